@@ -0,0 +1,100 @@
+"""
+benchmark_ann.py
+Compares the IVF approximate index against exact cosine search on synthetic catalogs.
+Reports build time, recall@k versus exact search and queries per second for several n_probe values.
+
+Example:
+    python scripts/benchmark_ann.py --sizes 100000 1000000 --dim 256 --n-probe 4 8 16 32
+"""
+
+# Standard library
+import argparse
+import json
+import os
+import sys
+import time
+
+# 3P Imports
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+from ann_index import IVFIndex
+from similarity import select_top_k
+from synthetic_catalog import synthetic_embeddings, synthetic_queries
+
+
+def exact_search(matrix, queries, top_k, batch_size=64):
+    """Ground-truth top-k by brute force over unit-norm vectors; returns results and queries/sec."""
+    results = []
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        for row in queries[start:start + batch_size] @ matrix.T:
+            results.append(select_top_k(row, -np.inf, top_k))
+    return results, len(queries) / (time.perf_counter() - started)
+
+
+def recall_at_k(truth, found):
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    total = sum(len(t) for t in truth)
+    return hits / total if total else 1.0
+
+
+def run(size, dim, n_queries, top_k, n_lists, n_probes, seed):
+    print(f"\n📦 Catalog: {size} x {dim}")
+    matrix = synthetic_embeddings(size, dim=dim, seed=seed)
+    queries = synthetic_queries(matrix, count=n_queries, seed=seed + 1)
+
+    truth, exact_qps = exact_search(matrix, queries, top_k)
+    print(f"   exact        qps={exact_qps:10.1f}")
+
+    started = time.perf_counter()
+    index = IVFIndex.build(matrix, n_lists=n_lists, seed=seed)
+    build_seconds = time.perf_counter() - started
+    print(f"   IVF build    lists={index.n_lists} time={build_seconds:.1f}s")
+
+    rows = []
+    for n_probe in n_probes:
+        started = time.perf_counter()
+        found = [index.search(query, threshold=-np.inf, top_k=top_k, n_probe=n_probe) for query in queries]
+        qps = len(queries) / (time.perf_counter() - started)
+        recall = recall_at_k(truth, found)
+        print(f"   IVF n_probe={n_probe:<4} qps={qps:10.1f} recall@{top_k}={recall:.3f} speedup={qps / exact_qps:.1f}x")
+        rows.append({"n_probe": n_probe, "qps": qps, f"recall@{top_k}": recall})
+
+    return {
+        "size": size,
+        "dim": dim,
+        "top_k": top_k,
+        "n_lists": index.n_lists,
+        "build_seconds": build_seconds,
+        "exact_qps": exact_qps,
+        "ivf": rows,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IVF recall and throughput against exact search")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    parser.add_argument("--dim", type=int, default=256, help="Vector width (3072 for text-embedding-3-large)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--n-lists", type=int, default=None, help="Default: about 4 * sqrt(size)")
+    parser.add_argument("--n-probe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = [
+        run(size, args.dim, args.queries, args.top_k, args.n_lists, args.n_probe, args.seed)
+        for size in args.sizes
+    ]
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
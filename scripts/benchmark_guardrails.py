@@ -0,0 +1,110 @@
+"""
+benchmark_guardrails.py
+Compares pairwise guardrail verification (one vision call per candidate) with batched mode (one call
+judging up to N candidates). Reports wall time, model calls and tokens per verified candidate, and
+how often each batched run agrees with the pairwise verdicts. Makes real API calls; the verdict cache
+is bypassed so every mode pays for its own calls.
+
+Example:
+    python scripts/benchmark_guardrails.py --reference data/sample_clothes/sample_images/1528.jpg --candidates 12 --batch-sizes 4 8
+"""
+
+# Standard library
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+from config import CATALOG_IMAGES_PATH, GUARDRAIL_IMAGE_MAX_EDGE, GUARDRAIL_MAX_CONCURRENCY
+from guardrails import guardrail_usage_stats, reset_guardrail_usage, verify_candidates
+from image_blob_store import get_image_blob_store
+from image_prep import prepare_image
+
+
+def load_candidates(image_dir, count, exclude, seed):
+    """Pick `count` catalog images and return (item_id, base64 payload) pairs, preferring the blob store."""
+    filenames = sorted(
+        name for name in os.listdir(image_dir)
+        if name.lower().endswith((".jpg", ".jpeg", ".png")) and os.path.join(image_dir, name) != exclude
+    )
+    random.Random(seed).shuffle(filenames)
+    blob_store = get_image_blob_store()
+    candidates = []
+    for filename in filenames[:count]:
+        item_id = os.path.splitext(filename)[0]
+        if blob_store is not None and item_id in blob_store:
+            candidates.append((item_id, blob_store.payload_base64(item_id)))
+        else:
+            candidates.append((item_id, prepare_image(os.path.join(image_dir, filename), max_edge=GUARDRAIL_IMAGE_MAX_EDGE).base64))
+    return candidates
+
+
+def run_mode(reference, candidates, batch_size, max_concurrency):
+    # No candidate ids: verdicts are neither read from nor written to the cache. Every candidate is
+    # checked so the modes' answers can be compared
+    reset_guardrail_usage()
+    started = time.perf_counter()
+    verdicts = dict(verify_candidates(reference, candidates, max_concurrency=max_concurrency, target_matches=None,
+                                        batch_size=batch_size))
+    seconds = time.perf_counter() - started
+    usage = guardrail_usage_stats()
+    matches = sum(verdict["answer"] == "yes" for verdict in verdicts.values())
+    return {
+        "batch_size": batch_size,
+        "seconds": seconds,
+        "calls": usage["calls"],
+        "fallbacks": usage["fallbacks"],
+        "matches": matches,
+        "prompt_tokens": usage["prompt_tokens"],
+        "completion_tokens": usage["completion_tokens"],
+        "tokens_per_candidate": usage["total_tokens"] / len(candidates),
+        "seconds_per_candidate": seconds / len(candidates),
+        "answers": {key: verdict["answer"] for key, verdict in verdicts.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched guardrail calls against pairwise check_match")
+    parser.add_argument("--reference", required=True, help="Reference image (the user's uploaded item)")
+    parser.add_argument("--images-dir", default=CATALOG_IMAGES_PATH)
+    parser.add_argument("--candidates", type=int, default=12)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[4, 8])
+    parser.add_argument("--max-concurrency", type=int, default=GUARDRAIL_MAX_CONCURRENCY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    reference = prepare_image(args.reference)
+    candidates = load_candidates(args.images_dir, args.candidates, args.reference, args.seed)
+    print(f"🧪 {len(candidates)} candidates against {args.reference}")
+
+    results = []
+    pairwise = None
+    for batch_size in [1] + [size for size in args.batch_sizes if size > 1]:
+        result = run_mode(reference, candidates, batch_size, args.max_concurrency)
+        if pairwise is None:
+            pairwise = result
+        agreement = sum(
+            result["answers"][key] == pairwise["answers"][key] for key in pairwise["answers"]
+        ) / len(pairwise["answers"])
+        result["agreement_with_pairwise"] = agreement
+        label = "pairwise" if batch_size == 1 else f"batch={batch_size}"
+        print(
+            f"   {label:<10} time={result['seconds']:6.1f}s calls={result['calls']:<3} fallbacks={result['fallbacks']:<2} "
+            f"tokens/candidate={result['tokens_per_candidate']:7.0f} matches={result['matches']:<3} agreement={agreement:.0%}"
+        )
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
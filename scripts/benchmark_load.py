@@ -0,0 +1,378 @@
+"""
+benchmark_load.py
+Concurrent-shopper load test of the full recommendation flow (prepare image -> analyze -> embed and
+search -> guardrail checks) against the offline fake model backend (providers.FakeProvider) with
+injected API latency, jitter and errors. For each concurrency level it reports throughput, end-to-end,
+service and queueing latency percentiles, per-stage latency percentiles (from the telemetry spans) and
+process memory over time, to find where p99 latency starts to degrade.
+
+Flows (--flow):
+    sequential  analyze_image, get_embeddings + search_many, then check_match one candidate at a time
+    threaded    as sequential, with verify_candidates checking GUARDRAIL_MAX_CONCURRENCY candidates at once
+    async       the streaming async pipeline (pipeline.recommend)
+
+Arrivals are open-loop Poisson at --rate requests/s (requests queue for one of --concurrency slots) or,
+without --rate, closed-loop: --concurrency shoppers each sending their next request as soon as the
+previous one finishes. Catalog, images, arrivals and fake responses are seeded, and every level starts
+from empty caches in a temporary directory, so runs are repeatable and levels comparable.
+The fake embeddings are unrelated to the catalog vectors, so --threshold defaults to -1 (take the top_k).
+
+Injected errors on embedding requests are retried by the tenacity policy in search_similar_items.py,
+which waits 1-40 s between attempts: with the real waits one error would add seconds to its request and
+the tail percentiles would measure the retry policy rather than the load. The wait is therefore shortened
+to at most --retry-wait-ms during the run; --production-retries keeps the real policy. (Analysis errors
+fail the request and guardrail errors give a "no" verdict; neither is retried.)
+
+Example:
+    python scripts/benchmark_load.py --flow sequential async --concurrency 1 4 16 --requests 60 --latency-ms 800
+    python scripts/benchmark_load.py --flow async --rate 4 --concurrency 32 --requests 200 --json load.json
+"""
+
+# Standard library
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import contextvars
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+# 3P Imports
+import numpy as np
+from PIL import Image, ImageDraw
+from tenacity import wait_random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+import analysis
+import embedding_cache
+import guardrails
+import search_similar_items
+from config import GUARDRAIL_BATCH_SIZE, GUARDRAIL_MAX_CONCURRENCY
+from filter_index import complementary_filter
+from image_prep import prepare_image
+from pipeline import recommend
+from providers import FakeProvider, set_provider
+from search_similar_items import CatalogSearchEngine, get_embeddings
+from synthetic_catalog import synthetic_catalog_frame
+from telemetry import get_registry, percentile, span
+
+FLOWS = ("sequential", "threaded", "async")
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def synthetic_photo(seed, size=(1024, 768)):
+    """JPEG bytes of a seeded product-photo-like image (flat background with a few coloured shapes)."""
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, tuple(rng.randrange(180, 256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(rng.randrange(3, 8)):
+        x0, y0 = rng.randrange(size[0] - 100), rng.randrange(size[1] - 100)
+        box = (x0, y0, x0 + rng.randrange(60, size[0] // 2), y0 + rng.randrange(60, size[1] // 2))
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        (draw.ellipse if rng.random() < 0.5 else draw.rectangle)(box, fill=colour)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+@contextlib.contextmanager
+def fresh_caches(enabled):
+    """Empty embedding / analysis / verdict caches in a temporary directory (or no caches at all)."""
+    modules = {
+        embedding_cache: ("EMBEDDING_CACHE_ENABLED", "EMBEDDING_CACHE_PATH", "_default_cache", "embeddings.sqlite3"),
+        analysis: ("ANALYSIS_CACHE_ENABLED", "ANALYSIS_CACHE_PATH", "_analysis_cache", "analyses.sqlite3"),
+        guardrails: ("GUARDRAIL_CACHE_ENABLED", "GUARDRAIL_CACHE_PATH", "_verdict_cache", "verdicts.sqlite3"),
+    }
+    saved = {module: {name: getattr(module, name) for name in names[:3]} for module, names in modules.items()}
+    with tempfile.TemporaryDirectory(prefix="load-test-") as directory:
+        for module, (enabled_name, path_name, instance_name, filename) in modules.items():
+            setattr(module, enabled_name, enabled)
+            setattr(module, path_name, os.path.join(directory, filename))
+            setattr(module, instance_name, None)
+        try:
+            yield
+        finally:
+            for module, values in saved.items():
+                for name, value in values.items():
+                    setattr(module, name, value)
+
+
+@contextlib.contextmanager
+def retry_wait(wait):
+    """Swap the wait of the embedding request retry policy (sync and async) for the block; None keeps it."""
+    if wait is None:
+        yield
+        return
+    functions = (search_similar_items._request_embeddings, search_similar_items._request_embeddings_async)
+    saved = [function.retry.wait for function in functions]
+    for function in functions:
+        function.retry.wait = wait
+    try:
+        yield
+    finally:
+        for function, previous in zip(functions, saved):
+            function.retry.wait = previous
+
+
+def rss_mb():
+    """Resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class Workload:
+    """Catalog, search engine, shopper images and candidate images shared by every request."""
+
+    def __init__(self, catalog_size, dim, requests, threshold, top_k, seed):
+        self.df = synthetic_catalog_frame(catalog_size, dim=dim, seed=seed)
+        self.engine = CatalogSearchEngine.from_dataframe(self.df)
+        self.subcategories = sorted(self.df["articleType"].unique())
+        self.threshold = threshold
+        self.top_k = top_k
+        self.uploads = [synthetic_photo(seed * 100003 + i) for i in range(requests)]
+        self.catalog_images = [synthetic_photo(-(seed * 100003 + i) - 1, size=(600, 800)) for i in range(32)]
+
+    def candidate_image(self, item):
+        """Guardrail payload loader for a match, prepared lazily like a catalog image file."""
+        data = self.catalog_images[int(item["id"]) % len(self.catalog_images)]
+        return lambda: prepare_image(data)
+
+
+def sync_request(workload, upload, flow):
+    """The synchronous flow; returns (matches, compatible)."""
+    image = prepare_image(upload)
+    result = json.loads(analysis.analyze_image(image, workload.subcategories))
+    filters = None
+    if result.get("gender") and result.get("category"):
+        filters = complementary_filter(result["gender"], result["category"])
+    descriptions = result.get("items", [])
+    if not descriptions:
+        return 0, 0
+    indices = workload.engine.search_many(
+        get_embeddings(descriptions), threshold=workload.threshold, top_k=workload.top_k, unique=True, filters=filters
+    )
+    items = [workload.df.iloc[i].to_dict() for row in indices for i in row]
+    if flow == "sequential":
+        verdicts = [
+            guardrails.parse_verdict(guardrails.check_match(image, workload.candidate_image(item)(), candidate_id=item["id"]))
+            for item in items
+        ]
+    else:
+        candidates = [(i, workload.candidate_image(item), item["id"]) for i, item in enumerate(items)]
+        verdicts = [verdict for _, verdict in guardrails.verify_candidates(
+            image, candidates, max_concurrency=GUARDRAIL_MAX_CONCURRENCY, batch_size=GUARDRAIL_BATCH_SIZE
+        )]
+    return len(items), sum(verdict["answer"] == "yes" for verdict in verdicts)
+
+
+async def async_request(workload, upload):
+    """The async pipeline; returns (matches, compatible)."""
+    image = await asyncio.to_thread(prepare_image, upload)
+    events = recommend(image, workload.subcategories, workload.df, workload.engine, threshold=workload.threshold,
+                       top_k=workload.top_k, target_matches=None, candidate_image=workload.candidate_image)
+    async for event in events:
+        if event["type"] == "error" and event["stage"] == "analysis":
+            raise RuntimeError(event["error"])
+        if event["type"] == "done":
+            return event["matches"], event["compatible"]
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {f"p{round(q * 100)}": percentile(ordered, q) * 1000 for q in QUANTILES} | {
+        "mean": float(np.mean(ordered)) * 1000 if ordered else 0.0
+    }
+
+
+async def run_level(workload, flow, concurrency, requests, rate, think_ms, seed, sample_seconds):
+    """One load level; every request is traced as a "load_request" telemetry span."""
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) if flow != "async" else None
+    slots = asyncio.Semaphore(concurrency)
+    records, timeline = [], []
+    state = {"in_flight": 0, "queued": 0, "next": 0}
+
+    def traced_sync(index):
+        with span("load_request", index=index) as root:
+            matches, compatible = sync_request(workload, workload.uploads[index], flow)
+        return matches, compatible, root.summary() or {"stages": {}, "totals": {}}
+
+    async def traced_async(index):
+        with span("load_request", index=index) as root:
+            matches, compatible = await async_request(workload, workload.uploads[index])
+        return matches, compatible, root.summary() or {"stages": {}, "totals": {}}
+
+    async def serve(index, arrival):
+        state["queued"] += 1
+        async with slots:
+            state["queued"] -= 1
+            state["in_flight"] += 1
+            started = time.perf_counter()
+            record = {"index": index, "queue_seconds": started - arrival, "error": None}
+            try:
+                if executor is not None:
+                    # A copy of the loop's context per request, so spans stay per request in the worker thread
+                    result = await loop.run_in_executor(executor, contextvars.copy_context().run, traced_sync, index)
+                else:
+                    result = await traced_async(index)
+                record["matches"], record["compatible"], summary = result
+                record["stages"] = {name: stage["seconds"] for name, stage in summary["stages"].items() if name != "load_request"}
+                record["cost_usd"] = summary["totals"].get("cost_usd", 0.0)
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            finished = time.perf_counter()
+            state["in_flight"] -= 1
+        record.update(service_seconds=finished - started, latency_seconds=finished - arrival,
+                      finished=finished - level_started)
+        records.append(record)
+
+    async def sample():
+        while True:
+            timeline.append({
+                "seconds": time.perf_counter() - level_started,
+                "rss_mb": rss_mb(),
+                "in_flight": state["in_flight"],
+                "queued": state["queued"],
+                "completed": len(records),
+            })
+            await asyncio.sleep(sample_seconds)
+
+    async def shopper():
+        # Closed loop: the next request is sent when the previous one is done (plus think time)
+        while state["next"] < requests:
+            index = state["next"]
+            state["next"] += 1
+            await serve(index, time.perf_counter())
+            if think_ms:
+                await asyncio.sleep(rng.expovariate(1000 / think_ms))
+
+    level_started = time.perf_counter()
+    sampler = asyncio.create_task(sample())
+    try:
+        if rate:
+            tasks, arrival = [], level_started
+            for index in range(requests):
+                arrival += rng.expovariate(rate)
+                await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+                tasks.append(asyncio.create_task(serve(index, arrival)))
+            await asyncio.gather(*tasks)
+        else:
+            await asyncio.gather(*(shopper() for _ in range(concurrency)))
+    finally:
+        sampler.cancel()
+        if executor is not None:
+            executor.shutdown(wait=True)
+    elapsed = time.perf_counter() - level_started
+    timeline.append({"seconds": elapsed, "rss_mb": rss_mb(), "in_flight": 0, "queued": 0, "completed": len(records)})
+    return records, timeline, elapsed
+
+
+def report(flow, concurrency, rate, records, timeline, elapsed, provider):
+    ok = [record for record in records if record["error"] is None]
+    stage_names = sorted({name for record in ok for name in record["stages"]})
+    result = {
+        "flow": flow,
+        "concurrency": concurrency,
+        "rate": rate,
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": summarize([record["latency_seconds"] for record in ok]),
+        "service_ms": summarize([record["service_seconds"] for record in ok]),
+        "queue_ms": summarize([record["queue_seconds"] for record in records]),
+        # Seconds spent in each stage's spans per request; concurrent spans (async flow) add up
+        "stage_ms": {name: summarize([record["stages"].get(name, 0.0) for record in ok]) for name in stage_names},
+        "matches_per_request": float(np.mean([record["matches"] for record in ok])) if ok else 0.0,
+        "cost_usd_per_request": float(np.mean([record["cost_usd"] for record in ok])) if ok else 0.0,
+        "rss_start_mb": timeline[0]["rss_mb"],
+        "rss_peak_mb": max(point["rss_mb"] for point in timeline),
+        "rss_growth_mb": timeline[-1]["rss_mb"] - timeline[0]["rss_mb"],
+        "fake_provider_calls": provider.stats(),
+        "timeline": timeline,
+        "errors_sample": sorted({record["error"] for record in records if record["error"]})[:5],
+    }
+    latency, queue = result["latency_ms"], result["queue_ms"]
+    print(f"   {flow:<10} c={concurrency:<4} {result['throughput_rps']:7.2f} req/s  "
+          f"p50={latency['p50']:8.0f}ms p95={latency['p95']:8.0f}ms p99={latency['p99']:8.0f}ms  "
+          f"queue p99={queue['p99']:7.0f}ms  errors={result['errors']:<3} "
+          f"rss {result['rss_start_mb']:.0f}->{timeline[-1]['rss_mb']:.0f}MB")
+    print("              " + "  ".join(f"{name} p95={values['p95']:.0f}ms" for name, values in result["stage_ms"].items()))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-shopper load test against the fake model backend")
+    parser.add_argument("--flow", nargs="+", choices=FLOWS, default=["sequential", "async"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16],
+                        help="Concurrent requests (shoppers in closed-loop mode); one run per value")
+    parser.add_argument("--rate", type=float, help="Open-loop Poisson arrival rate in requests/s (default: closed loop)")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a shopper's requests (closed loop)")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per run")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="Injected latency per model call")
+    parser.add_argument("--jitter-ms", type=float, default=200.0, help="Uniform extra latency per model call, up to")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of model calls that fail")
+    parser.add_argument("--retry-wait-ms", type=float, default=100.0,
+                        help="Longest wait before retrying a failed embedding request (see above)")
+    parser.add_argument("--production-retries", action="store_true",
+                        help="Keep the real 1-40 s embedding retry waits")
+    parser.add_argument("--catalog-size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=3072, help="Embedding width (3072 for text-embedding-3-large)")
+    parser.add_argument("--threshold", type=float, default=-1.0)
+    parser.add_argument("--top-k", type=int, default=2)
+    parser.add_argument("--no-cache", action="store_true", help="Disable the embedding / analysis / verdict caches")
+    parser.add_argument("--sample-seconds", type=float, default=0.5, help="Memory / queue sampling interval")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    print(f"📦 Catalog: {args.catalog_size} x {args.dim}, {args.requests} shopper images")
+    workload = Workload(args.catalog_size, args.dim, args.requests, args.threshold, args.top_k, args.seed)
+    mode = f"open loop at {args.rate} req/s" if args.rate else "closed loop"
+    print(f"🚦 {mode}, fake API latency {args.latency_ms:.0f}ms (+{args.jitter_ms:.0f}ms jitter), "
+          f"error rate {args.error_rate:.1%}")
+    if args.error_rate and not args.production_retries:
+        print(f"🔁 Embedding retries wait up to {args.retry_wait_ms:.0f}ms (--production-retries for 1-40 s)")
+    wait = None if args.production_retries else wait_random(0, args.retry_wait_ms / 1000)
+
+    results = []
+    for flow in args.flow:
+        for concurrency in args.concurrency:
+            provider = FakeProvider(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                                    dim=args.dim, seed=args.seed)
+            previous = set_provider(provider)
+            get_registry().reset()
+            try:
+                with fresh_caches(enabled=not args.no_cache), retry_wait(wait):
+                    records, timeline, elapsed = asyncio.run(run_level(
+                        workload, flow, concurrency, args.requests, args.rate, args.think_ms, args.seed,
+                        args.sample_seconds,
+                    ))
+            finally:
+                set_provider(previous)
+            result = report(flow, concurrency, args.rate, records, timeline, elapsed, provider)
+            result["metrics"] = get_registry().snapshot()
+            results.append(result)
+
+    if args.json:
+        settings = {name: value for name, value in vars(args).items() if name != "json"}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
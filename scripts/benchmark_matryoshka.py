@@ -0,0 +1,122 @@
+"""
+benchmark_matryoshka.py
+Compares full-width exact search with two-stage Matryoshka search (first stage on truncated,
+re-normalized vectors, full-precision re-rank of a shortlist) for several truncation widths.
+Reports recall@k against exact search with and without re-ranking, per-query latency and the memory
+held by the first-stage matrix. Runs on a synthetic catalog, or on a built embedding store with --store.
+
+Example:
+    python scripts/benchmark_matryoshka.py --size 100000 --dim 3072 --dims 256 512 --rerank 50 100 200
+    python scripts/benchmark_matryoshka.py --store data/sample_clothes/sample_styles_store --dims 256 512
+"""
+
+# Standard library
+import argparse
+import json
+import os
+import sys
+import time
+
+# 3P Imports
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+from embedding_store import open_store_matrix, open_truncated_matrix
+from search_similar_items import CatalogSearchEngine
+from similarity import select_top_k
+from synthetic_catalog import synthetic_embeddings, synthetic_queries
+
+
+def timed_search(engine, queries, top_k):
+    """Search one query at a time (as the app does); returns results and per-query latencies in ms."""
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(engine.search(query, threshold=-np.inf, top_k=top_k))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, np.array(latencies)
+
+
+def recall_at_k(truth, found):
+    hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+    total = sum(len(t) for t in truth)
+    return hits / total if total else 1.0
+
+
+def latency_summary(latencies):
+    return {
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "qps": float(len(latencies) / (latencies.sum() / 1000)),
+    }
+
+
+def run(matrix, queries, dims_list, reranks, top_k, store=None):
+    size, dim = matrix.shape
+    print(f"\n📦 Catalog: {size} x {dim}, {len(queries)} queries, top_k={top_k}")
+
+    exact = CatalogSearchEngine(matrix)
+    truth, latencies = timed_search(exact, queries, top_k)
+    baseline = {"dims": dim, "rerank": None, f"recall@{top_k}": 1.0,
+                "search_matrix_mb": exact.matrix.nbytes / 2**20, **latency_summary(latencies)}
+    print(f"   full {dim:<5}        p50={baseline['p50_ms']:7.2f}ms qps={baseline['qps']:8.1f} "
+          f"memory={baseline['search_matrix_mb']:8.1f}MB")
+    rows = [baseline]
+    del exact
+
+    for dims in dims_list:
+        if dims >= dim:
+            continue
+        search_matrix = open_truncated_matrix(store, dims) if store else None
+        # Ranking by the truncated vectors alone shows what the re-rank recovers
+        first_stage = CatalogSearchEngine(matrix, search_dims=dims, search_matrix=search_matrix)
+        found = [select_top_k(row, -np.inf, top_k) for row in first_stage.score(queries)]
+        no_rerank = recall_at_k(truth, found)
+        print(f"   {dims}-dim first stage only   recall@{top_k}={no_rerank:.3f}")
+
+        for rerank in reranks:
+            first_stage.rerank_candidates = rerank
+            found, latencies = timed_search(first_stage, queries, top_k)
+            result = {"dims": dims, "rerank": rerank, f"recall@{top_k}": recall_at_k(truth, found),
+                      f"recall@{top_k}_no_rerank": no_rerank,
+                      "search_matrix_mb": first_stage.matrix.nbytes / 2**20, **latency_summary(latencies)}
+            print(f"   {dims:<4} rerank={rerank:<5} p50={result['p50_ms']:7.2f}ms qps={result['qps']:8.1f} "
+                  f"memory={result['search_matrix_mb']:8.1f}MB recall@{top_k}={result[f'recall@{top_k}']:.3f} "
+                  f"speedup={baseline['p50_ms'] / result['p50_ms']:.1f}x")
+            rows.append(result)
+    return {"size": size, "dim": dim, "top_k": top_k, "results": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Matryoshka truncation with full-precision re-ranking")
+    parser.add_argument("--store", help="Embedding store to benchmark instead of a synthetic catalog")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=3072, help="Synthetic vector width (3072 for text-embedding-3-large)")
+    parser.add_argument("--decay", type=float, default=0.5,
+                        help="Synthetic per-dimension variance decay; 0.5 resembles Matryoshka-trained embeddings")
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 512])
+    parser.add_argument("--rerank", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.store:
+        matrix = open_store_matrix(args.store)
+        queries = synthetic_queries(matrix, count=args.queries, seed=args.seed + 1)
+    else:
+        matrix = synthetic_embeddings(args.size, dim=args.dim, seed=args.seed, decay=args.decay)
+        queries = synthetic_queries(matrix, count=args.queries, seed=args.seed + 1, decay=args.decay)
+
+    result = run(matrix, queries, args.dims, args.rerank, args.top_k, store=args.store)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
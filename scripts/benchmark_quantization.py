@@ -0,0 +1,126 @@
+"""
+benchmark_quantization.py
+Compares int8 and binary quantized indexes against exact cosine search. For each quantization and
+rescoring depth it reports recall@2 and recall@10 versus exact search (with and without the float
+rescoring step), per-query latency, and the memory held by the codes versus the float32 matrix.
+Runs on a synthetic catalog, or on a built embedding store with --store.
+
+Example:
+    python scripts/benchmark_quantization.py --size 200000 --dim 3072 --rescore 50 200 500
+    python scripts/benchmark_quantization.py --store data/sample_clothes/sample_styles_store
+"""
+
+# Standard library
+import argparse
+import json
+import os
+import sys
+import time
+
+# 3P Imports
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+from embedding_store import open_store_matrix
+from quantized_index import KINDS, QuantizedIndex
+from similarity import normalize_rows, select_top_k
+from synthetic_catalog import synthetic_embeddings, synthetic_queries
+
+RECALL_AT = (2, 10)
+
+
+def exact_search(matrix, queries, top_k):
+    """Ground-truth top-k by brute force; returns results and per-query latencies in ms."""
+    normalized = normalize_rows(np.asarray(matrix, dtype=np.float32))
+    results, latencies = [], []
+    for query in normalize_rows(queries):
+        started = time.perf_counter()
+        results.append(select_top_k(normalized @ query, -np.inf, top_k))
+        latencies.append((time.perf_counter() - started) * 1000)
+    return results, np.array(latencies), normalized.nbytes
+
+
+def recall_at_k(truth, found, k):
+    hits = sum(len(set(t[:k]) & set(f[:k])) for t, f in zip(truth, found))
+    total = sum(len(t[:k]) for t in truth)
+    return hits / total if total else 1.0
+
+
+def run(matrix, queries, kinds, depths):
+    size, dim = matrix.shape
+    top_k = max(RECALL_AT)
+    print(f"\n📦 Catalog: {size} x {dim}, {len(queries)} queries")
+
+    truth, latencies, float_bytes = exact_search(matrix, queries, top_k)
+    exact = {"kind": "float32", "memory_mb": float_bytes / 2**20, "p50_ms": float(np.percentile(latencies, 50))}
+    print(f"   float32  exact              p50={exact['p50_ms']:7.2f}ms memory={exact['memory_mb']:8.1f}MB")
+
+    rows = []
+    for kind in kinds:
+        started = time.perf_counter()
+        index = QuantizedIndex.build(matrix, kind=kind)
+        build_seconds = time.perf_counter() - started
+
+        # Ranking by the codes alone shows what the rescoring step recovers
+        found = [select_top_k(index.approximate_scores(query), -np.inf, top_k) for query in queries]
+        no_rescore = {f"recall@{k}": recall_at_k(truth, found, k) for k in RECALL_AT}
+        print(f"   {kind:<8} build={build_seconds:5.1f}s memory={index.nbytes / 2**20:8.1f}MB "
+              f"({float_bytes / index.nbytes:.0f}x smaller) codes only: "
+              + " ".join(f"{name}={value:.3f}" for name, value in no_rescore.items()))
+
+        for depth in depths:
+            found, latencies = [], []
+            for query in queries:
+                started = time.perf_counter()
+                found.append(index.search(query, threshold=-np.inf, top_k=top_k, shortlist=depth))
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies = np.array(latencies)
+            recall = {f"recall@{k}": recall_at_k(truth, found, k) for k in RECALL_AT}
+            result = {
+                "kind": kind,
+                "rescore": depth,
+                "build_seconds": build_seconds,
+                "memory_mb": index.nbytes / 2**20,
+                "compression": float_bytes / index.nbytes,
+                **recall,
+                **{f"{name}_codes_only": value for name, value in no_rescore.items()},
+                "p50_ms": float(np.percentile(latencies, 50)),
+                "p95_ms": float(np.percentile(latencies, 95)),
+            }
+            print(f"   {kind:<8} rescore={depth:<5} p50={result['p50_ms']:7.2f}ms "
+                  + " ".join(f"{name}={value:.3f}" for name, value in recall.items()))
+            rows.append(result)
+    return {"size": size, "dim": dim, "exact": exact, "results": rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark int8 / binary quantized search against exact cosine")
+    parser.add_argument("--store", help="Embedding store to benchmark instead of a synthetic catalog")
+    parser.add_argument("--size", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=3072, help="Synthetic vector width (3072 for text-embedding-3-large)")
+    parser.add_argument("--decay", type=float, default=0.5, help="Synthetic per-dimension variance decay")
+    parser.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS))
+    parser.add_argument("--rescore", type=int, nargs="+", default=[50, 200, 500], help="Shortlist sizes to rescore")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.store:
+        matrix = open_store_matrix(args.store)
+        queries = synthetic_queries(matrix, count=args.queries, seed=args.seed + 1)
+    else:
+        matrix = synthetic_embeddings(args.size, dim=args.dim, seed=args.seed, decay=args.decay)
+        queries = synthetic_queries(matrix, count=args.queries, seed=args.seed + 1, decay=args.decay)
+
+    result = run(matrix, queries, args.kinds, args.rescore)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\n💾 Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
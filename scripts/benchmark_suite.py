@@ -0,0 +1,365 @@
+"""
+benchmark_suite.py
+Microbenchmarks for the hot paths of the app on synthetic catalogs (1k to 1M items, in the
+sample_styles_with_embeddings.csv schema): catalog loading through load_clothing_data (embedding
+store and CSV fallback), search engine construction, find_similar_items, find_matching_items_with_rag
+(with the embeddings API stubbed out) and the base64 image encoding paths. Each benchmark records wall
+time, peak traced memory and throughput; results are written as JSON, and `compare` flags regressions
+between two result files. No API calls are made.
+
+Example:
+    python scripts/benchmark_suite.py run --sizes 1000 10000 100000 --output baseline.json
+    python scripts/benchmark_suite.py run --sizes 1000 10000 100000 --output current.json
+    python scripts/benchmark_suite.py compare baseline.json current.json --threshold 0.1
+"""
+
+# Standard library
+import argparse
+import base64
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 3P Imports
+import numpy as np
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+import data_loader
+import search_similar_items
+from config import GUARDRAIL_IMAGE_MAX_EDGE, IMAGE_MAX_EDGE, THUMBNAIL_MAX_EDGE
+from embedding_store import EmbeddingStoreWriter, MANIFEST_FILENAME, read_manifest
+from filter_index import complementary_filter
+from image_blob_store import ImageBlobStore, build_image_blob_store
+from image_prep import prepare_image
+from search_similar_items import CatalogSearchEngine, find_matching_items_with_rag, find_similar_items
+from synthetic_catalog import synthetic_catalog_frame, synthetic_queries, write_synthetic_catalog_csv
+
+RESULTS_FORMAT = "retailnext-benchmarks"
+RESULTS_VERSION = 1
+DEFAULT_DATA_DIR = ".cache/benchmarks"
+_CHUNK_ROWS = 50000
+
+
+def measure(name, size, function, items, unit, repeat):
+    """
+    Run `function` once under tracemalloc for its peak allocation, then `repeat` times untraced for
+    wall time (tracing slows Python-heavy code down). Throughput is `items` per median second.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        tracemalloc.start()
+        try:
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - started)
+
+    median = statistics.median(timings)
+    result = {
+        "name": name,
+        "size": size,
+        "runs": repeat,
+        "wall_seconds": median,
+        "wall_seconds_min": min(timings),
+        "peak_memory_mb": peak / 2**20,
+        "throughput": items / median if median > 0 else None,
+        "unit": unit,
+    }
+    print(f"   {name:<40} size={size:<8} {median * 1000:10.2f}ms  peak={result['peak_memory_mb']:9.1f}MB  "
+          f"{result['throughput'] or 0:12.1f} {unit}")
+    return result
+
+
+@contextlib.contextmanager
+def patched(module, **attributes):
+    """Temporarily replace module attributes (restored on exit)."""
+    saved = {name: getattr(module, name) for name in attributes}
+    for name, value in attributes.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def fake_embeddings(texts, dim):
+    """Deterministic unit vectors per text, standing in for the embeddings API."""
+    vectors = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+        vectors.append((vector / np.linalg.norm(vector)).tolist())
+    return vectors
+
+
+# === Synthetic data ===
+
+def catalog_paths(data_dir, size, dim, seed):
+    base = os.path.join(data_dir, f"catalog-{size}x{dim}-s{seed}")
+    return base + "_store", base + ".csv"
+
+
+def ensure_store(path, size, dim, seed):
+    """Synthetic embedding store, reused across runs when one with the same shape exists."""
+    if os.path.exists(os.path.join(path, MANIFEST_FILENAME)) and read_manifest(path)["rows"] == size:
+        return path
+    with EmbeddingStoreWriter(path, model="synthetic") as writer:
+        for start in range(0, size, _CHUNK_ROWS):
+            chunk = synthetic_catalog_frame(min(_CHUNK_ROWS, size - start), dim=dim, seed=seed + start,
+                                            start_id=start + 1)
+            writer.append(chunk, np.stack(chunk["embeddings"].to_numpy()))
+    return path
+
+
+def ensure_csv(path, size, dim, seed):
+    """Synthetic sample_styles_with_embeddings.csv, reused across runs when present."""
+    if not os.path.exists(path):
+        write_synthetic_catalog_csv(path + ".partial", size, dim=dim, seed=seed, chunk_size=_CHUNK_ROWS)
+        os.replace(path + ".partial", path)
+    return path
+
+
+def ensure_images(path, count, seed, size=(1080, 1440)):
+    """Synthetic catalog-photo-sized JPEGs (smooth gradients plus noise, so they compress realistically)."""
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    width, height = size
+    gradient = np.linspace(0, 1, width, dtype=np.float32)[None, :, None] * np.linspace(0.3, 1, height, dtype=np.float32)[:, None, None]
+    for number in range(count):
+        filename = os.path.join(path, f"{number + 1}.jpg")
+        if os.path.exists(filename):
+            continue
+        colour = rng.uniform(40, 215, 3).astype(np.float32)
+        pixels = gradient * colour + rng.normal(0, 12, (height, width, 3)).astype(np.float32)
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(filename, format="JPEG", quality=92)
+    return path
+
+
+# === Benchmarks ===
+
+def catalog_benchmarks(size, dim, queries, repeat, data_dir, seed, csv_max_size):
+    store_path, csv_path = catalog_paths(data_dir, size, dim, seed)
+    print(f"\n📦 Catalog: {size} x {dim}")
+    ensure_store(store_path, size, dim, seed)
+    results = []
+
+    # load_clothing_data as the app calls it, from the embedding store ...
+    with patched(data_loader, EMBEDDING_STORE_PATH=store_path):
+        results.append(measure("load_clothing_data[store]", size, data_loader.load_clothing_data, size, "rows/s", repeat))
+        with contextlib.redirect_stdout(io.StringIO()):
+            df_items = data_loader.load_clothing_data()
+
+    # ... and through its CSV fallback (remote download disabled, local file = synthetic CSV)
+    if size <= csv_max_size:
+        ensure_csv(csv_path, size, dim, seed)
+
+        def offline(*args, **kwargs):
+            raise OSError("remote catalog disabled for benchmarking")
+
+        missing_store = os.path.join(data_dir, "no-store")
+        with patched(data_loader, EMBEDDING_STORE_PATH=missing_store, LOCAL_DATA_PATH=csv_path,
+                     fetch_remote_catalog=offline):
+            results.append(measure("load_clothing_data[csv]", size, data_loader.load_clothing_data, size, "rows/s", repeat))
+
+    results.append(measure("CatalogSearchEngine.from_dataframe", size,
+                           lambda: CatalogSearchEngine.from_dataframe(df_items), size, "rows/s", repeat))
+    engine = CatalogSearchEngine.from_dataframe(df_items)
+    matrix = engine.matrix
+    query_vectors = synthetic_queries(matrix, count=queries, seed=seed + 1)
+
+    results.append(measure("find_similar_items[engine]", size,
+                           lambda: [find_similar_items(query, engine, threshold=-1, top_k=2) for query in query_vectors],
+                           len(query_vectors), "queries/s", repeat))
+
+    # The list-of-vectors call rebuilds the catalog matrix every time, so a few queries suffice
+    embeddings = df_items["embeddings"].tolist()
+    few = query_vectors[:max(1, min(5, queries))]
+    results.append(measure("find_similar_items[list]", size,
+                           lambda: [find_similar_items(query, embeddings, threshold=-1, top_k=2) for query in few],
+                           len(few), "queries/s", repeat))
+
+    descriptions = [f"{colour} {article}" for colour, article in
+                    zip(("Navy Blue", "White", "Brown", "Black", "Beige"), ("Jeans", "Tshirts", "Belts", "Casual Shoes", "Jackets"))]
+    item_filter = complementary_filter("Men", "Shirts")
+    with patched(search_similar_items, get_embeddings=lambda texts: fake_embeddings(texts, dim)):
+        results.append(measure("find_matching_items_with_rag", size,
+                               lambda: find_matching_items_with_rag(df_items, descriptions, engine=engine),
+                               1, "calls/s", repeat))
+        results.append(measure("find_matching_items_with_rag[filtered]", size,
+                               lambda: find_matching_items_with_rag(df_items, descriptions, engine=engine, filters=item_filter),
+                               1, "calls/s", repeat))
+    return results
+
+
+def image_benchmarks(count, repeat, data_dir, seed):
+    image_dir = ensure_images(os.path.join(data_dir, f"images-{count}-s{seed}"), count, seed)
+    paths = [os.path.join(image_dir, f"{number + 1}.jpg") for number in range(count)]
+    print(f"\n🖼️  Images: {count} synthetic JPEGs")
+    results = []
+
+    def raw_base64():
+        # Whole-file encoding, as the demo did before images were prepared
+        for path in paths:
+            with open(path, "rb") as f:
+                base64.b64encode(f.read()).decode("utf-8")
+
+    results.append(measure("base64[raw file]", count, raw_base64, count, "images/s", repeat))
+    results.append(measure("prepare_image[analysis]", count,
+                           lambda: [prepare_image(path, max_edge=IMAGE_MAX_EDGE).base64 for path in paths],
+                           count, "images/s", repeat))
+    results.append(measure("prepare_image[guardrail]", count,
+                           lambda: [prepare_image(path, max_edge=GUARDRAIL_IMAGE_MAX_EDGE).base64 for path in paths],
+                           count, "images/s", repeat))
+
+    blob_dir = tempfile.mkdtemp(prefix="blob-store-")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            build_image_blob_store(image_dir, blob_dir, payload_max_edge=GUARDRAIL_IMAGE_MAX_EDGE,
+                                   thumbnail_max_edge=THUMBNAIL_MAX_EDGE)
+        store = ImageBlobStore(blob_dir)
+        ids = [str(number + 1) for number in range(count)]
+        results.append(measure("ImageBlobStore.payload_base64", count,
+                               lambda: [store.payload_base64(item_id) for item_id in ids], count, "images/s", repeat))
+        store.close()
+    finally:
+        shutil.rmtree(blob_dir, ignore_errors=True)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(args):
+    results = []
+    for size in args.sizes:
+        results += catalog_benchmarks(size, args.dim, args.queries, args.repeat, args.data_dir, args.seed, args.csv_max_size)
+    if args.images:
+        results += image_benchmarks(args.images, args.repeat, args.data_dir, args.seed)
+
+    report = {
+        "format": RESULTS_FORMAT,
+        "version": RESULTS_VERSION,
+        "environment": environment(),
+        "config": {"sizes": args.sizes, "dim": args.dim, "queries": args.queries, "repeat": args.repeat,
+                   "images": args.images, "seed": args.seed},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 {len(results)} results written to {args.output}")
+    return 0
+
+
+# === Compare ===
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if report.get("format") != RESULTS_FORMAT:
+        raise SystemExit(f"❌ {path} is not a benchmark results file")
+    return {(result["name"], result["size"]): result for result in report["results"]}, report
+
+
+def compare(args):
+    baseline, baseline_report = load_results(args.baseline)
+    current, current_report = load_results(args.current)
+    if baseline_report["config"].get("dim") != current_report["config"].get("dim"):
+        print("⚠️  Result files were produced with different embedding widths; timings are not comparable")
+
+    # The fastest run is the least disturbed by other load on the machine, so it is compared by default
+    statistic = "wall_seconds_min" if args.statistic == "min" else "wall_seconds"
+    regressions = 0
+    print(f"{'benchmark':<40} {'size':>8} {'baseline':>11} {'current':>11} {'time':>8} {'memory':>8}")
+    for key in sorted(baseline.keys() & current.keys(), key=lambda key: (key[1], key[0])):
+        before, after = baseline[key], current[key]
+        time_change = after[statistic] / before[statistic] - 1 if before[statistic] else 0.0
+        memory_change = (after["peak_memory_mb"] / before["peak_memory_mb"] - 1) if before["peak_memory_mb"] else 0.0
+        slower = (time_change > args.threshold
+                  and after[statistic] - before[statistic] > args.min_seconds)
+        bigger = (memory_change > args.memory_threshold
+                  and after["peak_memory_mb"] - before["peak_memory_mb"] > args.min_memory_mb)
+        flag = "❌" if slower or bigger else "✅"
+        regressions += slower or bigger
+        print(f"{key[0]:<40} {key[1]:>8} {before[statistic] * 1000:9.2f}ms {after[statistic] * 1000:9.2f}ms "
+              f"{time_change:+8.1%} {memory_change:+8.1%} {flag}")
+
+    for missing, path in ((baseline.keys() - current.keys(), args.current), (current.keys() - baseline.keys(), args.baseline)):
+        if missing:
+            print(f"⚠️  {len(missing)} benchmark(s) not in {path}: "
+                  + ", ".join(f"{name}@{size}" for name, size in sorted(missing)))
+    if regressions:
+        print(f"\n❌ {regressions} regression(s) beyond {args.threshold:.0%} time / {args.memory_threshold:.0%} memory")
+        return 1
+    print("\n✅ No regressions")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks for catalog loading, search and image preparation")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks and write a JSON results file")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                            help="Synthetic catalog sizes (up to 1000000)")
+    run_parser.add_argument("--dim", type=int, default=256, help="Embedding width (3072 for text-embedding-3-large)")
+    run_parser.add_argument("--queries", type=int, default=50, help="Queries per find_similar_items run")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark (the median is reported)")
+    run_parser.add_argument("--images", type=int, default=20, help="Synthetic images for the encoding benchmarks (0 = skip)")
+    run_parser.add_argument("--csv-max-size", type=int, default=100000,
+                            help="Largest catalog also benchmarked through the CSV fallback (CSV text is ~20x the store)")
+    run_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where synthetic catalogs are generated and reused")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions between two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10, help="Allowed wall time increase (0.10 = 10%%)")
+    compare_parser.add_argument("--statistic", choices=("min", "median"), default="min",
+                                help="Wall time statistic to compare")
+    compare_parser.add_argument("--memory-threshold", type=float, default=0.10, help="Allowed peak memory increase")
+    compare_parser.add_argument("--min-seconds", type=float, default=0.001,
+                                help="Ignore time increases smaller than this (timer noise)")
+    compare_parser.add_argument("--min-memory-mb", type=float, default=1.0, help="Ignore memory increases smaller than this")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        os.makedirs(args.data_dir, exist_ok=True)
+        sys.exit(run(args))
+    sys.exit(compare(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+build_image_blobs.py
+Offline build step that pre-encodes every catalog image into the packed image blob store: a
+guardrail-ready base64 payload and a UI thumbnail per item, served by memory-mapped slices at request time.
+"""
+
+# Standard library
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+from config import CATALOG_IMAGES_PATH, GUARDRAIL_IMAGE_MAX_EDGE, IMAGE_BLOB_STORE_PATH, THUMBNAIL_MAX_EDGE
+from image_blob_store import build_image_blob_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack pre-encoded catalog images into a memory-mapped blob store")
+    parser.add_argument("--images", default=CATALOG_IMAGES_PATH, help="Directory of <id>.jpg catalog images")
+    parser.add_argument("--out", default=IMAGE_BLOB_STORE_PATH, help="Destination blob store directory")
+    parser.add_argument("--payload-max-edge", type=int, default=GUARDRAIL_IMAGE_MAX_EDGE)
+    parser.add_argument("--thumbnail-max-edge", type=int, default=THUMBNAIL_MAX_EDGE)
+    args = parser.parse_args()
+
+    print(f"🔄 Packing {args.images} -> {args.out}")
+    build_image_blob_store(
+        args.images,
+        args.out,
+        payload_max_edge=args.payload_max_edge,
+        thumbnail_max_edge=args.thumbnail_max_edge,
+    )
+
+
+if __name__ == "__main__":
+    main()
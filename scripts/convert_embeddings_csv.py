@@ -0,0 +1,34 @@
+"""
+convert_embeddings_csv.py
+One-shot converter from the legacy sample_styles_with_embeddings.csv (embeddings stored as text)
+to the binary, memory-mapped embedding store read by data_loader.
+"""
+
+# Standard library
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local Application Imports
+from config import EMBEDDING_MODEL, EMBEDDING_STORE_PATH, LOCAL_DATA_PATH
+from embedding_store import convert_csv_to_store, verify_embedding_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert an embeddings CSV into a binary embedding store")
+    parser.add_argument("--csv", default=LOCAL_DATA_PATH, help="Source CSV with an 'embeddings' column")
+    parser.add_argument("--out", default=EMBEDDING_STORE_PATH, help="Destination embedding store directory")
+    parser.add_argument("--model", default=EMBEDDING_MODEL, help="Embedding model recorded in the manifest")
+    parser.add_argument("--chunksize", type=int, default=2000, help="CSV rows parsed per chunk")
+    args = parser.parse_args()
+
+    print(f"🔄 Converting {args.csv} -> {args.out}")
+    manifest = convert_csv_to_store(args.csv, args.out, model=args.model, chunksize=args.chunksize)
+    verify_embedding_store(args.out, manifest)
+    print(f"✅ Wrote {manifest['rows']} x {manifest['dim']} embeddings (format v{manifest['version']}, checksums verified)")
+
+
+if __name__ == "__main__":
+    main()
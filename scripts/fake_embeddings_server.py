@@ -0,0 +1,180 @@
+"""
+fake_embeddings_server.py
+Local stand-in for the OpenAI embeddings endpoint that enforces requests-per-minute and
+tokens-per-minute limits like the real API: over-limit requests get a 429 with retry-after, and every
+response carries x-ratelimit-* headers. Vectors are deterministic per input, so results are stable
+across runs. Use it to exercise batching and adaptive concurrency without spending quota.
+
+Example:
+    python scripts/fake_embeddings_server.py --rpm 300 --tpm 200000 --dim 3072
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python scripts/generate_embeddings.py
+"""
+
+# Standard library
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 3P Imports
+import numpy as np
+
+
+def fake_embedding(item, dim):
+    """Unit-length float32 vector derived from a hash of the input (text or token list)."""
+    seed = int.from_bytes(hashlib.sha256(json.dumps(item).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def count_tokens(item):
+    # Token lists are exact; text is approximated at 4 characters per token
+    if isinstance(item, list):
+        return len(item)
+    return max(1, len(str(item)) // 4)
+
+
+class RateLimits:
+    """Sliding one-minute request and token windows shared by all handler threads."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.accepted = 0
+        self.rejected = 0
+        self._window = deque()
+        self._window_tokens = 0
+        self._lock = threading.Lock()
+
+    def admit(self, tokens):
+        """Returns (accepted, headers)."""
+        with self._lock:
+            now = time.monotonic()
+            while self._window and self._window[0][0] <= now - 60:
+                self._window_tokens -= self._window.popleft()[1]
+
+            over_requests = len(self._window) + 1 > self.requests_per_minute
+            over_tokens = self._window_tokens + tokens > self.tokens_per_minute and bool(self._window)
+            accepted = not (over_requests or over_tokens)
+            if accepted:
+                self._window.append((now, tokens))
+                self._window_tokens += tokens
+                self.accepted += 1
+            else:
+                self.rejected += 1
+
+            # Time until the oldest request leaves the window, the earliest moment anything frees up
+            reset = max(0.0, self._window[0][0] + 60 - now) if self._window else 0.0
+            headers = {
+                "x-ratelimit-limit-requests": str(self.requests_per_minute),
+                "x-ratelimit-limit-tokens": str(self.tokens_per_minute),
+                "x-ratelimit-remaining-requests": str(max(0, self.requests_per_minute - len(self._window))),
+                "x-ratelimit-remaining-tokens": str(max(0, self.tokens_per_minute - self._window_tokens)),
+                "x-ratelimit-reset-requests": f"{reset:.3f}s",
+                "x-ratelimit-reset-tokens": f"{reset:.3f}s",
+            }
+            if not accepted:
+                headers["retry-after-ms"] = str(int(reset * 1000) + 1)
+            return accepted, headers
+
+
+def make_handler(limits, dim, latency_ms, max_request_tokens):
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/embeddings"):
+                self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            inputs = request["input"]
+            # A single string or a single token list is one input
+            if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+                inputs = [inputs]
+            tokens = sum(count_tokens(item) for item in inputs)
+            if tokens > max_request_tokens:
+                self._send(400, {"error": {
+                    "message": f"Request has {tokens} tokens, the limit is {max_request_tokens}",
+                    "type": "invalid_request_error",
+                }})
+                return
+
+            accepted, headers = limits.admit(tokens)
+            if not accepted:
+                self._send(429, {"error": {
+                    "message": "Rate limit reached, please try again later",
+                    "type": "requests",
+                    "code": "rate_limit_exceeded",
+                }}, headers)
+                return
+
+            time.sleep(latency_ms / 1000 * (1 + tokens / 10000))
+            data = []
+            for index, item in enumerate(inputs):
+                vector = fake_embedding(item, request.get("dimensions") or dim)
+                if request.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+                else:
+                    embedding = vector.tolist()
+                data.append({"object": "embedding", "index": index, "embedding": embedding})
+            self._send(200, {
+                "object": "list",
+                "data": data,
+                "model": request.get("model"),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }, headers)
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=8089, requests_per_minute=500, tokens_per_minute=1000000, dim=3072,
+          latency_ms=50, max_request_tokens=300000):
+    """Start the server in a background thread; returns (server, RateLimits). Stop with server.shutdown()."""
+    limits = RateLimits(requests_per_minute, tokens_per_minute)
+    server = ThreadingHTTPServer((host, port), make_handler(limits, dim, latency_ms, max_request_tokens))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-embeddings", daemon=True).start()
+    return server, limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI embeddings endpoint with rate limits")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--rpm", type=int, default=500, help="Requests per minute")
+    parser.add_argument("--tpm", type=int, default=1000000, help="Tokens per minute")
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--max-request-tokens", type=int, default=300000)
+    args = parser.parse_args()
+
+    server, limits = serve(args.host, args.port, args.rpm, args.tpm, args.dim, args.latency_ms, args.max_request_tokens)
+    print(f"🧪 Fake embeddings API on http://{args.host}:{args.port}/v1 (rpm={args.rpm}, tpm={args.tpm}, dim={args.dim})")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"   accepted={limits.accepted} rejected={limits.rejected}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,86 @@
 """
 generate_embeddings.py
 Generates OpenAI embeddings for a product catalog using the `text-embedding-3-large` configured in config.py model.
+The catalog CSV is streamed in chunks into the binary embedding store, so memory stays flat for any catalog size.
 """
 
 # Standard library
 import concurrent.futures
+import os
+import random
+import sys
+import time
+from collections import deque
 from typing import List
 
 # 3P Imports
+import numpy as np
 import pandas as pd
 import tiktoken
 from tqdm import tqdm
-from openai import OpenAI
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+from openai import APIConnectionError, APITimeoutError, InternalServerError, OpenAI, RateLimitError
 
 # Local config
-from config import EMBEDDING_MODEL, EMBEDDING_COST_PER_1K_TOKENS
-from embeddings.embed_samples_load import styles_df
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
+from config import EMBEDDING_MODEL, EMBEDDING_COST_PER_1K_TOKENS, EMBEDDING_STORE_PATH, EMBEDDING_CHECKPOINT_ROWS
+from config import CATALOG_SOURCE_PATH, EMBEDDING_MAX_PENDING_ROWS
+from config import EMBEDDING_MAX_BATCH_TOKENS, EMBEDDING_MAX_BATCH_INPUTS, EMBEDDING_MAX_ATTEMPTS
+from config import EMBEDDING_INITIAL_CONCURRENCY, EMBEDDING_MAX_CONCURRENCY, EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_TOKENS_PER_MINUTE
+from config import ANN_ENABLED, ANN_INDEX_PATH, ANN_N_LISTS, ANN_N_PROBE, ANN_TRAIN_SAMPLE, SEARCH_DIMS
+from config import QUANTIZATION, QUANTIZED_INDEX_PATH
+from ann_index import build_ann_index
+from embedding_store import CHECKPOINT_SUFFIX, CONTENT_HASH_COLUMN, EmbeddingCheckpoint, EmbeddingStoreWriter
+from embedding_store import content_hash, open_store_matrix, read_manifest, store_vectors_by_hash, write_truncated_matrix
+from quantized_index import build_quantized_index
+from rate_limiter import AdaptiveConcurrencyLimiter
 
-# Initialize OpenAI client 
-client = OpenAI()
+# OpenAI client, created on first use so the module can be imported without credentials. SDK-level
+# retries are off: throttling is handled by the limiter below, which needs to see every 429 to adapt.
+# Point OPENAI_BASE_URL at scripts/fake_embeddings_server.py to exercise batching and rate limiting locally.
+client = None
 
-# Simple function to take in a list of text objects and return them as a list of embeddings
-@retry(wait=wait_random_exponential(min=1, max=40), stop=stop_after_attempt(10))
-def get_embeddings(input: List):
-    response = client.embeddings.create(
-        input=input,
-        model=EMBEDDING_MODEL
-    ).data
-    return [data.embedding for data in response]
+
+def get_client():
+    global client
+    if client is None:
+        client = OpenAI(max_retries=0)
+    return client
+
+
+# Shared by every embed_corpus call so learned rate limits and concurrency carry over between chunks
+limiter = AdaptiveConcurrencyLimiter(
+    initial=EMBEDDING_INITIAL_CONCURRENCY,
+    max_concurrency=EMBEDDING_MAX_CONCURRENCY,
+    requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+    tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+)
+
+
+# Takes in a list of tokenized texts and returns them as a list of embeddings. Each attempt waits for
+# the limiter; 429s back off by the server's retry/reset headers for as long as it takes (they are not
+# failures), transient errors exponentially for up to EMBEDDING_MAX_ATTEMPTS attempts.
+def _request_embeddings(input: List):
+    tokens = sum(len(item) for item in input)
+    failures = 0
+    while True:
+        limiter.acquire(tokens)
+        try:
+            raw = get_client().embeddings.with_raw_response.create(input=input, model=EMBEDDING_MODEL)
+        except RateLimitError as e:
+            limiter.release(tokens, e.response.headers, throttled=True)
+            if e.code == "insufficient_quota":
+                # Also a 429, but waiting will not help
+                raise
+            continue
+        except (APIConnectionError, APITimeoutError, InternalServerError):
+            limiter.release(tokens)
+            failures += 1
+            if failures >= EMBEDDING_MAX_ATTEMPTS:
+                raise
+            time.sleep(min(40, 2 ** failures) * random.uniform(0.5, 1.0))
+            continue
+        limiter.release(tokens, raw.headers)
+        return [data.embedding for data in raw.parse().data]
 
 
 # Splits an iterable into batches of size n. Allows for scale
@@ -36,61 +88,216 @@ def batchify(iterable, n=1):
     l = len(iterable)
     for ndx in range(0, l, n):
         yield iterable[ndx : min(ndx + n, l)]
-     
 
-# Function for batching and parallel processing the embeddings
+
+# Packs tokenized inputs into batches of consecutive positions holding at most max_tokens tokens
+# and max_inputs inputs each, so short texts share a request and long ones never overflow it
+def pack_batches(encoded_corpus, max_tokens=EMBEDDING_MAX_BATCH_TOKENS, max_inputs=EMBEDDING_MAX_BATCH_INPUTS):
+    batch, batch_tokens = [], 0
+    for position, tokens in enumerate(encoded_corpus):
+        if batch and (batch_tokens + len(tokens) > max_tokens or len(batch) == max_inputs):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(position)
+        batch_tokens += len(tokens)
+    if batch:
+        yield batch
+
+
+# Tokenizes texts for the embeddings API, truncating each to max_context_len tokens
+def encode_texts(texts: List[str], max_context_len=8191):
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return [encoded_article[:max_context_len] for encoded_article in encoding.encode_batch(texts)]
+
+
+# Embeds one packed batch of tokenized inputs as a float32 matrix (compact from the moment it arrives).
+# Bypasses the query embedding cache: catalog vectors are reused through the store's content hashes and
+# the checkpoint, and would only evict the query entries that cache is sized for.
+def embed_batch(batch):
+    return np.asarray(_request_embeddings(batch), dtype=np.float32)
+
+
+# Function for batching and parallel processing the embeddings of an in-memory corpus. Up to max_workers
+# threads wait on the limiter, which decides how many requests are actually in flight.
 def embed_corpus(
     corpus: List[str],
-    batch_size=64,
-    num_workers=8,
+    max_batch_tokens=EMBEDDING_MAX_BATCH_TOKENS,
+    max_workers=EMBEDDING_MAX_CONCURRENCY,
     max_context_len=8191,
 ):
-    # Encode the corpus, truncating to max_context_len
-    encoding = tiktoken.get_encoding("cl100k_base")
-    encoded_corpus = [
-        encoded_article[:max_context_len] for encoded_article in encoding.encode_batch(corpus)
-    ]
+    encoded_corpus = encode_texts(corpus, max_context_len)
 
     # Calculate corpus statistics: the number of inputs, the total number of tokens, and the estimated cost to embed
     num_tokens = sum(len(article) for article in encoded_corpus)
     cost_to_embed_tokens = num_tokens / 1000 * EMBEDDING_COST_PER_1K_TOKENS
+    batches = list(pack_batches(encoded_corpus, max_tokens=max_batch_tokens))
     print(
-        f"num_articles={len(encoded_corpus)}, num_tokens={num_tokens}, est_embedding_cost={cost_to_embed_tokens:.2f} USD"
+        f"num_articles={len(encoded_corpus)}, num_tokens={num_tokens}, num_batches={len(batches)}, "
+        f"est_embedding_cost={cost_to_embed_tokens:.2f} USD"
     )
 
     # Embed the corpus
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-        
-        futures = [
-            executor.submit(get_embeddings, text_batch)
-            for text_batch in batchify(encoded_corpus, batch_size)
-        ]
+    embeddings = [None] * len(encoded_corpus)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        futures = {
+            executor.submit(embed_batch, [encoded_corpus[position] for position in batch]): batch
+            for batch in batches
+        }
 
         with tqdm(total=len(encoded_corpus)) as pbar:
-            for _ in concurrent.futures.as_completed(futures):
-                pbar.update(batch_size)
+            for future in concurrent.futures.as_completed(futures):
+                batch = futures[future]
+                for position, embedding in zip(batch, future.result()):
+                    embeddings[position] = embedding
+                pbar.update(len(batch))
+                pbar.set_postfix(concurrency=int(limiter.limit), throttled=limiter.throttled)
+
+    print(f"Rate limiter: {limiter.stats()}")
+    return embeddings
+
+
+# Streams the catalog CSV in chunks of rows, so the whole catalog is never loaded at once
+def read_catalog_chunks(csv_path, chunk_size):
+    yield from pd.read_csv(csv_path, on_bad_lines="skip", chunksize=chunk_size)
+
+
+# Generates embeddings for a column of the catalog CSV and writes them to the embedding store as a streaming
+# pipeline: chunked reader -> tokenizer -> bounded window of in-flight embedding requests -> ordered writer
+# appending to the store. Peak memory depends on chunk_size and max_pending_rows, not on the catalog size.
+#
+# Incremental: rows whose text (and model) are unchanged since the last run reuse their stored vector, rows
+# removed from the catalog are dropped, and only new or edited rows are sent to the API. New vectors are
+# checkpointed chunk by chunk, so an interrupted run resumes where it stopped; when a request fails for good,
+# the batches already embedded are checkpointed before the error is raised.
+def generate_embeddings(csv_path, column_name, store_path=EMBEDDING_STORE_PATH, chunk_size=EMBEDDING_CHECKPOINT_ROWS,
+                        max_pending_rows=EMBEDDING_MAX_PENDING_ROWS):
+    stored_index, stored_matrix = store_vectors_by_hash(store_path, EMBEDDING_MODEL, column_name)
+    checkpoint = EmbeddingCheckpoint(store_path + CHECKPOINT_SUFFIX, EMBEDDING_MODEL)
+    checkpoint.load()
+    print(
+        f"Reusable vectors: {len(stored_index) if stored_index else 0} in the current store, "
+        f"{len(checkpoint)} in {checkpoint.chunks} checkpoint chunks"
+    )
+
+    counts = {"rows": 0, "unchanged": 0, "resumed": 0, "embedded": 0}
+    # Stored rows still in the catalog (1 byte per row); the rest are dropped from the new store
+    still_present = np.zeros(len(stored_index) if stored_index else 0, dtype=bool)
+    # Chunks read but not yet written, oldest first: (rows, hashes, stored positions, checkpoint positions, batch keys, futures)
+    pending = deque()
+
+    def write_oldest(writer, pbar):
+        rows, hashes, stored_positions, checkpoint_positions, batch_keys, futures = pending[0]
+        new_keys, new_vectors = [], []
+        for keys, future in zip(batch_keys, futures):
+            new_keys.extend(keys)
+            new_vectors.append(future.result())
+        pending.popleft()
+        new = {}
+        if new_keys:
+            new_vectors = np.concatenate(new_vectors)
+            checkpoint.append(new_keys, new_vectors)
+            new = dict(zip(new_keys, new_vectors))
+
+        vectors = []
+        for key, stored, resumed in zip(hashes, stored_positions, checkpoint_positions):
+            if stored >= 0:
+                vectors.append(stored_matrix[stored])
+            elif resumed >= 0:
+                vectors.append(checkpoint.vector(resumed))
+            else:
+                vectors.append(new[key])
+
+        rows = rows.drop(columns=["embeddings"], errors="ignore").copy()
+        rows[CONTENT_HASH_COLUMN] = hashes
+        writer.append(rows, np.stack(vectors))
+        pbar.update(len(rows))
+        pbar.set_postfix(concurrency=int(limiter.limit), throttled=limiter.throttled)
+
+    def checkpoint_finished():
+        # Batches embedded but not yet written, so a rerun does not pay for them again
+        for *_, batch_keys, futures in pending:
+            for keys, future in zip(batch_keys, futures):
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    checkpoint.append(keys, future.result())
+
+    def embed_chunks(executor, writer, pbar):
+        for rows in read_catalog_chunks(csv_path, chunk_size):
+            texts = rows[column_name].astype(str).tolist()
+            hashes = [content_hash(text, EMBEDDING_MODEL) for text in texts]
+            stored_positions = stored_index.lookup(hashes) if stored_index else np.full(len(hashes), -1)
+            checkpoint_positions = checkpoint.lookup(hashes)
+            still_present[stored_positions[stored_positions >= 0]] = True
+
+            # Distinct texts of this chunk that have no vector yet
+            todo = {}
+            for text, key, stored, resumed in zip(texts, hashes, stored_positions, checkpoint_positions):
+                if stored < 0 and resumed < 0:
+                    todo.setdefault(key, text)
+            counts["rows"] += len(rows)
+            counts["unchanged"] += int(np.count_nonzero(stored_positions >= 0))
+            counts["resumed"] += int(np.count_nonzero((stored_positions < 0) & (checkpoint_positions >= 0)))
+            counts["embedded"] += len(todo)
+
+            keys = list(todo)
+            encoded = encode_texts(list(todo.values()))
+            batch_keys, futures = [], []
+            for batch in pack_batches(encoded):
+                batch_keys.append([keys[position] for position in batch])
+                futures.append(executor.submit(embed_batch, [encoded[position] for position in batch]))
+            pending.append((rows, hashes, stored_positions, checkpoint_positions, batch_keys, futures))
+
+            # Ordered writer with a bounded window: finished chunks are written in catalog order, and the
+            # reader blocks on the oldest chunk whenever too many rows are outstanding
+            while pending and (all(future.done() for future in pending[0][5])
+                               or sum(len(chunk[0]) for chunk in pending) > max_pending_rows):
+                write_oldest(writer, pbar)
+
+        while pending:
+            write_oldest(writer, pbar)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=EMBEDDING_MAX_CONCURRENCY) as executor, \
+            EmbeddingStoreWriter(store_path, model=EMBEDDING_MODEL) as writer, tqdm(unit="rows") as pbar:
+        try:
+            embed_chunks(executor, writer, pbar)
+        except BaseException:
+            # Skip the requests not started yet, then keep what has already been paid for
+            executor.shutdown(wait=True, cancel_futures=True)
+            checkpoint_finished()
+            raise
+
+    checkpoint.clear()
+    # Store rows (duplicates included) whose text is no longer in the catalog
+    counts["dropped"] = int(np.count_nonzero(~stored_index.spread(still_present))) if stored_index else 0
+    print(f"Embeddings created successfully: {counts}")
+    print(f"Rate limiter: {limiter.stats()}")
+    return read_manifest(store_path)
+
 
-        embeddings = []
-        for future in futures:
-            data = future.result()
-            embeddings.extend(data)
+# Embeds the catalog into the store, then builds the search structures configured in config.py from it
+def main(csv_path=CATALOG_SOURCE_PATH, store_path=EMBEDDING_STORE_PATH):
+    # === Call the embedding function and save the result ===
+    manifest = generate_embeddings(csv_path, 'productDisplayName', store_path=store_path)
+    print(f"Embeddings successfully stored in {store_path} ({manifest['rows']} x {manifest['dim']} float32)")
 
-        return embeddings
-    
+    # === Store the truncated first-stage matrix for two-stage search ===
+    if SEARCH_DIMS and SEARCH_DIMS < manifest['dim']:
+        write_truncated_matrix(store_path, SEARCH_DIMS)
+        print(f"Truncated {SEARCH_DIMS}-dim search matrix stored in {store_path}")
 
-# Function to generate embeddings for a given column in a DataFrame
-def generate_embeddings(df, column_name):
-    # Initialize an empty list to store embeddings
-    descriptions = df[column_name].astype(str).tolist()
-    embeddings = embed_corpus(descriptions)
+    # === Build the approximate nearest-neighbour index over the stored matrix ===
+    if ANN_ENABLED:
+        print("Building ANN index ...")
+        matrix = open_store_matrix(store_path)
+        build_ann_index(matrix, ANN_INDEX_PATH, n_lists=ANN_N_LISTS, n_probe=ANN_N_PROBE, train_sample=ANN_TRAIN_SAMPLE,
+                        source_checksum=manifest['files']['matrix']['sha256'])
 
-    # Add the embeddings as a new column to the DataFrame
-    df['embeddings'] = embeddings
-    print("Embeddings created successfully.")
+    # === Quantize the stored matrix for compact int8 / binary search ===
+    if QUANTIZATION:
+        print(f"Building {QUANTIZATION} quantized index ...")
+        build_quantized_index(open_store_matrix(store_path), QUANTIZED_INDEX_PATH, kind=QUANTIZATION,
+                              source_checksum=manifest['files']['matrix']['sha256'])
 
 
-# === Call the embedding function and save the result ===
-generate_embeddings(styles_df, 'productDisplayName')
-print("Writing embeddings to file ...")
-styles_df.to_csv('data/sample_clothes/sample_styles_with_embeddings.csv', index=False)
-print("Embeddings successfully stored in sample_styles_with_embeddings.csv")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
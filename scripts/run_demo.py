@@ -1,7 +1,7 @@
 # Standard Library Imports
-import ast
+import argparse
+import asyncio
 import base64
-import json
 import os
 
 # 3P Imports
@@ -13,9 +13,20 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src"))
 
-from analysis import analyze_image
-from guardrails import check_match
-from search_similar_items import find_matching_items_with_rag
+from analysis import analysis_cache_stats
+from config import GUARDRAIL_TARGET_MATCHES, PROFILE
+from guardrails import verdict_cache_stats
+from pipeline import CATALOG_IMAGES_DIR, load_catalog_image, recommend
+from search_similar_items import build_search_engine
+from filter_index import complementary_filter
+from image_prep import image_prep_stats, prepare_image
+from profiling import profile_request, resolve_mode
+from telemetry import get_registry
+
+parser = argparse.ArgumentParser(description="Run the recommendation pipeline on a sample image")
+parser.add_argument("--profile", nargs="?", const="sample", default=PROFILE, type=resolve_mode,
+                    help="Profile the request: sample (default) or cprofile; output goes to PROFILE_DIR")
+args, _ = parser.parse_known_args()
 
 # Load the dataset with embeddings from GCP Cloud Storage
 
@@ -31,6 +42,17 @@ def encode_image_from_url(image_url):
         print(f"❌ Error downloading image from {image_url}: {e}")
         return None
 
+def prepare_image_from_url(image_url):
+    """Download image from URL and prepare it (orient, downscale, re-encode) for vision calls."""
+    import requests
+    try:
+        response = requests.get(image_url)
+        response.raise_for_status()
+        return prepare_image(response.content)
+    except Exception as e:
+        print(f"❌ Error downloading image from {image_url}: {e}")
+        return None
+
 def encode_image_to_base64(image_path):
     """Legacy function for local files."""
     with open(image_path, "rb") as image_file:
@@ -38,6 +60,7 @@ def encode_image_to_base64(image_path):
         return encoded_image.decode("utf-8")
 from data_loader import load_clothing_data
 styles_df = load_clothing_data()
+search_engine = build_search_engine(styles_df)
 
 
 
@@ -55,86 +78,99 @@ test_images = ["2133.jpg", "7143.jpg", "4226.jpg"]
 reference_image_path = local_image_path + test_images[0]
 if os.path.exists(reference_image_path):
     print(f"📁 Using local image: {reference_image_path}")
-    encoded_image = encode_image_to_base64(reference_image_path)
+    encoded_image = prepare_image(reference_image_path)
 else:
     print(f"🌐 Using remote image: {base_image_url + test_images[0]}")
     reference_image_url = base_image_url + test_images[0]
-    encoded_image = encode_image_from_url(reference_image_url)
+    encoded_image = prepare_image_from_url(reference_image_url)
 
 # Select the unique subcategories from the DataFrame
 unique_subcategories = styles_df['articleType'].unique()
 
-# Analyze the image and return the results
-analysis = analyze_image(encoded_image, unique_subcategories)
-image_analysis = json.loads(analysis)
-
-# Display the image and the analysis results
+# Display the image being analyzed
 if 'reference_image_url' in locals():
     print(f"🖼️  Sample image URL: {reference_image_url}")
 else:
     print(f"🖼️  Sample image path: {reference_image_path}")
-print(image_analysis)
-
-## Break this out into own file TODO match_from_image
-# Extract the relevant features from the analysis
-item_descs = image_analysis['items']
-item_category = image_analysis['category']
-item_gender = image_analysis['gender']
-
-
-# Filter data such that we only look through the items of the same gender (or unisex) and different category
-filtered_items = styles_df.loc[styles_df['gender'].isin([item_gender, 'Unisex'])]
-filtered_items = filtered_items[filtered_items['articleType'] != item_category]
-print(str(len(filtered_items)) + " Remaining Items")
-
-# Find the most similar items based on the input item descriptions
-matching_items = find_matching_items_with_rag(filtered_items, item_descs)
-
-# Display the matching items (this will display 2 items for each description in the image analysis)
-html = ""
-paths = []
-for i, item in enumerate(matching_items):
-    item_id = item['id']
-        
-    # Path to the image file - try local first, then remote
-    local_image_path = f"data/sample_clothes/sample_images/{item_id}.jpg"
+
+def item_image_path(item_id):
+    """Local catalog image if present, otherwise the remote copy."""
+    local_image_path = os.path.join(CATALOG_IMAGES_DIR, f"{item_id}.jpg")
     if os.path.exists(local_image_path):
-        image_path = local_image_path
-        html += f"<img src=\"{local_image_path}\" style=\"display:inline;margin:1px;max-width:200px\"/>"
-    else:
-        image_url = f"{base_image_url}{item_id}.jpg"
-        image_path = image_url
-        html += f"<img src=\"{image_url}\" style=\"display:inline;margin:1px;max-width:200px\"/>"
-    paths.append(image_path)
-
-# Print the matching item description as a reminder of what we are looking for
-print(item_descs)
-
-# Display the image
-display(HTML(html))
-
-
-# Select the unique paths for the generated images
-paths = list(set(paths))
-
-for path in paths:
-    # Handle both local files and URLs
-    if path.startswith("http"):
-        # Remote URL
-        suggested_image = encode_image_from_url(path)
-    elif os.path.exists(path):
-        # Local file
-        suggested_image = encode_image_to_base64(path)
-    else:
-        print(f"⚠️ File not found, skipping: {path}")
-        continue
-    
-    # Check if the items match
-    match = json.loads(check_match(encoded_image, suggested_image))
-    
-    # Display the image and the analysis results
-    if match["answer"] == 'yes':
-        # Use HTML display for URLs instead of local file display
-        display(HTML(f'<img src="{path}" style="max-width:300px;margin:10px;border:2px solid green;"/>'))
-        print("The items match!")
-        print(match["reason"])
\ No newline at end of file
+        return local_image_path
+    return f"{base_image_url}{item_id}.jpg"
+
+def candidate_loader(item):
+    """Guardrail payload for a matched item: the pipeline's catalog loader, falling back to the remote copy."""
+    payload = load_catalog_image(item)
+    if payload is None:
+        # Downloading/encoding is deferred to a worker thread
+        url = f"{base_image_url}{item['id']}.jpg"
+        return lambda: prepare_image_from_url(url)
+    return payload
+
+
+async def run_pipeline():
+    """Analysis, catalog search and guardrail checks overlap; print each result as it arrives."""
+    paths = {}
+    events = recommend(
+        encoded_image,
+        unique_subcategories,
+        styles_df,
+        search_engine,
+        target_matches=GUARDRAIL_TARGET_MATCHES,
+        candidate_image=candidate_loader,
+    )
+    async for event in events:
+        if event["type"] == "analysis_item":
+            # Streamed from the model's answer; its catalog search starts right away
+            print(f"💡 Recommended item: {event['description']}")
+        elif event["type"] == "analysis":
+            image_analysis = event["analysis"]
+            print(image_analysis)
+            if image_analysis.get('gender') and image_analysis.get('category'):
+                # Only items of the same gender (or unisex) and a different category are searched, via the precomputed filter index
+                item_filter = complementary_filter(image_analysis['gender'], image_analysis['category'])
+                print(str(search_engine.filter_index.count(item_filter)) + " Remaining Items")
+        elif event["type"] == "match":
+            # Display each matching item as soon as it is found (up to 2 per description)
+            path = item_image_path(event["item"]['id'])
+            paths[event["index"]] = path
+            print(f"🔎 {event['description']}: {event['item'].get('productDisplayName')}")
+            display(HTML(f"<img src=\"{path}\" style=\"display:inline;margin:1px;max-width:200px\"/>"))
+        elif event["type"] == "verdict":
+            match = event["verdict"]
+            if match["answer"] == 'yes':
+                # Use HTML display for URLs instead of local file display
+                display(HTML(f'<img src="{paths[event["index"]]}" style="max-width:300px;margin:10px;border:2px solid green;"/>'))
+                print("The items match!")
+                print(match["reason"])
+        elif event["type"] == "error":
+            print(f"❌ {event['stage']} failed: {event['error']}")
+        elif event["type"] == "done":
+            timings = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in event["timings"].items())
+            print(f"⏱️  {event['matches']} matches, {event['compatible']} compatible ({timings})")
+            if event["time_to_first_match"] is not None:
+                print(f"⏱️  Time to first match: {event['time_to_first_match']:.2f}s")
+            if event.get("telemetry"):
+                totals = event["telemetry"]["totals"]
+                print(f"💰 {totals.get('model_calls', 0)} model calls, {totals.get('prompt_tokens', 0)} prompt + "
+                      f"{totals.get('completion_tokens', 0)} completion tokens "
+                      f"(~{totals.get('image_tokens', 0)} image), ${totals.get('cost_usd', 0):.4f}, "
+                      f"{totals.get('bytes_sent', 0) / 1024:.0f} KB sent")
+                for stage, values in event["telemetry"]["stages"].items():
+                    print(f"   {stage:<16} x{values['count']:<3} {values['seconds']:.2f}s "
+                          f"cache hits={values.get('cache_hits', 0)} misses={values.get('cache_misses', 0)}")
+
+
+with profile_request("run_demo", mode=args.profile) as profile:
+    asyncio.run(run_pipeline())
+if profile is not None:
+    print(f"🔬 Profile written to {', '.join(profile.files)}")
+
+print(f"🗃️  Analysis cache: {analysis_cache_stats()}")
+print(f"🗃️  Guardrail cache: {verdict_cache_stats()}")
+print(f"🖼️  Image preparation: {image_prep_stats()}")
+for histogram in get_registry().snapshot()["histograms"]:
+    print(f"📈 {histogram['name']} {histogram['labels']}: n={histogram['count']} p50={histogram['p50']:.3f}s "
+          f"p95={histogram['p95']:.3f}s p99={histogram['p99']:.3f}s")
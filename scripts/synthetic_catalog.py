@@ -0,0 +1,108 @@
+"""
+synthetic_catalog.py
+Generates synthetic, clustered embedding catalogs for benchmarking search at sizes far beyond the
+sample catalog. Vectors are drawn around random "style" centres so that neighbourhoods are realistic
+enough for cluster-based indexes to be meaningfully evaluated. With `decay`, variance falls off along
+the dimensions the way it does in Matryoshka-trained embeddings, so truncation can be evaluated too.
+Full catalogs (metadata columns plus embeddings) can be generated in the sample_styles_with_embeddings.csv schema.
+"""
+
+# 3P Imports
+import numpy as np
+import pandas as pd
+
+
+def dimension_weights(dim, decay=0.0):
+    """Per-dimension scale (1 + i) ** -decay; 0 gives isotropic vectors."""
+    return (1.0 + np.arange(dim, dtype=np.float32)) ** np.float32(-decay)
+
+
+def synthetic_embeddings(size, dim=256, n_clusters=None, spread=0.35, seed=0, batch_size=65536, decay=0.0):
+    """
+    Unit-norm float32 matrix of `size` vectors grouped around `n_clusters` random centres. `decay` > 0
+    concentrates variance in the leading dimensions (about 0.5 resembles text-embedding-3 vectors).
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = n_clusters or max(1, int(np.sqrt(size)))
+    weights = dimension_weights(dim, decay)
+    centres = rng.standard_normal((n_clusters, dim), dtype=np.float32) * weights
+    centres /= np.linalg.norm(centres, axis=1, keepdims=True)
+
+    matrix = np.empty((size, dim), dtype=np.float32)
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        batch = centres[rng.integers(0, n_clusters, count)]
+        noise = rng.standard_normal((count, dim), dtype=np.float32) * weights
+        batch += spread * noise / np.linalg.norm(weights)
+        matrix[start:start + count] = batch / np.linalg.norm(batch, axis=1, keepdims=True)
+    return matrix
+
+
+def synthetic_queries(matrix, count=200, noise=0.5, seed=1, decay=0.0):
+    """Queries made by perturbing random catalog vectors, like a description close to a real product."""
+    rng = np.random.default_rng(seed)
+    weights = dimension_weights(matrix.shape[1], decay)
+    queries = np.array(matrix[rng.integers(0, matrix.shape[0], count)], dtype=np.float32)
+    queries += noise * rng.standard_normal(queries.shape, dtype=np.float32) * weights / np.linalg.norm(weights)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+# Column layout of sample_styles_with_embeddings.csv, with the vocabularies synthetic rows draw from
+CATALOG_COLUMNS = ("id", "gender", "masterCategory", "subCategory", "articleType", "baseColour", "season",
+                   "year", "usage", "productDisplayName", "embeddings")
+_GENDERS = ("Men", "Women", "Unisex", "Boys", "Girls")
+_ARTICLES = (
+    ("Apparel", "Topwear", "Shirts"), ("Apparel", "Topwear", "Tshirts"), ("Apparel", "Topwear", "Tops"),
+    ("Apparel", "Topwear", "Sweaters"), ("Apparel", "Topwear", "Jackets"), ("Apparel", "Bottomwear", "Jeans"),
+    ("Apparel", "Bottomwear", "Trousers"), ("Apparel", "Bottomwear", "Shorts"), ("Apparel", "Bottomwear", "Skirts"),
+    ("Apparel", "Dress", "Dresses"), ("Footwear", "Shoes", "Casual Shoes"), ("Footwear", "Shoes", "Sports Shoes"),
+    ("Footwear", "Sandal", "Sandals"), ("Accessories", "Watches", "Watches"), ("Accessories", "Bags", "Handbags"),
+    ("Accessories", "Belts", "Belts"),
+)
+_COLOURS = ("Black", "White", "Blue", "Navy Blue", "Grey", "Red", "Green", "Brown", "Pink", "Beige", "Purple", "Yellow")
+_SEASONS = ("Summer", "Fall", "Winter", "Spring")
+_USAGES = ("Casual", "Formal", "Sports", "Ethnic", "Party")
+_BRANDS = ("Urban", "Classic", "Nordic", "Metro", "Coastal", "Heritage", "Studio", "Trail")
+
+
+def synthetic_catalog_frame(size, dim=256, seed=0, decay=0.0, start_id=1):
+    """
+    Synthetic catalog DataFrame in the sample_styles_with_embeddings.csv schema; the "embeddings"
+    column holds float32 vectors (as produced by data_loader.prepare_catalog).
+    """
+    rng = np.random.default_rng(seed)
+    articles = rng.integers(0, len(_ARTICLES), size)
+    colours = rng.choice(_COLOURS, size)
+    genders = rng.choice(_GENDERS, size, p=(0.4, 0.4, 0.1, 0.05, 0.05))
+    brands = rng.choice(_BRANDS, size)
+    article_types = [_ARTICLES[article][2] for article in articles]
+    frame = pd.DataFrame({
+        "id": np.arange(start_id, start_id + size),
+        "gender": genders,
+        "masterCategory": [_ARTICLES[article][0] for article in articles],
+        "subCategory": [_ARTICLES[article][1] for article in articles],
+        "articleType": article_types,
+        "baseColour": colours,
+        "season": rng.choice(_SEASONS, size),
+        "year": rng.integers(2010, 2019, size),
+        "usage": rng.choice(_USAGES, size, p=(0.6, 0.15, 0.12, 0.08, 0.05)),
+        "productDisplayName": [
+            f"{brand} {gender} {colour} {article}"
+            for brand, gender, colour, article in zip(brands, genders, colours, article_types)
+        ],
+    })
+    frame["embeddings"] = list(synthetic_embeddings(size, dim=dim, seed=seed, decay=decay))
+    return frame
+
+
+def write_synthetic_catalog_csv(path, size, dim=256, seed=0, decay=0.0, chunk_size=50000):
+    """
+    Write a synthetic catalog as a CSV with JSON-style embedding text, like sample_styles_with_embeddings.csv.
+    Rows are generated in chunks, so memory stays bounded for million-row catalogs.
+    """
+    for start in range(0, size, chunk_size):
+        chunk = synthetic_catalog_frame(min(chunk_size, size - start), dim=dim, seed=seed + start, decay=decay,
+                                        start_id=start + 1)
+        chunk["embeddings"] = ["[" + ", ".join(map(repr, vector.tolist())) + "]" for vector in chunk["embeddings"]]
+        chunk.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+    return path
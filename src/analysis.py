@@ -1,26 +1,136 @@
 """
 analysis.py
 This module defines the `analyze_image` function, which uses OpenAI's GPT-5 mini 
-API to analyze a clothing image and return structured fashion metadata. It provides
+API (through the model provider layer in providers.py) to analyze a clothing image and return structured fashion metadata. It provides
 an example input and output prompt (one shot example). The output (JSON format) includes a predefined structure
 including, items, category, gender 
 """
 
-# 3P Imports
-from openai import OpenAI
+# Standard library imports
+import hashlib
+import json
+import threading
 
 # Local Application Imports
-from config import GPT_MODEL
+from config import GPT_MODEL, ANALYSIS_PROMPT_VERSION
+from config import ANALYSIS_CACHE_ENABLED, ANALYSIS_CACHE_MAX_DISTANCE, ANALYSIS_CACHE_MAX_ENTRIES, ANALYSIS_CACHE_PATH, ANALYSIS_CACHE_TTL_SECONDS
+from image_prep import hamming_distance, image_data_url, image_fingerprint
+from providers import get_provider
+from telemetry import span, start_span
+from ttl_cache import TTLCache
 
-# Initialize OpenAI client
-client = OpenAI()
+_analysis_cache = None
+_analysis_cache_lock = threading.Lock()
+_lookups = {"exact_hits": 0, "near_hits": 0, "misses": 0}
+
+
+def get_analysis_cache():
+    """Process-wide analysis cache configured from config.py, or None when caching is disabled."""
+    global _analysis_cache
+    if not ANALYSIS_CACHE_ENABLED:
+        return None
+    with _analysis_cache_lock:
+        if _analysis_cache is None:
+            _analysis_cache = TTLCache(
+                max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+                ttl_seconds=ANALYSIS_CACHE_TTL_SECONDS,
+                path=ANALYSIS_CACHE_PATH,
+            )
+            if ANALYSIS_CACHE_MAX_DISTANCE > 0:
+                # Near-duplicate matching scans the memory tier; load the analyses kept on disk into it
+                _analysis_cache.warm()
+        return _analysis_cache
+
+
+def analysis_cache_scope(subcategories):
+    """Key prefix shared by analyses that are interchangeable: same model (and provider), prompt version and subcategories."""
+    digest = hashlib.sha256(json.dumps(sorted(str(s) for s in subcategories)).encode("utf-8")).hexdigest()[:16]
+    return f"{get_provider().model_key(GPT_MODEL)}:{ANALYSIS_PROMPT_VERSION}:{digest}"
+
+
+def _image_key(image_base64, subcategories):
+    """(scope, perceptual hash) of an upload; the scope includes its colour signature, since the hash is grayscale."""
+    image_hash, colour = image_fingerprint(image_base64)
+    return f"{analysis_cache_scope(subcategories)}:{colour}", image_hash
+
+
+def _cached_analysis(image_base64, subcategories):
+    """
+    Cached analysis for an image with the same colour signature and perceptual hash, or failing that
+    the closest one of that colour within ANALYSIS_CACHE_MAX_DISTANCE bits. Near-duplicate matching
+    scans the memory tier, which is warmed from the disk tier when the cache opens, so it also covers
+    analyses stored before a restart (the ANALYSIS_CACHE_MAX_ENTRIES most recently used ones).
+    """
+    cache = get_analysis_cache()
+    if cache is None:
+        return None
+    scope, image_hash = _image_key(image_base64, subcategories)
+
+    result = cache.get(f"{scope}:{image_hash:016x}")
+    if result is not None:
+        _count("exact_hits")
+        return result
+
+    if ANALYSIS_CACHE_MAX_DISTANCE > 0:
+        # Near-duplicate lookup: closest cached hash within the tolerance
+        best = None
+        for key, value in cache.items():
+            key_scope, _, key_hash = key.rpartition(":")
+            if key_scope != scope:
+                continue
+            distance = hamming_distance(image_hash, int(key_hash, 16))
+            if distance <= ANALYSIS_CACHE_MAX_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, value)
+        if best is not None:
+            _count("near_hits")
+            return best[1]
+
+    _count("misses")
+    return None
+
+
+def _store_analysis(image_base64, subcategories, result):
+    cache = get_analysis_cache()
+    if cache is None:
+        return
+    try:
+        if not isinstance(json.loads(result), dict):
+            return
+    except (TypeError, json.JSONDecodeError):
+        return
+    scope, image_hash = _image_key(image_base64, subcategories)
+    cache.set(f"{scope}:{image_hash:016x}", result)
+
+
+def _count(outcome):
+    with _analysis_cache_lock:
+        _lookups[outcome] += 1
+
+
+def analysis_cache_stats():
+    """Analysis cache counters; every hit (exact or near-duplicate) is a vision call that was not made."""
+    cache = get_analysis_cache()
+    if cache is None:
+        return {"enabled": False, "vision_calls_saved": 0}
+    with _analysis_cache_lock:
+        stats = dict(_lookups)
+    hits = stats["exact_hits"] + stats["near_hits"]
+    lookups = hits + stats["misses"]
+    cache_stats = cache.stats()
+    return {
+        "enabled": True,
+        **stats,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "vision_calls_saved": hits,
+        "entries": cache_stats["entries"],
+        "expirations": cache_stats["expirations"],
+        "evictions": cache_stats["evictions"],
+    }
 
 # Includes example of expected output, to future clarify expected output. 
 
-def analyze_image(image_base64, subcategories):
-    response = client.chat.completions.create(
-        model=GPT_MODEL,
-        messages=[
+def _analysis_messages(image_base64, subcategories):
+    return [
             {
             "role": "user",
             "content": [
@@ -54,13 +164,167 @@ def analyze_image(image_base64, subcategories):
                 {
                 "type": "image_url",
                 "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_base64}",
+                    "url": image_data_url(image_base64),
                 },
                 }
             ],
             }
         ]
-    )
-    # Extract relevant features from the response
-    features = response.choices[0].message.content
-    return features
\ No newline at end of file
+
+
+def analyze_image(image_base64, subcategories):
+    # image_base64 may also be a PreparedImage from image_prep, reused across the request
+    with span("analyze_image") as stage:
+        cached = _cached_analysis(image_base64, subcategories)
+        if cached is not None:
+            stage.add(cache_hits=1)
+            return cached
+        stage.add(cache_misses=1)
+        messages = _analysis_messages(image_base64, subcategories)
+        response = get_provider().chat(GPT_MODEL, messages, task="analysis")
+        stage.record_model_call(GPT_MODEL, response.prompt_tokens, response.completion_tokens, messages)
+        # Extract relevant features from the response
+        features = response.text
+        _store_analysis(image_base64, subcategories, features)
+        return features
+
+
+def analyze_image_stream(image_base64, subcategories):
+    """
+    Streaming analyze_image. Yields ("item", description), ("category", value) and ("gender", value) as
+    soon as each value is complete in the model's output, then ("complete", full response text).
+    A cached analysis is replayed through the same events without calling the model.
+    """
+    # Not made the current span: the caller runs between our yields
+    stage = start_span("analyze_image", streaming=True)
+    error = None
+    try:
+        parser = AnalysisStreamParser()
+        cached = _cached_analysis(image_base64, subcategories)
+        if cached is not None:
+            stage.add(cache_hits=1)
+            yield from parser.feed(cached)
+            yield "complete", cached
+            return
+        stage.add(cache_misses=1)
+        chunks, usage = [], {"prompt_tokens": 0, "completion_tokens": 0}
+        messages = _analysis_messages(image_base64, subcategories)
+        for text in get_provider().chat_stream(GPT_MODEL, messages, task="analysis", usage=usage):
+            chunks.append(text)
+            yield from parser.feed(text)
+        stage.record_model_call(GPT_MODEL, usage["prompt_tokens"], usage["completion_tokens"], messages)
+        features = "".join(chunks)
+        _store_analysis(image_base64, subcategories, features)
+        yield "complete", features
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Also reached when the consumer closes the stream early
+        stage.finish(error=error)
+
+
+async def analyze_image_stream_async(image_base64, subcategories):
+    """analyze_image_stream on the provider's async API."""
+    stage = start_span("analyze_image", streaming=True)
+    error = None
+    try:
+        parser = AnalysisStreamParser()
+        cached = _cached_analysis(image_base64, subcategories)
+        if cached is not None:
+            stage.add(cache_hits=1)
+            for event in parser.feed(cached):
+                yield event
+            yield "complete", cached
+            return
+        stage.add(cache_misses=1)
+        chunks, usage = [], {"prompt_tokens": 0, "completion_tokens": 0}
+        messages = _analysis_messages(image_base64, subcategories)
+        async for text in get_provider().chat_stream_async(GPT_MODEL, messages, task="analysis", usage=usage):
+            chunks.append(text)
+            for event in parser.feed(text):
+                yield event
+        stage.record_model_call(GPT_MODEL, usage["prompt_tokens"], usage["completion_tokens"], messages)
+        features = "".join(chunks)
+        _store_analysis(image_base64, subcategories, features)
+        yield "complete", features
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Also reached when the consumer closes the stream early
+        stage.finish(error=error)
+
+
+class AnalysisStreamParser:
+    """
+    Incremental parser for the analysis JSON ({"items": [...], "category": ..., "gender": ...}).
+    Feed it response chunks as they arrive; `feed` returns the (field, value) pairs completed by that
+    chunk: ("item", description) for each entry of "items", ("category", value) and ("gender", value).
+    Only string values are reported; anything before the opening brace (e.g. a ```json fence) is skipped.
+    """
+
+    def __init__(self):
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._string = []
+        self._expect_key = False
+        self._key = None
+
+    def feed(self, text):
+        events = []
+        for char in text:
+            if self._in_string:
+                self._string.append(char)
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    event = self._end_string(json.loads("".join(self._string)))
+                    if event is not None:
+                        events.append(event)
+            elif char == '"' and self._stack:
+                self._in_string = True
+                self._string = [char]
+            elif char in "{[":
+                self._stack.append(char)
+                self._expect_key = char == "{"
+            elif char in "}]" and self._stack:
+                self._stack.pop()
+                self._expect_key = False
+            elif char == "," and self._stack:
+                self._expect_key = self._stack[-1] == "{"
+            elif char == ":":
+                self._expect_key = False
+        return events
+
+    def _end_string(self, value):
+        depth = len(self._stack)
+        if self._stack[-1] == "{" and self._expect_key:
+            if depth == 1:
+                self._key = value
+            return None
+        if depth == 1 and self._key in ("category", "gender"):
+            return self._key, value
+        if depth == 2 and self._stack[-1] == "[" and self._key == "items":
+            return "item", value
+        return None
+
+
+async def analyze_image_async(image_base64, subcategories):
+    """analyze_image on the provider's async API (same prompt, cache and raw JSON string result)."""
+    with span("analyze_image") as stage:
+        cached = _cached_analysis(image_base64, subcategories)
+        if cached is not None:
+            stage.add(cache_hits=1)
+            return cached
+        stage.add(cache_misses=1)
+        messages = _analysis_messages(image_base64, subcategories)
+        response = await get_provider().chat_async(GPT_MODEL, messages, task="analysis")
+        stage.record_model_call(GPT_MODEL, response.prompt_tokens, response.completion_tokens, messages)
+        features = response.text
+        _store_analysis(image_base64, subcategories, features)
+        return features
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+ann_index.py
+Approximate nearest-neighbour search for large catalogs using an inverted file (IVF) index.
+Catalog vectors are clustered with spherical k-means; each query only scores the vectors in the
+`n_probe` clusters whose centroids are closest to it. `n_lists` and `n_probe` trade recall for latency.
+"""
+
+# Standard library imports
+import json
+import os
+import time
+
+# 3P Imports
+import numpy as np
+
+# Local application imports
+from similarity import as_matrix, normalize_rows, select_top_k
+
+INDEX_FORMAT = "retailnext-ivf"
+INDEX_VERSION = 1
+
+_META_FILENAME = "index.json"
+_ARRAY_FILENAMES = ("centroids", "vectors", "ids", "offsets")
+_ASSIGN_BATCH = 8192
+
+
+def default_n_lists(size):
+    """Rule-of-thumb number of clusters: about 4 * sqrt(N), at least 1."""
+    return max(1, int(4 * np.sqrt(size)))
+
+
+def _normalized_batches(matrix, batch_size=_ASSIGN_BATCH):
+    for start in range(0, matrix.shape[0], batch_size):
+        yield start, normalize_rows(np.asarray(matrix[start:start + batch_size], dtype=np.float32))
+
+
+def _assign(vectors, centroids):
+    """Index of the most similar centroid for each (normalized) vector, NaN rows go to cluster 0."""
+    scores = vectors @ centroids.T
+    np.nan_to_num(scores, copy=False, nan=-np.inf)
+    return np.argmax(scores, axis=1)
+
+
+def _spherical_kmeans(sample, n_lists, n_iter, rng):
+    """Cluster unit vectors by cosine similarity; empty clusters are re-seeded from random points."""
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assignment = np.concatenate([
+            _assign(sample[start:start + _ASSIGN_BATCH], centroids)
+            for start in range(0, len(sample), _ASSIGN_BATCH)
+        ])
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=n_lists)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        sums = np.add.reduceat(sample[order], starts, axis=0)
+
+        centroids[nonempty] = normalize_rows(sums)
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized vectors.
+
+    Vectors are stored grouped by cluster (`vectors[offsets[c]:offsets[c + 1]]` belong to cluster c,
+    `ids` maps them back to catalog row positions), so probing a cluster is one contiguous slice.
+    `source_checksum` is the SHA-256 of the embedding store matrix the index was built from, if any.
+    """
+
+    def __init__(self, centroids, vectors, ids, offsets, n_probe=8, source_checksum=None):
+        self.centroids = centroids
+        self.vectors = vectors
+        self.ids = ids
+        self.offsets = offsets
+        self.n_probe = n_probe
+        self.source_checksum = source_checksum
+        self._positions = None
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @property
+    def dim(self):
+        return self.centroids.shape[1]
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @classmethod
+    def build(cls, embeddings, n_lists=None, n_probe=8, n_iter=10, train_sample=20000, seed=0):
+        """
+        Train centroids on a random sample of the catalog, then assign every vector to its cluster.
+        `embeddings` may be a memory-mapped matrix; it is read in batches and never copied whole
+        except for the final cluster-ordered copy the index keeps.
+        """
+        matrix = embeddings if isinstance(embeddings, np.ndarray) and embeddings.ndim == 2 else as_matrix(embeddings)
+        size = matrix.shape[0]
+        if size == 0:
+            raise ValueError("Cannot build an IVF index over an empty catalog")
+        n_lists = min(n_lists or default_n_lists(size), size)
+        rng = np.random.default_rng(seed)
+
+        sample_ids = np.sort(rng.choice(size, min(size, max(train_sample, n_lists)), replace=False))
+        sample = np.nan_to_num(normalize_rows(np.asarray(matrix[sample_ids], dtype=np.float32)))
+        centroids = _spherical_kmeans(sample, n_lists, n_iter, rng)
+
+        assignment = np.empty(size, dtype=np.int64)
+        for start, batch in _normalized_batches(matrix):
+            assignment[start:start + len(batch)] = _assign(batch, centroids)
+
+        ids = np.argsort(assignment, kind="stable").astype(np.int64)
+        counts = np.bincount(assignment, minlength=n_lists)
+        offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        vectors = np.empty(matrix.shape, dtype=np.float32)
+        for start in range(0, size, _ASSIGN_BATCH):
+            chunk = ids[start:start + _ASSIGN_BATCH]
+            vectors[start:start + len(chunk)] = normalize_rows(np.asarray(matrix[chunk], dtype=np.float32))
+
+        return cls(centroids, vectors, ids, offsets, n_probe=n_probe)
+
+    def probe(self, query_embedding, n_probe=None):
+        """
+        Score one query against the clusters nearest to it.
+
+        Returns:
+            tuple: (catalog row positions, cosine similarities) for every probed vector
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        query = normalize_rows(np.atleast_2d(np.asarray(query_embedding, dtype=np.float32)))[0]
+        centroid_scores = np.nan_to_num(self.centroids @ query, nan=-np.inf)
+        if n_probe < self.n_lists:
+            lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            lists = np.arange(self.n_lists)
+
+        ids, scores = [], []
+        for cluster in lists:
+            start, end = self.offsets[cluster], self.offsets[cluster + 1]
+            if end > start:
+                ids.append(self.ids[start:end])
+                scores.append(self.vectors[start:end] @ query)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        return np.concatenate(ids), np.concatenate(scores)
+
+    def score_rows(self, query_embedding, rows):
+        """
+        Exact cosine similarities of one query against the given catalog rows, e.g. the few rows matching a
+        selective filter. Returns (rows, scores) like `probe`.
+        """
+        if self._positions is None:
+            # Inverse of `ids`: where each catalog row sits in the cluster-ordered vectors
+            positions = np.empty(len(self.ids), dtype=np.int64)
+            positions[self.ids] = np.arange(len(self.ids))
+            self._positions = positions
+        query = normalize_rows(np.atleast_2d(np.asarray(query_embedding, dtype=np.float32)))[0]
+        rows = np.asarray(rows, dtype=np.int64)
+        return rows, self.vectors[self._positions[rows]] @ query
+
+    def search(self, query_embedding, threshold=0.5, top_k=2, n_probe=None):
+        """Catalog row positions of the most similar items, best first (same contract as find_similar_items)."""
+        ids, scores = self.probe(query_embedding, n_probe=n_probe)
+        return ids[select_top_k(scores, threshold, top_k)].tolist()
+
+    def save(self, path):
+        """Write the index as a directory of .npy arrays plus a JSON header."""
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAY_FILENAMES:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            "format": INDEX_FORMAT,
+            "version": INDEX_VERSION,
+            "size": len(self),
+            "dim": self.dim,
+            "n_lists": self.n_lists,
+            "n_probe": self.n_probe,
+            "source_sha256": self.source_checksum,
+        }
+        with open(os.path.join(path, _META_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, n_probe=None, mmap=True):
+        """Open a saved index. With `mmap`, the arrays are memory-mapped instead of read into memory."""
+        with open(os.path.join(path, _META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != INDEX_FORMAT or meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported ANN index at {path}: {meta.get('format')} v{meta.get('version')}")
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in _ARRAY_FILENAMES
+        }
+        return cls(n_probe=n_probe or meta["n_probe"], source_checksum=meta.get("source_sha256"), **arrays)
+
+
+def build_ann_index(embeddings, path, n_lists=None, n_probe=8, train_sample=20000, source_checksum=None):
+    """
+    Build an IVF index over a catalog matrix and save it to `path`, recording `source_checksum` (the
+    embedding store's matrix checksum) so a stale index can be detected at load time.
+    """
+    started = time.perf_counter()
+    index = IVFIndex.build(embeddings, n_lists=n_lists, n_probe=n_probe, train_sample=train_sample)
+    index.source_checksum = source_checksum
+    index.save(path)
+    print(f"✅ Built IVF index ({len(index)} vectors, {index.n_lists} lists) in {time.perf_counter() - started:.1f}s -> {path}")
+    return index
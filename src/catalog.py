@@ -0,0 +1,120 @@
+"""
+catalog.py
+Process-wide catalog cache. The catalog DataFrame and its search engine are loaded once per server
+process and shared by every session; a background thread checks the catalog source for changes
+(ETag / Last-Modified conditional requests for the remote CSV, the manifest checksum for the local
+embedding store) and swaps in a new snapshot only when the data actually changed.
+"""
+
+# Standard library imports
+import threading
+import time
+
+# Local application imports
+from config import CATALOG_REFRESH_SECONDS, EMBEDDING_STORE_PATH
+from data_loader import fetch_remote_catalog, load_catalog, load_embedding_store, prepare_catalog, store_checksum
+from search_similar_items import build_search_engine
+
+
+class CatalogSnapshot:
+    """An immutable catalog version: the DataFrame, its search engine and where it came from."""
+
+    def __init__(self, df_items, engine, version):
+        self.df_items = df_items
+        self.engine = engine
+        self.version = version
+        self.loaded_at = time.time()
+
+
+class CatalogManager:
+    """
+    Holds the current CatalogSnapshot. Readers call `snapshot()` once per request and use that
+    snapshot throughout, so a refresh swapping in a new version never changes data mid-request.
+    """
+
+    def __init__(self, refresh_interval=CATALOG_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self._snapshot = None
+        self._load_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def snapshot(self):
+        """Current snapshot, loading the catalog on first use."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._load_lock:
+                if self._snapshot is None:
+                    df_items, version = load_catalog()
+                    self._snapshot = CatalogSnapshot(df_items, build_search_engine(df_items), version)
+                snapshot = self._snapshot
+        return snapshot
+
+    def refresh(self):
+        """
+        Check the catalog source for changes and swap in a new snapshot if it changed.
+
+        Returns:
+            bool: True if a new snapshot was installed
+        """
+        current = self.snapshot()
+        version = current.version
+
+        if version["source"] == "store":
+            checksum = store_checksum(EMBEDDING_STORE_PATH)
+            if checksum == version.get("checksum"):
+                return False
+            df_items = load_embedding_store(EMBEDDING_STORE_PATH)
+            new_version = {"source": "store", "checksum": checksum}
+        else:
+            # A catalog that fell back to the local CSV is upgraded as soon as the remote is reachable
+            df_items, validators = fetch_remote_catalog(
+                etag=version.get("etag"), last_modified=version.get("last_modified")
+            )
+            if df_items is None:
+                return False
+            df_items = prepare_catalog(df_items)
+            new_version = {"source": "remote", **validators}
+
+        snapshot = CatalogSnapshot(df_items, build_search_engine(df_items), new_version)
+        with self._load_lock:
+            self._snapshot = snapshot
+        print(f"🔄 Catalog refreshed: {len(df_items)} items ({new_version['source']})")
+        return True
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️  Catalog refresh failed, keeping current version: {e}")
+
+    def start_background_refresh(self):
+        """Start the refresh thread (idempotent; no-op when the refresh interval is 0)."""
+        with self._load_lock:
+            if self.refresh_interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name="catalog-refresh", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the refresh thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_catalog_manager():
+    """Process-wide CatalogManager with background refresh running."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = CatalogManager()
+            _manager.start_background_refresh()
+        return _manager
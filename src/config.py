@@ -3,9 +3,13 @@ config.py
 Contains basic OpenAI configs and cloud storage settings
 """
 
+import os
+
 GPT_MODEL = "gpt-5-mini"
 EMBEDDING_MODEL = "text-embedding-3-large"
 EMBEDDING_COST_PER_1K_TOKENS = 0.00013
+GPT_COST_PER_1K_PROMPT_TOKENS = 0.00025
+GPT_COST_PER_1K_COMPLETION_TOKENS = 0.002
 
 # GCP Cloud Storage Configuration
 GCP_BUCKET_URL = "https://storage.googleapis.com/retailnext00"
@@ -13,3 +17,126 @@ EMBEDDINGS_FILE_URL = f"{GCP_BUCKET_URL}/sample_styles_with_embeddings.csv"
 
 # Local fallback (for development)
 LOCAL_DATA_PATH = "data/sample_clothes/sample_styles_with_embeddings.csv"
+
+# Catalog CSV (without embeddings) read by scripts/generate_embeddings.py
+CATALOG_SOURCE_PATH = "data/sample_clothes/sample_styles.csv"
+
+# Binary embedding store (memory-mapped float32 matrix + metadata sidecar), preferred over the CSV
+EMBEDDING_STORE_PATH = "data/sample_clothes/sample_styles_embeddings"
+# generate_embeddings.py checkpoints newly computed vectors every this many rows (resumable runs)
+EMBEDDING_CHECKPOINT_ROWS = 2000
+# Bulk embedding (generate_embeddings.py): requests are packed up to these token / input limits and
+# their concurrency adapts to the API's rate-limit headers (AIMD). RPM/TPM of None are learned from headers.
+EMBEDDING_MAX_BATCH_TOKENS = 250000  # API limit is 300k tokens per request
+EMBEDDING_MAX_BATCH_INPUTS = 2048
+EMBEDDING_INITIAL_CONCURRENCY = 4
+EMBEDDING_MAX_CONCURRENCY = 32
+EMBEDDING_REQUESTS_PER_MINUTE = None
+EMBEDDING_TOKENS_PER_MINUTE = None
+EMBEDDING_MAX_ATTEMPTS = 10  # connection / timeout / 5xx failures per request; 429s only slow the limiter down
+# Rows read but not yet written (waiting on embedding requests); bounds peak memory to roughly
+# EMBEDDING_MAX_PENDING_ROWS x dim x 4 bytes of vectors (about 250 MB at 3072 dims)
+EMBEDDING_MAX_PENDING_ROWS = 20000
+# Recompute store checksums on every load (reads the whole matrix, so off by default)
+EMBEDDING_STORE_VERIFY = False
+
+# Query embedding cache: in-process LRU plus an SQLite file shared by worker processes
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_PATH = ".cache/embeddings.sqlite3"
+EMBEDDING_CACHE_MEMORY_ITEMS = 4096
+EMBEDDING_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Approximate nearest-neighbour (IVF) index, built by generate_embeddings.py
+ANN_ENABLED = False
+ANN_INDEX_PATH = "data/sample_clothes/sample_styles_ivf"
+ANN_N_LISTS = None  # None = about 4 * sqrt(catalog size)
+ANN_N_PROBE = 8  # clusters scored per query: higher = better recall, slower queries
+ANN_TRAIN_SAMPLE = 20000
+
+# Matryoshka-style two-stage search: score the catalog on the first SEARCH_DIMS components of each
+# embedding (re-normalized; e.g. 256 or 512 of text-embedding-3-large's 3072), then re-rank the best
+# RERANK_CANDIDATES with the full vectors. generate_embeddings.py writes the truncated matrix into the
+# embedding store. None = exact search over the full vectors
+SEARCH_DIMS = None
+RERANK_CANDIDATES = 100
+
+# Quantized search index, built by generate_embeddings.py: "int8" (per-dimension scale, 4x smaller than
+# float32) or "binary" (sign bits scored by Hamming distance, 32x smaller) codes rank the catalog, then
+# the best QUANTIZED_RESCORE_CANDIDATES are rescored with the memory-mapped float vectors. None = disabled
+QUANTIZATION = None
+QUANTIZED_INDEX_PATH = "data/sample_clothes/sample_styles_quantized"
+QUANTIZED_RESCORE_CANDIDATES = 200
+
+# Process-wide catalog cache: how often to check the catalog source for changes (0 disables)
+CATALOG_REFRESH_SECONDS = 300
+CATALOG_REQUEST_TIMEOUT = 60
+
+# Guardrail verification: concurrent check_match calls, and "yes" verdicts after which to stop (None = check all)
+GUARDRAIL_MAX_CONCURRENCY = 5
+GUARDRAIL_TARGET_MATCHES = None
+# Candidates judged per guardrail vision call, in the app pipeline and verify_candidates; 1 keeps one
+# check_match call per candidate
+GUARDRAIL_BATCH_SIZE = 1
+
+# Guardrail verdict cache keyed by reference image hash, candidate id, model and prompt version.
+# Bump GUARDRAIL_PROMPT_VERSION whenever the check_match prompt changes to invalidate old verdicts.
+GUARDRAIL_PROMPT_VERSION = "v1"
+GUARDRAIL_CACHE_ENABLED = True
+GUARDRAIL_CACHE_TTL_SECONDS = 7 * 24 * 3600
+GUARDRAIL_CACHE_MAX_ENTRIES = 10000
+GUARDRAIL_CACHE_PATH = ".cache/guardrail_verdicts.sqlite3"  # None keeps the cache in memory only
+
+# Image preparation before vision calls: longest edge in pixels, JPEG quality, optional image-token cap
+IMAGE_MAX_EDGE = 1024
+IMAGE_JPEG_QUALITY = 85
+IMAGE_TOKEN_BUDGET = None
+
+# Image analysis cache keyed by a perceptual hash and coarse colour of the uploaded image, the subcategory
+# list, model and prompt version. Uploads of the same colour whose hash differs by at most
+# ANALYSIS_CACHE_MAX_DISTANCE bits (of 64) reuse a cached analysis; 0 only matches identical hashes. Near-duplicates are searched among the entries in memory,
+# which are loaded from ANALYSIS_CACHE_PATH when the cache opens. Bump ANALYSIS_PROMPT_VERSION when the prompt changes.
+ANALYSIS_PROMPT_VERSION = "v1"
+ANALYSIS_CACHE_ENABLED = True
+ANALYSIS_CACHE_MAX_DISTANCE = 4
+ANALYSIS_CACHE_TTL_SECONDS = 7 * 24 * 3600
+ANALYSIS_CACHE_MAX_ENTRIES = 2000
+ANALYSIS_CACHE_PATH = ".cache/analyses.sqlite3"  # None keeps the cache in memory only
+
+# Stream analyze_image output in the async pipeline so catalog search starts before the answer is complete
+ANALYSIS_STREAMING = True
+
+# Pre-encoded catalog images (guardrail payloads + UI thumbnails), built by scripts/build_image_blobs.py
+IMAGE_BLOB_STORE_PATH = "data/sample_clothes/sample_images_blobs"
+CATALOG_IMAGES_PATH = "data/sample_clothes/sample_images"
+GUARDRAIL_IMAGE_MAX_EDGE = 512
+THUMBNAIL_MAX_EDGE = 256
+
+# Backend for chat-vision and embedding calls (see providers.py): "openai" (live API), "fake" (deterministic,
+# offline), "record" (live API, responses saved to MODEL_RECORDINGS_PATH) or "replay" (saved responses only)
+MODEL_PROVIDER = os.environ.get("MODEL_PROVIDER", "openai")
+MODEL_RECORDINGS_PATH = os.environ.get("MODEL_RECORDINGS_PATH", "data/model_recordings")
+# Fake backend: simulated latency per call (plus uniform jitter), share of calls that fail, share of "yes" verdicts
+FAKE_PROVIDER_LATENCY_MS = float(os.environ.get("FAKE_PROVIDER_LATENCY_MS", 0))
+FAKE_PROVIDER_JITTER_MS = float(os.environ.get("FAKE_PROVIDER_JITTER_MS", 0))
+FAKE_PROVIDER_ERROR_RATE = float(os.environ.get("FAKE_PROVIDER_ERROR_RATE", 0))
+FAKE_PROVIDER_YES_RATE = 0.5
+
+# Telemetry (see telemetry.py): per-stage spans feeding an in-process metrics registry. Latency percentiles
+# cover the last TELEMETRY_HISTOGRAM_SAMPLES observations per stage. A JSON line per request (and per span
+# with TELEMETRY_LOG_SPANS) goes to the "retailnext.telemetry" logger, and to TELEMETRY_LOG_PATH when set.
+# TELEMETRY_METRICS_PORT serves /metrics (Prometheus text) and /metrics.json from the Streamlit app
+TELEMETRY_ENABLED = True
+TELEMETRY_HISTOGRAM_SAMPLES = 2048
+TELEMETRY_LOG_SPANS = False
+TELEMETRY_LOG_PATH = os.environ.get("TELEMETRY_LOG_PATH")
+TELEMETRY_METRICS_PORT = int(os.environ["TELEMETRY_METRICS_PORT"]) if os.environ.get("TELEMETRY_METRICS_PORT") else None
+
+# On-demand profiling of one request (see profiling.py): "sample" (wall-clock stack sampling, written as
+# collapsed stacks for flamegraph tools) or "cprofile" (deterministic, pstats), each with a tracemalloc
+# top-allocations report in PROFILE_DIR. Enabled per request with ?profile=sample on the Streamlit app
+# or --profile on run_demo.py; the PROFILE environment variable profiles every request
+PROFILE = os.environ.get("PROFILE")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL_MS = 5
+PROFILE_TRACEMALLOC_FRAMES = 16
+PROFILE_TOP_ALLOCATIONS = 30
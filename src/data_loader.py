@@ -1,52 +1,199 @@
 """
 data_loader.py
-Utility for loading clothing data from GCP Cloud Storage or local files
+Utility for loading clothing data from the local embedding store, GCP Cloud Storage or local files
 """
 
+import os
+
+import numpy as np
 import pandas as pd
 import requests
-from config import EMBEDDINGS_FILE_URL, LOCAL_DATA_PATH
-import ast
+from config import EMBEDDINGS_FILE_URL, LOCAL_DATA_PATH, EMBEDDING_STORE_PATH, EMBEDDING_STORE_VERIFY, CATALOG_REQUEST_TIMEOUT
+from embedding_store import (
+    EmbeddingStoreError, MANIFEST_FILENAME, open_embedding_store, open_store_matrix, open_truncated_matrix, parse_embedding, read_manifest,
+)
+from similarity import truncate_rows
 
-def load_clothing_data():
+# DataFrame.attrs key holding the matrix checksum of the embedding store a catalog was loaded from
+STORE_CHECKSUM_ATTR = "store_checksum"
+
+
+def load_embedding_store(path=EMBEDDING_STORE_PATH, verify=EMBEDDING_STORE_VERIFY):
     """
-    Load clothing data with embeddings from GCP Cloud Storage or local file.
-    
+    Load clothing data from a binary embedding store.
+
+    The embeddings column holds row views into the memory-mapped float32 matrix, so no vector
+    is parsed or copied at load time. The store's matrix checksum is kept in
+    `attrs[STORE_CHECKSUM_ATTR]` so search indexes can tell which store the catalog came from.
+
     Returns:
         pandas.DataFrame: Clothing data with embeddings
     """
+    metadata, matrix, manifest = open_embedding_store(path, verify=verify)
+    metadata["embeddings"] = list(matrix)
+    metadata.attrs[STORE_CHECKSUM_ATTR] = manifest["files"]["matrix"]["sha256"]
+    print(f"✅ Opened embedding store {path} ({manifest['rows']} x {manifest['dim']}, v{manifest['version']})")
+    return metadata
+
+
+def _rows_in_store_order(embeddings, row_bytes):
+    """True if every vector is a view of consecutive rows of one matrix, i.e. no row was replaced or reordered."""
+    addresses = np.fromiter(
+        (row.__array_interface__["data"][0] if isinstance(row, np.ndarray) else -1 for row in embeddings),
+        dtype=np.int64, count=len(embeddings),
+    )
+    return bool(np.all(np.diff(addresses) == row_bytes)) and (len(addresses) == 0 or addresses[0] >= 0)
+
+
+def load_store_matrix(df_items, path=EMBEDDING_STORE_PATH):
+    """
+    The embedding store's memory-mapped matrix if `df_items` is the catalog loaded from that store,
+    otherwise None. Lets search structures keep full vectors on disk instead of copying them.
+    """
+    checksum = df_items.attrs.get(STORE_CHECKSUM_ATTR)
+    if checksum is None or not os.path.exists(os.path.join(path, MANIFEST_FILENAME)):
+        return None
+    try:
+        manifest = read_manifest(path)
+        if manifest["files"]["matrix"]["sha256"] != checksum or manifest["rows"] != len(df_items):
+            return None
+        # attrs survive filtering and sorting, so also check the rows are still the store's, in its order
+        if not _rows_in_store_order(df_items["embeddings"], manifest["dim"] * np.dtype(np.float32).itemsize):
+            return None
+        return open_store_matrix(path, manifest)
+    except EmbeddingStoreError as e:
+        print(f"⚠️  Could not open embedding store matrix: {e}")
+        return None
+
+
+def catalog_store_checksum(df_items, path=EMBEDDING_STORE_PATH):
+    """
+    store_checksum of the embedding store if `df_items` is the catalog loaded from that store, otherwise
+    None. Search indexes record the checksum of the store they were built from.
+    """
+    if load_store_matrix(df_items, path) is None:
+        return None
+    return df_items.attrs[STORE_CHECKSUM_ATTR]
+
+
+def load_search_matrices(df_items, dims, path=EMBEDDING_STORE_PATH):
+    """
+    Memory-mapped matrices for two-stage search over a catalog loaded from the embedding store: the full
+    vectors and the `dims`-wide truncated copy written by generate_embeddings.py (computed here if the
+    store has none yet).
+
+    Returns:
+        tuple: (full matrix, truncated matrix), or None if `df_items` is not the catalog in the store
+    """
+    full_matrix = load_store_matrix(df_items, path)
+    if full_matrix is None or not 0 < dims < full_matrix.shape[1]:
+        return None
+    try:
+        search_matrix = open_truncated_matrix(path, dims)
+    except EmbeddingStoreError as e:
+        print(f"⚠️  Could not open the {dims}-dim search matrix: {e}")
+        search_matrix = None
+    if search_matrix is None:
+        print(f"⚠️  Embedding store has no {dims}-dim matrix; truncating in memory (run generate_embeddings.py to store it)")
+        search_matrix = truncate_rows(full_matrix, dims)
+    return full_matrix, search_matrix
+
+
+def fetch_remote_catalog(url=EMBEDDINGS_FILE_URL, etag=None, last_modified=None):
+    """
+    Download the embeddings CSV, sending If-None-Match / If-Modified-Since when validators from a
+    previous download are given.
+
+    Returns:
+        tuple: (DataFrame, or None if the server answered 304 Not Modified, dict of new validators)
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    response = requests.get(url, headers=headers, timeout=CATALOG_REQUEST_TIMEOUT)
+    validators = {
+        "etag": response.headers.get("ETag", etag),
+        "last_modified": response.headers.get("Last-Modified", last_modified),
+    }
+    if response.status_code == 304:
+        return None, validators
+    response.raise_for_status()  # Raise exception for bad status codes
+
+    # Read CSV from the response content
+    from io import StringIO
+    csv_content = StringIO(response.text)
+    styles_df = pd.read_csv(csv_content, on_bad_lines="skip")
+    return styles_df, validators
+
+
+def load_catalog():
+    """
+    Load clothing data with embeddings from the local embedding store, GCP Cloud Storage or local file,
+    along with a description of the version that was loaded (used to detect changes later).
+
+    Returns:
+        tuple: (pandas.DataFrame with embeddings, dict with "source" and version validators)
+    """
+    if os.path.exists(os.path.join(EMBEDDING_STORE_PATH, MANIFEST_FILENAME)):
+        try:
+            styles_df = load_embedding_store(EMBEDDING_STORE_PATH)
+            print(f"🎯 Data loaded successfully! Shape: {styles_df.shape}")
+            return styles_df, {"source": "store", "checksum": styles_df.attrs[STORE_CHECKSUM_ATTR]}
+        except EmbeddingStoreError as e:
+            print(f"⚠️  Embedding store load failed: {e}")
+            print("🔄 Falling back to CSV...")
+
     try:
         # Try to load from GCP Cloud Storage first
         print(f"🔄 Loading data from GCP: {EMBEDDINGS_FILE_URL}")
-        response = requests.get(EMBEDDINGS_FILE_URL)
-        response.raise_for_status()  # Raise exception for bad status codes
-        
-        # Read CSV from the response content
-        from io import StringIO
-        csv_content = StringIO(response.text)
-        styles_df = pd.read_csv(csv_content, on_bad_lines="skip")
-        
+        styles_df, validators = fetch_remote_catalog()
+        version = {"source": "remote", **validators}
+
         print(f"✅ Successfully loaded {len(styles_df)} items from GCP Cloud Storage")
-        
+
     except Exception as e:
         print(f"⚠️  GCP load failed: {e}")
         print("🔄 Falling back to local file...")
-        
+
         try:
             # Fallback to local file
             styles_df = pd.read_csv(LOCAL_DATA_PATH, on_bad_lines="skip")
+            version = {"source": "local"}
             print(f"✅ Successfully loaded {len(styles_df)} items from local file")
         except Exception as local_error:
             print(f"❌ Local file load also failed: {local_error}")
             raise Exception("Could not load clothing data from either GCP or local file")
-    
-    # Convert embeddings from string to list of floats
+
+    styles_df = prepare_catalog(styles_df)
+    return styles_df, version
+
+
+def prepare_catalog(styles_df):
+    """Convert the embeddings column of a CSV-loaded catalog from text to float32 vectors."""
     print("🔄 Converting embeddings...")
-    styles_df["embeddings"] = styles_df["embeddings"].apply(ast.literal_eval)
-    
+    styles_df["embeddings"] = styles_df["embeddings"].apply(parse_embedding)
+
     print(f"🎯 Data loaded successfully! Shape: {styles_df.shape}")
     print(f"📊 Columns: {list(styles_df.columns)}")
-    
+    return styles_df
+
+
+def store_checksum(path=EMBEDDING_STORE_PATH):
+    """Matrix checksum recorded in an embedding store's manifest; changes whenever the store is rewritten."""
+    return read_manifest(path)["files"]["matrix"]["sha256"]
+
+
+def load_clothing_data():
+    """
+    Load clothing data with embeddings from the local embedding store, GCP Cloud Storage or local file.
+
+    Returns:
+        pandas.DataFrame: Clothing data with embeddings
+    """
+    styles_df, _ = load_catalog()
     return styles_df
 
 def get_sample_data_info():
@@ -0,0 +1,317 @@
+"""
+embedding_cache.py
+Two-tier cache for embedding vectors keyed by model name and normalized input text. An in-process
+LRU answers repeat queries without I/O; an SQLite file shared by all worker processes keeps vectors
+across restarts and is trimmed to a byte budget by evicting the least recently used entries.
+"""
+
+# Standard library imports
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# 3P Imports
+import numpy as np
+
+# Local application imports
+from config import (
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_MAX_BYTES,
+    EMBEDDING_CACHE_MEMORY_ITEMS,
+    EMBEDDING_CACHE_PATH,
+)
+
+# Stay well under SQLite's bound-parameter limit
+_SQL_BATCH = 500
+# Disk hits whose last_access update may be held back before reads write them in their own transaction
+_TOUCH_BATCH = 256
+# How long writes wait for another process's write lock
+_BUSY_TIMEOUT_SECONDS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access);
+CREATE TABLE IF NOT EXISTS embeddings_total (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+"""
+
+
+def normalize_text(text):
+    """Unicode-normalize, collapse whitespace and case-fold so trivially different strings share a key."""
+    return " ".join(unicodedata.normalize("NFKC", text).split()).casefold()
+
+
+def cache_key(model, item):
+    """
+    Cache key for one embedding input. Strings are normalized first; pre-tokenized inputs (lists of
+    token ids, as sent by generate_embeddings.py) are keyed on the exact token sequence.
+    """
+    if isinstance(item, str):
+        payload = "text:" + normalize_text(item)
+    else:
+        payload = "tokens:" + ",".join(str(int(token)) for token in item)
+    return hashlib.sha256(f"{model}\0{payload}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Memory + disk cache of embedding vectors.
+
+    Vectors are stored as float32. `path=None` disables the disk tier; the memory tier holds at
+    most `memory_items` vectors and the disk tier at most `max_disk_bytes` of vector data. The disk
+    tier's byte total is kept in the database next to the vectors (so every process sharing the file
+    sees the same figure) and updated with each write, instead of being summed on every write.
+    Reads do not write: the last-access times of disk hits are recorded in memory and written with
+    the next put_many (or once _TOUCH_BATCH of them are pending), so eviction order is approximate.
+    """
+
+    def __init__(self, path=None, memory_items=4096, max_disk_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # WAL lets readers in other worker processes proceed while one process writes
+            self._db = sqlite3.connect(path, timeout=_BUSY_TIMEOUT_SECONDS, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+            # Caches created before the running total existed are summed once
+            self._db.execute(
+                "INSERT OR IGNORE INTO embeddings_total (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM embeddings"
+            )
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Look up keys in memory, then on disk. Returns {key: vector} for the keys that were found."""
+        found = {}
+        with self._lock:
+            pending = []
+            for key in keys:
+                if key in found:
+                    continue
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                    self.memory_hits += 1
+                else:
+                    pending.append(key)
+
+            if pending and self._db is not None:
+                now = time.time()
+                for start in range(0, len(pending), _SQL_BATCH):
+                    batch = pending[start:start + _SQL_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[key] = vector
+                        self._remember(key, vector)
+                        self._touched[key] = now
+                        self.disk_hits += 1
+                if len(self._touched) >= _TOUCH_BATCH:
+                    self._flush_touched_locked()
+
+            self.misses += len(set(pending) - found.keys())
+        return found
+
+    def put_many(self, model, items):
+        """Store (key, vector) pairs in both tiers, then evict from disk if over the byte budget."""
+        items = [(key, np.asarray(vector, dtype=np.float32)) for key, vector in items]
+        with self._lock:
+            for key, vector in items:
+                self._remember(key, vector)
+            if self._db is None or not items:
+                return
+            now = time.time()
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                # A key given twice is stored once (its last vector); replaced rows give their bytes back
+                latest = dict(items)
+                added = sum(vector.nbytes for vector in latest.values()) - self._stored_bytes_locked(list(latest))
+                # Before the insert, so a pending older access time cannot overwrite a fresh one
+                self._write_touched_locked()
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                    [(key, model, vector.tobytes(), vector.nbytes, now) for key, vector in items],
+                )
+                self._db.execute("UPDATE embeddings_total SET bytes = bytes + ? WHERE id = 0", (added,))
+                self._evict_locked()
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _write_touched_locked(self):
+        if self._touched:
+            self._db.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(last_access, key) for key, last_access in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _flush_touched_locked(self):
+        # One short write transaction for many reads; if another process holds the write lock the
+        # access times simply stay pending, so a read never waits or fails because of them
+        self._db.execute("PRAGMA busy_timeout = 0")
+        try:
+            self._db.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            return
+        finally:
+            self._db.execute(f"PRAGMA busy_timeout = {_BUSY_TIMEOUT_SECONDS * 1000}")
+        try:
+            self._write_touched_locked()
+            self._db.execute("COMMIT")
+        except sqlite3.OperationalError:
+            self._db.execute("ROLLBACK")
+
+    def _stored_bytes_locked(self, keys):
+        # Bytes of the given keys already on disk (replaced by the write in progress); uses the primary key
+        stored = 0
+        for start in range(0, len(keys), _SQL_BATCH):
+            batch = keys[start:start + _SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            stored += self._db.execute(
+                f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchone()[0]
+        return stored
+
+    def _disk_bytes_locked(self):
+        return self._db.execute("SELECT bytes FROM embeddings_total WHERE id = 0").fetchone()[0]
+
+    def _evict_locked(self):
+        total = self._disk_bytes_locked()
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - self.max_disk_bytes
+        freed = 0
+        victims = []
+        for key, size in self._db.execute("SELECT key, size FROM embeddings ORDER BY last_access"):
+            victims.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._db.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._db.execute("UPDATE embeddings_total SET bytes = bytes - ? WHERE id = 0", (freed,))
+        self.evictions += len(victims)
+
+    def get_or_compute(self, model, inputs, compute):
+        """
+        Return one embedding per input. Cached vectors are served locally; all misses (deduplicated
+        by key) are sent to `compute` together as a single batch and then cached.
+        """
+        keys, found, missing = self._lookup(model, inputs)
+        if missing:
+            self._fill(model, found, missing, compute(list(missing.values())))
+        return [found[key] for key in keys]
+
+    async def get_or_compute_async(self, model, inputs, compute):
+        """
+        get_or_compute for a coroutine `compute`, e.g. one built on the async OpenAI client. With a
+        disk tier, the SQLite reads and writes run in a worker thread instead of blocking the event loop.
+        """
+        if self._db is None:
+            keys, found, missing = self._lookup(model, inputs)
+        else:
+            keys, found, missing = await asyncio.to_thread(self._lookup, model, inputs)
+        if missing:
+            vectors = await compute(list(missing.values()))
+            if self._db is None:
+                self._fill(model, found, missing, vectors)
+            else:
+                await asyncio.to_thread(self._fill, model, found, missing, vectors)
+        return [found[key] for key in keys]
+
+    def _lookup(self, model, inputs):
+        keys = [cache_key(model, item) for item in inputs]
+        found = self.get_many(keys)
+
+        missing = OrderedDict()
+        for key, item in zip(keys, inputs):
+            if key not in found and key not in missing:
+                missing[key] = item
+        return keys, found, missing
+
+    def _fill(self, model, found, missing, vectors):
+        computed = list(zip(missing.keys(), vectors))
+        self.put_many(model, computed)
+        found.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in computed)
+
+    def stats(self):
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            stats = {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "memory_items": len(self._memory),
+            }
+            if self._db is not None:
+                stats["disk_items"] = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                stats["disk_bytes"] = self._disk_bytes_locked()
+            return stats
+
+    def clear(self):
+        """Drop every cached vector from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            if self._db is not None:
+                self._db.execute("BEGIN IMMEDIATE")
+                self._db.execute("DELETE FROM embeddings")
+                self._db.execute("UPDATE embeddings_total SET bytes = 0 WHERE id = 0")
+                self._db.execute("COMMIT")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    """Process-wide cache configured from config.py, or None when caching is disabled."""
+    global _default_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                path=EMBEDDING_CACHE_PATH,
+                memory_items=EMBEDDING_CACHE_MEMORY_ITEMS,
+                max_disk_bytes=EMBEDDING_CACHE_MAX_BYTES,
+            )
+        return _default_cache
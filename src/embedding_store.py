@@ -0,0 +1,473 @@
+"""
+embedding_store.py
+Native on-disk format for the catalog embeddings. Vectors live in one contiguous little-endian
+float32 matrix that can be memory-mapped, the remaining catalog columns live in a CSV sidecar,
+and a JSON manifest records the format version, shape, model and checksums of both files.
+Optional Matryoshka-truncated copies of the matrix (see write_truncated_matrix) sit next to it.
+"""
+
+# Standard library imports
+import hashlib
+import json
+import os
+
+# 3P Imports
+import numpy as np
+import pandas as pd
+
+# Local application imports
+from similarity import truncate_rows
+
+STORE_FORMAT = "retailnext-embeddings"
+STORE_VERSION = 1
+
+MANIFEST_FILENAME = "manifest.json"
+MATRIX_FILENAME = "embeddings.f32"
+METADATA_FILENAME = "metadata.csv"
+
+# Metadata column identifying what each vector embeds (see content_hash)
+CONTENT_HASH_COLUMN = "content_hash"
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+_DTYPE = np.dtype("<f4")
+_PARTIAL_SUFFIX = ".partial"
+_HASH_CHUNK_BYTES = 1 << 20
+
+
+class EmbeddingStoreError(Exception):
+    """Raised when an embedding store is missing, malformed or fails verification."""
+
+
+def parse_embedding(value):
+    """
+    Parse one embedding serialized as text (e.g. "[0.1, -0.2, ...]") into a float32 vector.
+    json.loads is an order of magnitude faster than ast.literal_eval for plain float lists.
+    """
+    return np.asarray(json.loads(value), dtype=_DTYPE)
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class EmbeddingStoreWriter:
+    """
+    Incrementally writes an embedding store. Rows are appended in chunks so the full catalog never
+    has to be held in memory; files are written with a `.partial` suffix and only moved into place
+    (manifest last) when the writer is closed successfully.
+    """
+
+    def __init__(self, path, model=None):
+        self.path = path
+        self.model = model
+        self.rows = 0
+        self.dim = None
+        self._matrix_hash = hashlib.sha256()
+        self._metadata_hash = hashlib.sha256()
+        self._columns = None
+        self._header_written = False
+        self._closed = False
+
+        os.makedirs(path, exist_ok=True)
+        self._matrix_file = open(self._partial(MATRIX_FILENAME), "wb")
+        self._metadata_file = open(self._partial(METADATA_FILENAME), "w", encoding="utf-8", newline="")
+
+    def _partial(self, filename):
+        return os.path.join(self.path, filename + _PARTIAL_SUFFIX)
+
+    def append(self, metadata_df, embeddings):
+        """Append a chunk of catalog rows and their embeddings (one vector per row)."""
+        matrix = np.ascontiguousarray(np.asarray(embeddings, dtype=_DTYPE))
+        if matrix.ndim != 2:
+            raise EmbeddingStoreError(f"Expected a 2-D embedding matrix, got shape {matrix.shape}")
+        if len(metadata_df) != matrix.shape[0]:
+            raise EmbeddingStoreError(
+                f"Metadata has {len(metadata_df)} rows but {matrix.shape[0]} embeddings were given"
+            )
+        if self.dim is None:
+            self.dim = matrix.shape[1]
+        elif matrix.shape[1] != self.dim:
+            raise EmbeddingStoreError(f"Embedding width changed from {self.dim} to {matrix.shape[1]}")
+
+        metadata_df = metadata_df.drop(columns=["embeddings"], errors="ignore")
+        if self._columns is None:
+            self._columns = list(metadata_df.columns)
+        elif list(metadata_df.columns) != self._columns:
+            raise EmbeddingStoreError("Metadata columns changed between chunks")
+
+        data = matrix.tobytes()
+        self._matrix_file.write(data)
+        self._matrix_hash.update(data)
+
+        text = metadata_df.to_csv(index=False, header=not self._header_written)
+        self._header_written = True
+        self._metadata_file.write(text)
+        self._metadata_hash.update(text.encode("utf-8"))
+
+        self.rows += matrix.shape[0]
+
+    def close(self):
+        """Finalize the store and return its manifest."""
+        if self._closed:
+            raise EmbeddingStoreError("Embedding store writer is already closed")
+        self._closed = True
+        self._matrix_file.close()
+        self._metadata_file.close()
+
+        manifest = {
+            "format": STORE_FORMAT,
+            "version": STORE_VERSION,
+            "dtype": _DTYPE.str,
+            "rows": self.rows,
+            "dim": self.dim or 0,
+            "model": self.model,
+            "columns": self._columns or [],
+            "files": {
+                "matrix": {"name": MATRIX_FILENAME, "sha256": self._matrix_hash.hexdigest()},
+                "metadata": {"name": METADATA_FILENAME, "sha256": self._metadata_hash.hexdigest()},
+            },
+        }
+
+        # Move data files into place before the manifest so a reader never sees a manifest
+        # describing files that are not there yet
+        os.replace(self._partial(MATRIX_FILENAME), os.path.join(self.path, MATRIX_FILENAME))
+        os.replace(self._partial(METADATA_FILENAME), os.path.join(self.path, METADATA_FILENAME))
+        with open(self._partial(MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self._partial(MANIFEST_FILENAME), os.path.join(self.path, MANIFEST_FILENAME))
+        return manifest
+
+    def abort(self):
+        """Discard everything written so far."""
+        if self._closed:
+            return
+        self._closed = True
+        self._matrix_file.close()
+        self._metadata_file.close()
+        for filename in (MATRIX_FILENAME, METADATA_FILENAME):
+            try:
+                os.remove(self._partial(filename))
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def write_embedding_store(path, df, embeddings=None, model=None):
+    """
+    Write a catalog DataFrame and its embeddings as an embedding store.
+    If `embeddings` is omitted, the DataFrame's 'embeddings' column is used.
+    """
+    if embeddings is None:
+        embeddings = np.stack(df["embeddings"].to_numpy())
+    with EmbeddingStoreWriter(path, model=model) as writer:
+        writer.append(df, embeddings)
+    return read_manifest(path)
+
+
+def read_manifest(path):
+    """Read and validate the manifest of an embedding store."""
+    manifest_path = os.path.join(path, MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise EmbeddingStoreError(f"No embedding store manifest at {manifest_path}")
+    except json.JSONDecodeError as e:
+        raise EmbeddingStoreError(f"Corrupt embedding store manifest at {manifest_path}: {e}")
+
+    if manifest.get("format") != STORE_FORMAT:
+        raise EmbeddingStoreError(f"Unknown embedding store format: {manifest.get('format')!r}")
+    if manifest.get("version") != STORE_VERSION:
+        raise EmbeddingStoreError(
+            f"Unsupported embedding store version {manifest.get('version')} (expected {STORE_VERSION})"
+        )
+    return manifest
+
+
+def verify_embedding_store(path, manifest=None):
+    """Recompute the checksums of an embedding store and raise if they do not match the manifest."""
+    manifest = manifest or read_manifest(path)
+    entries = list(manifest["files"].items())
+    entries += [(f"{dims}-dim truncated", entry) for dims, entry in manifest.get("truncations", {}).items()]
+    for role, entry in entries:
+        actual = _sha256_file(os.path.join(path, entry["name"]))
+        if actual != entry["sha256"]:
+            raise EmbeddingStoreError(f"Checksum mismatch for {role} file {entry['name']}")
+
+
+def _map_matrix(matrix_path, rows, dim):
+    """Memory-map a (rows, dim) float32 matrix file read-only after checking its size."""
+    expected_bytes = rows * dim * _DTYPE.itemsize
+    try:
+        actual_bytes = os.path.getsize(matrix_path)
+    except OSError as e:
+        raise EmbeddingStoreError(f"Embedding matrix missing: {e}")
+    if actual_bytes != expected_bytes:
+        raise EmbeddingStoreError(
+            f"Embedding matrix is {actual_bytes} bytes, expected {expected_bytes} for shape ({rows}, {dim})"
+        )
+
+    if rows == 0:
+        return np.empty((0, dim), dtype=_DTYPE)
+    # np.asarray drops the memmap subclass but keeps the mapped buffer, so slicing stays cheap
+    return np.asarray(np.memmap(matrix_path, dtype=_DTYPE, mode="r", shape=(rows, dim)))
+
+
+def open_store_matrix(path, manifest=None):
+    """Memory-map only the float32 matrix of an embedding store (no metadata is read)."""
+    manifest = manifest or read_manifest(path)
+    return _map_matrix(os.path.join(path, manifest["files"]["matrix"]["name"]), manifest["rows"], manifest["dim"])
+
+
+def open_embedding_store(path, verify=False):
+    """
+    Open an embedding store.
+
+    The matrix is memory-mapped read-only, so opening is near-instant regardless of catalog size and
+    pages are shared between processes. Shape and file size are always checked; full checksums are
+    only recomputed when `verify` is True since that reads every byte.
+
+    Returns:
+        tuple: (metadata DataFrame, float32 matrix of shape (rows, dim), manifest dict)
+    """
+    manifest = read_manifest(path)
+    if verify:
+        verify_embedding_store(path, manifest)
+
+    rows = manifest["rows"]
+    matrix = open_store_matrix(path, manifest)
+
+    metadata = pd.read_csv(os.path.join(path, manifest["files"]["metadata"]["name"]))
+    if len(metadata) != rows:
+        raise EmbeddingStoreError(f"Metadata has {len(metadata)} rows, manifest says {rows}")
+
+    return metadata, matrix, manifest
+
+
+def convert_csv_to_store(csv_path, store_path, model=None, chunksize=2000):
+    """
+    One-shot conversion of a CSV with an 'embeddings' text column (the historical
+    sample_styles_with_embeddings.csv layout) into an embedding store. The CSV is streamed in chunks
+    so peak memory stays bounded by the chunk size rather than the catalog size.
+    """
+    with EmbeddingStoreWriter(store_path, model=model) as writer:
+        for chunk in pd.read_csv(csv_path, on_bad_lines="skip", chunksize=chunksize):
+            vectors = np.stack([parse_embedding(value) for value in chunk["embeddings"]])
+            writer.append(chunk, vectors)
+    return read_manifest(store_path)
+
+
+def truncated_matrix_filename(dims):
+    return f"embeddings.d{dims}.f32"
+
+
+def write_truncated_matrix(path, dims, batch_rows=65536):
+    """
+    Add a Matryoshka-truncated copy of the store's matrix (first `dims` components of every vector,
+    re-normalized) for first-stage search, and record it under "truncations" in the manifest.
+    The full matrix is streamed in batches, so this works on catalogs larger than memory.
+
+    Returns:
+        dict: the updated manifest
+    """
+    manifest = read_manifest(path)
+    rows, dim = manifest["rows"], manifest["dim"]
+    if not 0 < dims < dim:
+        raise EmbeddingStoreError(f"Cannot truncate {dim}-dim embeddings to {dims} dims")
+    matrix = open_store_matrix(path, manifest)
+
+    filename = truncated_matrix_filename(dims)
+    digest = hashlib.sha256()
+    with open(os.path.join(path, filename + _PARTIAL_SUFFIX), "wb") as f:
+        for start in range(0, rows, batch_rows):
+            data = truncate_rows(matrix[start:start + batch_rows], dims).astype(_DTYPE, copy=False).tobytes()
+            f.write(data)
+            digest.update(data)
+
+    manifest.setdefault("truncations", {})[str(dims)] = {"name": filename, "sha256": digest.hexdigest()}
+    # Same ordering as EmbeddingStoreWriter.close: data file first, manifest last
+    os.replace(os.path.join(path, filename + _PARTIAL_SUFFIX), os.path.join(path, filename))
+    with open(os.path.join(path, MANIFEST_FILENAME + _PARTIAL_SUFFIX), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(os.path.join(path, MANIFEST_FILENAME + _PARTIAL_SUFFIX), os.path.join(path, MANIFEST_FILENAME))
+    return manifest
+
+
+def open_truncated_matrix(path, dims, manifest=None):
+    """
+    Memory-map the `dims`-wide truncated matrix written by write_truncated_matrix, or return None if
+    the store has none (a rewritten store drops its truncations from the manifest until they are rebuilt).
+    """
+    manifest = manifest or read_manifest(path)
+    entry = manifest.get("truncations", {}).get(str(dims))
+    if entry is None:
+        return None
+    return _map_matrix(os.path.join(path, entry["name"]), manifest["rows"], dims)
+
+
+def content_hash(text, model):
+    """Identity of an embedding: the exact text embedded and the model that embedded it."""
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()[:32]
+
+
+class HashIndex:
+    """
+    Compact lookup from content hash to position: a sorted array of 16-byte hash digests plus their
+    positions (24 bytes per entry), so indexing millions of rows costs tens of MB rather than the
+    hundreds a dict of strings would.
+    """
+
+    def __init__(self, hashes):
+        keys = self._keys_of(hashes)
+        self._order = np.argsort(keys, kind="stable")
+        self._keys = keys[self._order]
+
+    @staticmethod
+    def _keys_of(hashes):
+        return np.array([bytes.fromhex(value) for value in hashes], dtype="S16")
+
+    def __len__(self):
+        return len(self._keys)
+
+    def lookup(self, hashes):
+        """Position of each hash in the indexed sequence, or -1 where it is absent."""
+        queries = self._keys_of(hashes)
+        if len(self._keys) == 0:
+            return np.full(len(queries), -1, dtype=np.int64)
+        slots = np.minimum(np.searchsorted(self._keys, queries), len(self._keys) - 1)
+        return np.where(self._keys[slots] == queries, self._order[slots], -1)
+
+    def spread(self, marked):
+        """Boolean mask over positions: `marked` extended to every position sharing a hash with a marked one."""
+        marked = np.asarray(marked, dtype=bool)
+        if len(self._keys) == 0:
+            return marked.copy()
+        groups = np.concatenate(([0], np.cumsum(self._keys[1:] != self._keys[:-1])))
+        group_marked = np.zeros(groups[-1] + 1, dtype=bool)
+        group_marked[groups[marked[self._order]]] = True
+        spread = np.empty(len(marked), dtype=bool)
+        spread[self._order] = group_marked[groups]
+        return spread
+
+
+def store_vectors_by_hash(path, model, text_column):
+    """
+    Index the vectors of an existing store by content hash so unchanged rows can be reused.
+    Stores written before content hashes were recorded are hashed from `text_column`.
+
+    Returns:
+        tuple: (HashIndex over store rows, matrix), or (None, None) if there is no usable store for `model`
+    """
+    try:
+        metadata, matrix, manifest = open_embedding_store(path)
+    except (EmbeddingStoreError, OSError):
+        return None, None
+    if manifest.get("model") != model:
+        return None, None
+    if CONTENT_HASH_COLUMN in metadata.columns:
+        hashes = metadata[CONTENT_HASH_COLUMN].astype(str)
+    elif text_column in metadata.columns:
+        hashes = [content_hash(text, model) for text in metadata[text_column].astype(str)]
+    else:
+        return None, None
+    return HashIndex(hashes), matrix
+
+
+class EmbeddingCheckpoint:
+    """
+    Progress of an interrupted embedding run: each chunk of freshly computed vectors is saved as its
+    own .npy file plus a JSON list of their content hashes (each written to `.partial`, then renamed;
+    the hash list last, so a chunk only counts once both are complete). A crash loses at most the
+    chunk in flight and a rerun picks up everything already paid for. Chunks from previous runs are
+    memory-mapped and indexed with a HashIndex, so resuming does not grow memory with their size.
+    """
+
+    def __init__(self, path, model):
+        self.path = path
+        self.model = model
+        self.chunks = 0
+        self._index = None
+        self._arrays = []
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def _chunk_path(self, number, extension):
+        return os.path.join(self.path, f"chunk-{number:06d}{extension}")
+
+    def load(self):
+        """Index the chunks saved by previous runs for this model; returns the number of vectors."""
+        hashes = []
+        if os.path.isdir(self.path):
+            for filename in sorted(os.listdir(self.path)):
+                if not filename.endswith(".json"):
+                    continue
+                number = int(filename[len("chunk-"):-len(".json")])
+                self.chunks = max(self.chunks, number + 1)
+                try:
+                    with open(os.path.join(self.path, filename), "r", encoding="utf-8") as f:
+                        chunk = json.load(f)
+                    if chunk.get("model") != self.model:
+                        continue
+                    vectors = np.load(self._chunk_path(number, ".npy"), mmap_mode="r")
+                    if len(vectors) != len(chunk["hashes"]):
+                        raise ValueError(f"{len(chunk['hashes'])} hashes for {len(vectors)} vectors")
+                except (OSError, KeyError, ValueError) as e:
+                    print(f"⚠️  Ignoring unreadable checkpoint chunk {filename}: {e}")
+                    continue
+                self._arrays.append(vectors)
+                hashes.extend(chunk["hashes"])
+        self._offsets = np.cumsum([0] + [len(vectors) for vectors in self._arrays])
+        self._index = HashIndex(hashes)
+        return len(self)
+
+    def lookup(self, hashes):
+        """Checkpoint position of each hash (loaded chunks only), or -1 where it is absent."""
+        if self._index is None:
+            return np.full(len(hashes), -1, dtype=np.int64)
+        return self._index.lookup(hashes)
+
+    def vector(self, position):
+        chunk = int(np.searchsorted(self._offsets, position, side="right")) - 1
+        return self._arrays[chunk][position - self._offsets[chunk]]
+
+    def append(self, hashes, vectors):
+        """Durably save one chunk of (content hash, vector) pairs (read back by the next run's load())."""
+        os.makedirs(self.path, exist_ok=True)
+        number = self.chunks
+        self.chunks += 1
+        for extension, write in (
+            (".npy", lambda f: np.save(f, np.asarray(vectors, dtype=_DTYPE))),
+            (".json", lambda f: f.write(json.dumps({"model": self.model, "hashes": list(hashes)}).encode("utf-8"))),
+        ):
+            final = self._chunk_path(number, extension)
+            with open(final + _PARTIAL_SUFFIX, "wb") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(final + _PARTIAL_SUFFIX, final)
+
+    def clear(self):
+        """Remove the checkpoint once its vectors are in the store."""
+        self._index = None
+        self._arrays.clear()
+        self._offsets = np.zeros(1, dtype=np.int64)
+        if not os.path.isdir(self.path):
+            return
+        for filename in os.listdir(self.path):
+            os.remove(os.path.join(self.path, filename))
+        os.rmdir(self.path)
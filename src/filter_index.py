@@ -0,0 +1,90 @@
+"""
+filter_index.py
+Attribute filter index for pre-filtering the catalog before similarity search. Posting lists of row
+positions are built once per attribute value at load time, so a filter such as "same gender or Unisex,
+different category" becomes a handful of array operations instead of DataFrame masks and copies.
+"""
+
+# 3P Imports
+import numpy as np
+import pandas as pd
+
+FILTER_COLUMNS = ("gender", "articleType", "baseColour", "usage")
+
+
+def _as_values(value):
+    if isinstance(value, (list, tuple, set, frozenset, np.ndarray, pd.Index)):
+        return list(value)
+    return [value]
+
+
+def complementary_filter(gender, category):
+    """
+    Filter expression for outfit matching: items for the same gender (or Unisex) from a different
+    category than the uploaded item.
+    """
+    return {
+        "include": {"gender": [gender, "Unisex"]},
+        "exclude": {"articleType": [category]},
+    }
+
+
+class FilterIndex:
+    """
+    Posting lists (sorted row positions) per value of each filterable column.
+
+    A filter expression is a dict with optional "include" and "exclude" clauses, each mapping a column
+    to a value or list of values. A row matches when, for every include clause, its value is one of the
+    listed values, and for no exclude clause is its value listed.
+    """
+
+    def __init__(self, df_items, columns=FILTER_COLUMNS):
+        self.size = len(df_items)
+        self.postings = {}
+        dtype = np.int32 if self.size < np.iinfo(np.int32).max else np.int64
+        for column in columns:
+            if column not in df_items.columns:
+                continue
+            codes, values = pd.factorize(df_items[column])
+            order = np.argsort(codes, kind="stable").astype(dtype)
+            counts = np.bincount(codes[codes >= 0], minlength=len(values))
+            # Rows with missing values (code -1) sort first and are left out of every posting list
+            start = int(np.count_nonzero(codes < 0))
+            self.postings[column] = {}
+            for value, count in zip(values, counts):
+                self.postings[column][value] = order[start:start + count]
+                start += count
+
+    def values(self, column):
+        """Distinct values indexed for a column."""
+        return list(self.postings[column])
+
+    def rows(self, column, values):
+        """Row positions whose `column` is one of `values`, as a sorted array."""
+        if column not in self.postings:
+            raise ValueError(f"Column {column!r} is not in the filter index (indexed: {list(self.postings)})")
+        lists = [self.postings[column].get(value) for value in _as_values(values)]
+        lists = [rows for rows in lists if rows is not None]
+        if not lists:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(lists)) if len(lists) > 1 else lists[0]
+
+    def mask(self, expression=None):
+        """Boolean bitmap over catalog rows for a filter expression (None matches everything)."""
+        expression = expression or {}
+        mask = np.ones(self.size, dtype=bool)
+        for column, values in (expression.get("include") or {}).items():
+            clause = np.zeros(self.size, dtype=bool)
+            clause[self.rows(column, values)] = True
+            mask &= clause
+        for column, values in (expression.get("exclude") or {}).items():
+            mask[self.rows(column, values)] = False
+        return mask
+
+    def select(self, expression=None):
+        """Sorted row positions matching a filter expression."""
+        return np.flatnonzero(self.mask(expression))
+
+    def count(self, expression=None):
+        """Number of catalog rows matching a filter expression."""
+        return int(np.count_nonzero(self.mask(expression)))
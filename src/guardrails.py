@@ -4,20 +4,107 @@ Contains business logic filters and constraints used to refine matching results.
 images are sent back to the model and asked if they are relevant (Yes/No) and provide justification.
 """
 
-# 3P Imports
-from openai import OpenAI
+# Standard library imports
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import hashlib
+import json
+import threading
 
 # Local Application Imports
-from config import GPT_MODEL
+from config import GPT_MODEL, GUARDRAIL_BATCH_SIZE, GUARDRAIL_MAX_CONCURRENCY, GUARDRAIL_PROMPT_VERSION
+from config import GUARDRAIL_TARGET_MATCHES
+from config import GUARDRAIL_CACHE_ENABLED, GUARDRAIL_CACHE_MAX_ENTRIES, GUARDRAIL_CACHE_PATH, GUARDRAIL_CACHE_TTL_SECONDS
+from image_prep import image_base64, image_data_url
+from providers import get_provider
+from telemetry import current_span, span
+from ttl_cache import TTLCache
 
-# Initialize OpenAI client 
-client = OpenAI()
+# Fallback verdicts returned when the model cannot be used; never cached
+_RETRY_VERDICT = '{"answer": "no", "reason": "Unable to validate compatibility - please try again"}'
+_ERROR_VERDICT = '{"answer": "no", "reason": "Validation failed due to technical error"}'
 
-def check_match(reference_image_base64, suggested_image_base64):
+_verdict_cache = None
+_verdict_cache_lock = threading.Lock()
+
+_usage = {"calls": 0, "batched_calls": 0, "fallbacks": 0, "candidates": 0, "prompt_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
+
+
+def get_verdict_cache():
+    """Process-wide verdict cache configured from config.py, or None when caching is disabled."""
+    global _verdict_cache
+    if not GUARDRAIL_CACHE_ENABLED:
+        return None
+    with _verdict_cache_lock:
+        if _verdict_cache is None:
+            _verdict_cache = TTLCache(
+                max_entries=GUARDRAIL_CACHE_MAX_ENTRIES,
+                ttl_seconds=GUARDRAIL_CACHE_TTL_SECONDS,
+                path=GUARDRAIL_CACHE_PATH,
+            )
+        return _verdict_cache
+
+
+@functools.lru_cache(maxsize=64)
+def image_hash(image_base64):
+    """Content hash of a base64-encoded image (memoized, since one reference is checked against many candidates)."""
+    return hashlib.sha256(image_base64.encode("ascii")).hexdigest()
+
+
+def verdict_cache_key(reference_image_base64, candidate_id):
+    """Cache key: model (and provider), prompt version, reference image content and catalog candidate id."""
+    return f"{get_provider().model_key(GPT_MODEL)}:{GUARDRAIL_PROMPT_VERSION}:{image_hash(image_base64(reference_image_base64))}:{candidate_id}"
+
+
+def _cached_verdict(reference_image_base64, candidate_id):
+    cache = get_verdict_cache()
+    if cache is None or candidate_id is None:
+        return None
+    result = cache.get(verdict_cache_key(reference_image_base64, candidate_id))
+    current_span().add(**{"cache_hits" if result is not None else "cache_misses": 1})
+    return result
+
+
+def _store_verdict(reference_image_base64, candidate_id, result):
+    cache = get_verdict_cache()
+    if cache is None or candidate_id is None or result in (_RETRY_VERDICT, _ERROR_VERDICT):
+        return
     try:
-        response = client.chat.completions.create(
-            model=GPT_MODEL,
-            messages=[
+        json.loads(result)
+    except (TypeError, json.JSONDecodeError):
+        return
+    cache.set(verdict_cache_key(reference_image_base64, candidate_id), result)
+
+
+def verdict_cache_stats():
+    """Verdict cache counters; every hit is a vision call that was not made."""
+    cache = get_verdict_cache()
+    if cache is None:
+        return {"enabled": False, "vision_calls_saved": 0}
+    stats = cache.stats()
+    return {"enabled": True, "vision_calls_saved": stats["hits"], **stats}
+
+
+def check_match(reference_image_base64, suggested_image_base64, candidate_id=None):
+    """
+    Ask the model whether the suggested item goes with the reference item; returns a JSON string
+    with "answer" and "reason". Images are base64 JPEG strings or PreparedImages from image_prep.
+    When the catalog `candidate_id` is given, verdicts are cached per (reference image, candidate) pair.
+    """
+    with span("check_match", candidate_id=candidate_id):
+        cached = _cached_verdict(reference_image_base64, candidate_id)
+        if cached is not None:
+            return cached
+        result = _request_match(reference_image_base64, suggested_image_base64)
+        _store_verdict(reference_image_base64, candidate_id, result)
+        return result
+
+
+def _match_messages(reference_image_base64, suggested_image_base64):
+    return [
                 {
                 "role": "user",
                 "content": [
@@ -36,29 +123,344 @@ def check_match(reference_image_base64, suggested_image_base64):
                     {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{reference_image_base64}",
+                        "url": image_data_url(reference_image_base64),
                     },
                     },
                     {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{suggested_image_base64}",
+                        "url": image_data_url(suggested_image_base64),
                     },
                     }
                 ],
                 }
-            ],
-            max_completion_tokens=600
-        )
-        # Extract relevant features from the response
-        features = response.choices[0].message.content
-        
-        # Validate we got a proper response
-        if not features or features.strip() == '':
-            return '{"answer": "no", "reason": "Unable to validate compatibility - please try again"}'
-        
-        return features
-        
+            ]
+
+
+def _match_result(response, messages):
+    _record_usage(response, messages, candidates=1)
+    # Extract relevant features from the response
+    features = response.text
+
+    # Validate we got a proper response
+    if not features or features.strip() == '':
+        return _RETRY_VERDICT
+
+    return features
+
+
+def _request_match(reference_image_base64, suggested_image_base64):
+    try:
+        messages = _match_messages(reference_image_base64, suggested_image_base64)
+        response = get_provider().chat(GPT_MODEL, messages, task="guardrail", max_completion_tokens=600)
+        return _match_result(response, messages)
+
     except Exception as e:
-        return '{"answer": "no", "reason": "Validation failed due to technical error"}'
+        current_span().add(model_errors=1)
+        return _ERROR_VERDICT
+
+
+async def _request_match_async(reference_image_base64, suggested_image_base64):
+    try:
+        messages = _match_messages(reference_image_base64, suggested_image_base64)
+        response = await get_provider().chat_async(GPT_MODEL, messages, task="guardrail", max_completion_tokens=600)
+        return _match_result(response, messages)
+
+    except Exception:
+        current_span().add(model_errors=1)
+        return _ERROR_VERDICT
+
+
+async def check_match_async(reference_image_base64, suggested_image_base64, candidate_id=None):
+    """check_match on the provider's async API, sharing the verdict cache with the sync path."""
+    with span("check_match", candidate_id=candidate_id):
+        cached = _cached_verdict(reference_image_base64, candidate_id)
+        if cached is not None:
+            return cached
+        result = await _request_match_async(reference_image_base64, suggested_image_base64)
+        _store_verdict(reference_image_base64, candidate_id, result)
+        return result
+
+
+def _record_usage(response, messages, candidates, batched=False):
+    current_span().record_model_call(GPT_MODEL, response.prompt_tokens, response.completion_tokens, messages)
+    with _usage_lock:
+        _usage["calls"] += 1
+        _usage["batched_calls"] += int(batched)
+        _usage["candidates"] += candidates
+        _usage["prompt_tokens"] += response.prompt_tokens
+        _usage["completion_tokens"] += response.completion_tokens
+
+
+def guardrail_usage_stats():
+    """Process-wide guardrail call counters: model calls, candidates judged and tokens billed."""
+    with _usage_lock:
+        stats = dict(_usage)
+    stats["total_tokens"] = stats["prompt_tokens"] + stats["completion_tokens"]
+    stats["tokens_per_candidate"] = stats["total_tokens"] / stats["candidates"] if stats["candidates"] else 0.0
+    return stats
+
+
+def reset_guardrail_usage():
+    with _usage_lock:
+        for key in _usage:
+            _usage[key] = 0
+
 
+def _batch_messages(reference_image_base64, suggested_images_base64):
+    content = [
+        {
+        "type": "text",
+        "text": f""" You will be given a reference image of an item of clothing followed by {len(suggested_images_base64)} numbered candidate images of other items.
+                    Your goal is to decide, for each candidate independently, if it would work in an outfit together with the reference item.
+                    Your response must be a JSON object with a single field "verdicts": a list with exactly one entry per candidate, in candidate order.
+                    Each entry must have the fields "candidate", "answer", "reason".
+                    The "candidate" field is the candidate number as an integer.
+                    The "answer" field must be either "yes" or "no", depending on whether you think the items would work well together.
+                    The "reason" field must be a short explanation of your reasoning for your decision. Do not include the descriptions of the images.
+                    Do not include the ```json ``` tag in the output.
+                   """,
+        },
+        {"type": "text", "text": "Reference item:"},
+        {"type": "image_url", "image_url": {"url": image_data_url(reference_image_base64)}},
+    ]
+    for number, suggested_image_base64 in enumerate(suggested_images_base64, start=1):
+        content.append({"type": "text", "text": f"Candidate {number}:"})
+        content.append({"type": "image_url", "image_url": {"url": image_data_url(suggested_image_base64)}})
+    return [{"role": "user", "content": content}]
+
+
+def _request_matches(reference_image_base64, suggested_images_base64):
+    """
+    One vision call judging several candidates against the reference. Returns the raw response
+    text, or None if the call failed.
+    """
+    messages = _batch_messages(reference_image_base64, suggested_images_base64)
+    try:
+        response = get_provider().chat(
+            GPT_MODEL,
+            messages,
+            task="guardrail_batch",
+            max_completion_tokens=400 + 300 * len(suggested_images_base64),
+        )
+        # Candidates are counted once the response parses; a failed batch only adds to the token totals
+        _record_usage(response, messages, candidates=0, batched=True)
+        return response.text
+    except Exception:
+        current_span().add(model_errors=1)
+        return None
+
+
+async def _request_matches_async(reference_image_base64, suggested_images_base64):
+    """_request_matches on the provider's async API."""
+    messages = _batch_messages(reference_image_base64, suggested_images_base64)
+    try:
+        response = await get_provider().chat_async(
+            GPT_MODEL,
+            messages,
+            task="guardrail_batch",
+            max_completion_tokens=400 + 300 * len(suggested_images_base64),
+        )
+        _record_usage(response, messages, candidates=0, batched=True)
+        return response.text
+    except Exception:
+        current_span().add(model_errors=1)
+        return None
+
+
+def parse_batch_verdicts(result, count):
+    """
+    Split a batched response into one check_match-style JSON string per candidate, in candidate
+    order. Returns None unless every candidate 1..count has exactly one valid verdict.
+    """
+    try:
+        text = result.strip()
+        if text.startswith("```"):
+            text = text.strip("`").removeprefix("json").strip()
+        verdicts = json.loads(text)["verdicts"]
+        by_number = {}
+        for verdict in verdicts:
+            number = int(verdict["candidate"])
+            if verdict.get("answer") not in ("yes", "no") or number in by_number:
+                return None
+            by_number[number] = {"answer": verdict["answer"], "reason": str(verdict.get("reason", ""))}
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    if sorted(by_number) != list(range(1, count + 1)):
+        return None
+    return [json.dumps(by_number[number]) for number in range(1, count + 1)]
+
+
+def check_matches(reference_image_base64, suggested_images_base64, candidate_ids=None):
+    """
+    Batched check_match: judge several candidates against the reference in one vision call, sending
+    the reference image once. Returns one check_match-style JSON string per candidate, in order.
+    Cached verdicts are reused when `candidate_ids` are given; if the batched response cannot be
+    parsed, the remaining candidates are checked pairwise with check_match.
+    """
+    with span("check_matches", candidates=len(suggested_images_base64)):
+        candidate_ids = list(candidate_ids) if candidate_ids is not None else [None] * len(suggested_images_base64)
+        results = [_cached_verdict(reference_image_base64, candidate_id) for candidate_id in candidate_ids]
+        return _check_matches(reference_image_base64, suggested_images_base64, candidate_ids, results)
+
+
+def _take_batch_verdicts(reference_image_base64, candidate_ids, results, pending, raw):
+    """
+    Fill the `pending` entries of `results` from a batched response. Returns the candidates still to be
+    checked pairwise: none if the response parsed, all of them otherwise.
+    """
+    verdicts = parse_batch_verdicts(raw, len(pending)) if raw else None
+    if verdicts is None:
+        with _usage_lock:
+            _usage["fallbacks"] += 1
+        return pending
+    for i, verdict in zip(pending, verdicts):
+        results[i] = verdict
+        _store_verdict(reference_image_base64, candidate_ids[i], verdict)
+    with _usage_lock:
+        _usage["candidates"] += len(verdicts)
+    return []
+
+
+def _check_matches(reference_image_base64, suggested_images_base64, candidate_ids, results):
+    """check_matches for the candidates whose `results` entry (cached verdict) is None."""
+    results = list(results)
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    if len(pending) > 1:
+        raw = _request_matches(reference_image_base64, [suggested_images_base64[i] for i in pending])
+        pending = _take_batch_verdicts(reference_image_base64, candidate_ids, results, pending, raw)
+
+    for i in pending:
+        results[i] = _request_match(reference_image_base64, suggested_images_base64[i])
+        _store_verdict(reference_image_base64, candidate_ids[i], results[i])
+    return results
+
+
+async def check_matches_async(reference_image_base64, suggested_images_base64, candidate_ids=None):
+    """check_matches on the provider's async API; pairwise fallback checks run concurrently."""
+    with span("check_matches", candidates=len(suggested_images_base64)):
+        candidate_ids = list(candidate_ids) if candidate_ids is not None else [None] * len(suggested_images_base64)
+        current_span().set(candidate_ids=candidate_ids)
+        results = [_cached_verdict(reference_image_base64, candidate_id) for candidate_id in candidate_ids]
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        if len(pending) > 1:
+            raw = await _request_matches_async(reference_image_base64, [suggested_images_base64[i] for i in pending])
+            pending = _take_batch_verdicts(reference_image_base64, candidate_ids, results, pending, raw)
+
+        fallbacks = await asyncio.gather(
+            *(_request_match_async(reference_image_base64, suggested_images_base64[i]) for i in pending)
+        )
+        for i, result in zip(pending, fallbacks):
+            results[i] = result
+            _store_verdict(reference_image_base64, candidate_ids[i], result)
+        return results
+
+
+def parse_verdict(result):
+    """Parse a check_match response into a dict; anything unparseable counts as a "no"."""
+    try:
+        verdict = json.loads(result)
+        if isinstance(verdict, dict) and verdict.get("answer") in ("yes", "no"):
+            return verdict
+    except (TypeError, json.JSONDecodeError):
+        pass
+    return {"answer": "no", "reason": "Unable to validate compatibility - please try again"}
+
+
+@span("check_match")
+def _check_candidate(reference_image_base64, suggested_image, candidate_id=None):
+    current_span().set(candidate_id=candidate_id)
+    cached = _cached_verdict(reference_image_base64, candidate_id)
+    if cached is not None:
+        return parse_verdict(cached)
+    # Candidate images may be passed lazily so file reads and encoding also happen off the caller's thread
+    try:
+        suggested_image_base64 = suggested_image() if callable(suggested_image) else suggested_image
+    except OSError:
+        return {"answer": "no", "reason": "Candidate image is unavailable"}
+    result = _request_match(reference_image_base64, suggested_image_base64)
+    _store_verdict(reference_image_base64, candidate_id, result)
+    return parse_verdict(result)
+
+
+@span("check_matches")
+def _check_group(reference_image_base64, group):
+    """Judge a group of (image, candidate_id) pairs with one batched call; returns parsed verdicts in order."""
+    current_span().set(candidate_ids=[candidate_id for _, candidate_id in group])
+    verdicts = [None] * len(group)
+    images, ids, positions = [], [], []
+    for position, (suggested_image, candidate_id) in enumerate(group):
+        cached = _cached_verdict(reference_image_base64, candidate_id)
+        if cached is not None:
+            verdicts[position] = parse_verdict(cached)
+            continue
+        try:
+            images.append(suggested_image() if callable(suggested_image) else suggested_image)
+        except OSError:
+            verdicts[position] = {"answer": "no", "reason": "Candidate image is unavailable"}
+            continue
+        ids.append(candidate_id)
+        positions.append(position)
+
+    if images:
+        results = _check_matches(reference_image_base64, images, ids, [None] * len(images))
+        for position, result in zip(positions, results):
+            verdicts[position] = parse_verdict(result)
+    return verdicts
+
+
+def verify_candidates(reference_image_base64, candidates, max_concurrency=GUARDRAIL_MAX_CONCURRENCY,
+                      target_matches=GUARDRAIL_TARGET_MATCHES, batch_size=GUARDRAIL_BATCH_SIZE):
+    """
+    Run check_match for every candidate concurrently and yield (key, verdict) pairs as they finish.
+
+    `candidates` is an iterable of (key, image) or (key, image, candidate_id) tuples where image is a
+    base64 string or a zero-argument callable returning one; with a candidate_id, cached verdicts are
+    returned without loading the image or calling the model. At most `max_concurrency` checks are in flight at once. Once
+    `target_matches` "yes" verdicts have been yielded (GUARDRAIL_TARGET_MATCHES by default; None checks every
+    candidate), checks that have not started are cancelled and iteration stops; checks already in flight
+    finish in the background and their results are dropped.
+
+    With `batch_size` > 1, candidates are judged in groups of up to `batch_size` per vision call
+    (see check_matches) and each group's verdicts are yielded together when its call returns.
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return
+
+    batch_size = max(1, batch_size or 1)
+    groups = [candidates[start:start + batch_size] for start in range(0, len(candidates), batch_size)]
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(groups))))
+    # Each check runs in a copy of the caller's context so its telemetry span nests under the caller's
+    if batch_size == 1:
+        futures = {
+            executor.submit(contextvars.copy_context().run, _check_candidate, reference_image_base64, *group[0][1:]): group
+            for group in groups
+        }
+    else:
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run,
+                _check_group,
+                reference_image_base64,
+                [(candidate[1], candidate[2] if len(candidate) > 2 else None) for candidate in group],
+            ): group
+            for group in groups
+        }
+    matches = 0
+    try:
+        for future in concurrent.futures.as_completed(futures):
+            verdicts = future.result()
+            if batch_size == 1:
+                verdicts = [verdicts]
+            for candidate, verdict in zip(futures[future], verdicts):
+                yield candidate[0], verdict
+                if verdict["answer"] == "yes":
+                    matches += 1
+                    if target_matches is not None and matches >= target_matches:
+                        return
+    finally:
+        # Also reached when the consumer stops iterating early
+        executor.shutdown(wait=False, cancel_futures=True)
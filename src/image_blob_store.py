@@ -0,0 +1,140 @@
+"""
+image_blob_store.py
+Packed, memory-mapped store of pre-encoded catalog images. An offline build step prepares every
+catalog image twice (a base64 JPEG payload sized for guardrail calls and a small JPEG thumbnail for
+the UI) and appends both to a single blob file, with a JSON index of id -> (offset, length). At request
+time a lookup is a slice of the mapped file: no per-request file opens, decoding or encoding.
+"""
+
+# Standard library imports
+import json
+import mmap
+import os
+import threading
+
+# Local application imports
+from config import GUARDRAIL_IMAGE_MAX_EDGE, IMAGE_BLOB_STORE_PATH, THUMBNAIL_MAX_EDGE
+from image_prep import prepare_image
+
+BLOB_FORMAT = "retailnext-image-blobs"
+BLOB_VERSION = 1
+
+BLOB_FILENAME = "images.blob"
+INDEX_FILENAME = "index.json"
+_PARTIAL_SUFFIX = ".partial"
+
+
+def build_image_blob_store(image_dir, path=IMAGE_BLOB_STORE_PATH, payload_max_edge=GUARDRAIL_IMAGE_MAX_EDGE,
+                           thumbnail_max_edge=THUMBNAIL_MAX_EDGE, extensions=(".jpg", ".jpeg", ".png")):
+    """
+    Prepare every image in `image_dir` (keyed by file name without extension, i.e. the catalog id)
+    and pack the guardrail payloads and thumbnails into one blob file.
+
+    Returns:
+        dict: the index header (counts and sizes)
+    """
+    os.makedirs(path, exist_ok=True)
+    blob_partial = os.path.join(path, BLOB_FILENAME + _PARTIAL_SUFFIX)
+    entries = {}
+    offset = 0
+    skipped = 0
+
+    with open(blob_partial, "wb") as blob:
+        for filename in sorted(os.listdir(image_dir)):
+            item_id, extension = os.path.splitext(filename)
+            if extension.lower() not in extensions:
+                continue
+            source = os.path.join(image_dir, filename)
+            try:
+                payload = prepare_image(source, max_edge=payload_max_edge).base64.encode("ascii")
+                thumbnail = prepare_image(source, max_edge=thumbnail_max_edge, quality=80).data
+            except OSError as e:
+                print(f"⚠️  Skipping unreadable image {source}: {e}")
+                skipped += 1
+                continue
+
+            blob.write(payload)
+            blob.write(thumbnail)
+            entries[item_id] = [offset, len(payload), offset + len(payload), len(thumbnail)]
+            offset += len(payload) + len(thumbnail)
+
+    index = {
+        "format": BLOB_FORMAT,
+        "version": BLOB_VERSION,
+        "count": len(entries),
+        "bytes": offset,
+        "payload_max_edge": payload_max_edge,
+        "thumbnail_max_edge": thumbnail_max_edge,
+        "entries": entries,
+    }
+    index_partial = os.path.join(path, INDEX_FILENAME + _PARTIAL_SUFFIX)
+    with open(index_partial, "w", encoding="utf-8") as f:
+        json.dump(index, f, separators=(",", ":"))
+
+    # Blob first, index last: an index never points into a blob file it was not built with
+    os.replace(blob_partial, os.path.join(path, BLOB_FILENAME))
+    os.replace(index_partial, os.path.join(path, INDEX_FILENAME))
+    print(f"✅ Packed {len(entries)} images ({offset / 1024 / 1024:.1f} MB, {skipped} skipped) into {path}")
+    return {key: value for key, value in index.items() if key != "entries"}
+
+
+class ImageBlobStore:
+    """Read-only view over a built image blob store."""
+
+    def __init__(self, path=IMAGE_BLOB_STORE_PATH):
+        with open(os.path.join(path, INDEX_FILENAME), "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("format") != BLOB_FORMAT or index.get("version") != BLOB_VERSION:
+            raise ValueError(f"Unsupported image blob store at {path}: {index.get('format')} v{index.get('version')}")
+        self.path = path
+        self.entries = index["entries"]
+
+        self._file = open(os.path.join(path, BLOB_FILENAME), "rb")
+        if index["bytes"]:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+        else:
+            self._map = None
+            self._view = memoryview(b"")
+
+    def __contains__(self, item_id):
+        return str(item_id) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def payload(self, item_id):
+        """Zero-copy view of the base64 JPEG payload (ASCII bytes) prepared for guardrail calls."""
+        offset, length, _, _ = self.entries[str(item_id)]
+        return self._view[offset:offset + length]
+
+    def payload_base64(self, item_id):
+        """Guardrail payload as a str, ready for image_data_url (one copy, as the API client needs a str)."""
+        return str(self.payload(item_id), "ascii")
+
+    def thumbnail(self, item_id):
+        """Zero-copy view of the JPEG thumbnail bytes."""
+        _, _, offset, length = self.entries[str(item_id)]
+        return self._view[offset:offset + length]
+
+    def close(self):
+        self._view.release()
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_image_blob_store():
+    """Process-wide ImageBlobStore, or None if the store has not been built."""
+    global _store
+    with _store_lock:
+        if _store is None and os.path.exists(os.path.join(IMAGE_BLOB_STORE_PATH, INDEX_FILENAME)):
+            try:
+                _store = ImageBlobStore(IMAGE_BLOB_STORE_PATH)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Could not open image blob store: {e}")
+        return _store
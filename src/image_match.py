@@ -10,13 +10,12 @@ item_category = image_analysis['category']
 item_gender = image_analysis['gender']
 
 
-# Filter data such that we only look through the items of the same gender (or unisex) and different category
-filtered_items = styles_df.loc[styles_df['gender'].isin([item_gender, 'Unisex'])]
-filtered_items = filtered_items[filtered_items['articleType'] != item_category]
-print(str(len(filtered_items)) + " Remaining Items")
+# Only search items of the same gender (or unisex) and a different category, via the precomputed filter index
+item_filter = complementary_filter(item_gender, item_category)
+print(str(search_engine.filter_index.count(item_filter)) + " Remaining Items")
 
 # Find the most similar items based on the input item descriptions
-matching_items = find_matching_items_with_rag(filtered_items, item_descs)
+matching_items = find_matching_items_with_rag(styles_df, item_descs, engine=search_engine, filters=item_filter)
 
 # Display the matching items (this will display 2 items for each description in the image analysis)
 html = ""
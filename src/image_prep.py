@@ -0,0 +1,228 @@
+"""
+image_prep.py
+Image preparation stage shared by analysis.py and guardrails.py. Images are decoded once, rotated
+according to their EXIF orientation, downscaled to a maximum edge (or until they fit an image-token
+budget) and re-encoded as JPEG. The resulting PreparedImage is reused for every model call in a request.
+"""
+
+# Standard library imports
+import base64
+import io
+import math
+import threading
+import time
+
+# 3P Imports
+import numpy as np
+from PIL import Image, ImageOps
+
+# Local application imports
+from config import IMAGE_JPEG_QUALITY, IMAGE_MAX_EDGE, IMAGE_TOKEN_BUDGET
+from telemetry import current_span, span
+
+
+class PreparedImage:
+    """A downscaled, re-encoded JPEG ready to send to the model, with before/after statistics."""
+
+    def __init__(self, data, width, height, stats):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.stats = stats
+        self._base64 = None
+        self._fingerprint = None
+
+    @property
+    def base64(self):
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.data).decode("ascii")
+        return self._base64
+
+    @property
+    def data_url(self):
+        return f"data:image/jpeg;base64,{self.base64}"
+
+
+def image_base64(image):
+    """Base64 payload of a PreparedImage or of an already base64-encoded JPEG string."""
+    return image.base64 if isinstance(image, PreparedImage) else image
+
+
+def image_data_url(image):
+    """Data URL for the model's image_url content part (PreparedImage or base64 JPEG string)."""
+    return image.data_url if isinstance(image, PreparedImage) else f"data:image/jpeg;base64,{image}"
+
+
+def _difference_hash(image, hash_size=8):
+    # Grayscale thumbnail one column wider than tall; each bit says whether a pixel is brighter than its right neighbour
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+# Coarse colour classes for colour_signature: six hue sectors centred on the primary and secondary
+# colours, plus black, grey and white for unsaturated pixels
+_HUE_NAMES = ("red", "yellow", "green", "cyan", "blue", "magenta")
+
+
+def _colour_signature(image, size=16):
+    # HSV thumbnail; near-white pixels are treated as the product-photo background and ignored
+    hue, saturation, value = np.asarray(image.convert("RGB").resize((size, size), Image.BILINEAR).convert("HSV"),
+                                        dtype=np.int16).reshape(-1, 3).T
+    foreground = ~((value > 230) & (saturation < 26))
+    if not foreground.any():
+        return "white"
+    hue, saturation, value = hue[foreground], saturation[foreground], value[foreground]
+    classes = np.where(
+        saturation >= 64,
+        (hue * 6 + 128) // 256 % 6,
+        np.where(value < 64, 6, np.where(value < 192, 7, 8)),
+    )
+    return (_HUE_NAMES + ("black", "grey", "white"))[int(np.bincount(classes, minlength=9).argmax())]
+
+
+def _fingerprint(image):
+    return _difference_hash(image), _colour_signature(image)
+
+
+def image_fingerprint(image):
+    """
+    (perceptual_hash, colour_signature) of a PreparedImage or base64 JPEG string, decoding it once.
+    The dHash is computed on grayscale, so the same garment in another colour can get the same hash;
+    the colour signature (the dominant coarse colour class of the foreground) tells them apart.
+    """
+    if isinstance(image, PreparedImage):
+        if image._fingerprint is None:
+            image._fingerprint = _fingerprint(Image.open(io.BytesIO(image.data)))
+        return image._fingerprint
+    return _fingerprint(Image.open(io.BytesIO(base64.b64decode(image))))
+
+
+def perceptual_hash(image):
+    """
+    64-bit difference hash (dHash) of a PreparedImage or base64 JPEG string. Re-encoded, resized or
+    slightly recompressed copies of the same photo get identical or nearly identical hashes; compare
+    hashes with hamming_distance.
+    """
+    return image_fingerprint(image)[0]
+
+
+def colour_signature(image):
+    """Dominant coarse colour ("red", ..., "black", "grey", "white") of a PreparedImage or base64 JPEG string."""
+    return image_fingerprint(image)[1]
+
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two perceptual hashes."""
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def estimate_image_tokens(width, height):
+    """
+    Approximate vision input tokens for a high-detail image: the image is fitted within 2048x2048,
+    its shortest side scaled to 768px, then billed 170 tokens per 512px tile plus 85 base tokens.
+    """
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _target_size(width, height, max_edge, token_budget):
+    scale = min(1.0, max_edge / max(width, height)) if max_edge else 1.0
+    if token_budget:
+        while scale > 0.05 and estimate_image_tokens(width * scale, height * scale) > token_budget:
+            scale *= 0.9
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _load(source):
+    if isinstance(source, Image.Image):
+        return source, None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        raw = bytes(source)
+        return Image.open(io.BytesIO(raw)), len(raw)
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            raw = f.read()
+        return Image.open(io.BytesIO(raw)), len(raw)
+    # File-like object such as a Streamlit UploadedFile
+    raw = source.read()
+    return Image.open(io.BytesIO(raw)), len(raw)
+
+
+@span("prepare_image")
+def prepare_image(source, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_JPEG_QUALITY, token_budget=IMAGE_TOKEN_BUDGET):
+    """
+    Prepare an image for a vision call.
+
+    Args:
+        source: encoded image bytes, a file path, a file-like object or a PIL image
+        max_edge: longest edge in pixels after downscaling (never upscales)
+        quality: JPEG quality used for re-encoding
+        token_budget: optional cap on estimated image tokens; shrinks the image further if needed
+
+    Returns:
+        PreparedImage
+    """
+    started = time.perf_counter()
+    image, original_bytes = _load(source)
+    original_width, original_height = image.size
+    if image.format == "JPEG" and max_edge:
+        # Let the JPEG decoder downscale by a power of two while decoding; much cheaper than resizing after
+        image.draft("RGB", (max_edge, max_edge))
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        # Flatten transparency onto white rather than letting JPEG turn it black
+        rgba = image.convert("RGBA")
+        image = Image.new("RGB", rgba.size, (255, 255, 255))
+        image.paste(rgba, mask=rgba.getchannel("A"))
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    width, height = _target_size(image.width, image.height, max_edge, token_budget)
+    if (width, height) != image.size:
+        image = image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    data = buffer.getvalue()
+
+    stats = {
+        "original_bytes": original_bytes,
+        "prepared_bytes": len(data),
+        "original_size": (original_width, original_height),
+        "prepared_size": (width, height),
+        "original_tokens": estimate_image_tokens(original_width, original_height),
+        "prepared_tokens": estimate_image_tokens(width, height),
+        "prepare_ms": (time.perf_counter() - started) * 1000,
+    }
+    _record(stats)
+    current_span().add(bytes_in=original_bytes or 0, bytes_out=len(data))
+    return PreparedImage(data, width, height, stats)
+
+
+_totals = {"images": 0, "original_bytes": 0, "prepared_bytes": 0, "original_tokens": 0, "prepared_tokens": 0, "prepare_ms": 0.0}
+_totals_lock = threading.Lock()
+
+
+def _record(stats):
+    with _totals_lock:
+        _totals["images"] += 1
+        _totals["original_bytes"] += stats["original_bytes"] or 0
+        _totals["prepared_bytes"] += stats["prepared_bytes"]
+        _totals["original_tokens"] += stats["original_tokens"]
+        _totals["prepared_tokens"] += stats["prepared_tokens"]
+        _totals["prepare_ms"] += stats["prepare_ms"]
+
+
+def image_prep_stats():
+    """Process-wide totals of payload bytes and estimated image tokens before and after preparation."""
+    with _totals_lock:
+        totals = dict(_totals)
+    images = totals["images"]
+    totals["bytes_saved"] = totals["original_bytes"] - totals["prepared_bytes"]
+    totals["avg_prepare_ms"] = totals["prepare_ms"] / images if images else 0.0
+    return totals
@@ -0,0 +1,305 @@
+"""
+pipeline.py
+Asynchronous end-to-end recommendation pipeline on the model provider's async API (providers.py). Instead of running
+analyze -> search -> verify one stage at a time, stages overlap: each recommended item description is
+embedded and searched as soon as it is available (with ANALYSIS_STREAMING, while the model is still
+writing the rest of its answer), and each catalog match is sent for guardrail verification as soon as
+it is found. Descriptions known together (all of them without streaming) share one embedding request
+and one search_many, and with GUARDRAIL_BATCH_SIZE > 1 matches are verified in groups of that size,
+one vision call per group (check_matches_async). Progress is yielded as an async stream of event
+dicts, so a UI can show the analysis, the matches and the verdicts as they arrive.
+
+Events (dicts with a "type" key):
+    {"type": "analysis_item", "index": i, "description": d}    streamed description (streaming only)
+    {"type": "analysis_field", "field": f, "value": v}         streamed category / gender (streaming only)
+    {"type": "analysis", "analysis": {...}}                    parsed analyze_image output
+    {"type": "match", "index": i, "item": {...}, "description": d}
+    {"type": "search_done", "matches": n}                      every description has been searched
+    {"type": "verdict", "index": i, "item": {...}, "verdict": {"answer": ..., "reason": ...}}
+    {"type": "error", "stage": ..., "error": ..., ...}
+    {"type": "done", "matches": n, "compatible": k, "time_to_first_match": s, "timings": {...},
+     "telemetry": {...}}                                        always last
+
+Each run is traced as a "recommendation" telemetry span (see telemetry.py); the stages' spans nest under
+it and the "done" event carries its summary: per-stage latency, tokens, cost, bytes sent and cache hits.
+"""
+
+# Standard library imports
+import asyncio
+import json
+import os
+import time
+
+# Local application imports
+from analysis import analyze_image_async, analyze_image_stream_async
+from config import ANALYSIS_STREAMING, CATALOG_IMAGES_PATH, GUARDRAIL_BATCH_SIZE, GUARDRAIL_MAX_CONCURRENCY
+from config import GUARDRAIL_TARGET_MATCHES
+from filter_index import complementary_filter
+from guardrails import check_match_async, check_matches_async, parse_verdict
+from image_blob_store import get_image_blob_store
+from image_prep import prepare_image
+from search_similar_items import get_embeddings_async
+from telemetry import activate, start_span
+
+# Catalog image directory resolved against the project root, so loading does not depend on the working directory
+CATALOG_IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), CATALOG_IMAGES_PATH)
+
+# Marker put on the event queue when a stage task finishes
+_TASK_DONE = object()
+
+
+def load_catalog_image(item, images_dir=CATALOG_IMAGES_DIR):
+    """
+    Guardrail payload for a catalog item: the pre-encoded blob store entry when available, otherwise a
+    zero-argument callable preparing <images_dir>/<id>.jpg (run off the event loop), or None if there is
+    no image.
+    """
+    item_id = str(item.get("id"))
+    image_store = get_image_blob_store()
+    if image_store is not None and item_id in image_store:
+        return image_store.payload_base64(item_id)
+    path = os.path.join(images_dir, f"{item_id}.jpg")
+    if os.path.exists(path):
+        return lambda: prepare_image(path)
+    return None
+
+
+class RecommendationPipeline:
+    """
+    One recommendation request. Use `run()` as an async iterator of events; stage tasks are cancelled
+    when the consumer stops iterating early or when `target_matches` compatible items have been found.
+
+    With `batch_size` > 1, matches are verified in groups of up to `batch_size` candidates per vision
+    call; a partly filled group is sent once every description has been searched.
+    """
+
+    def __init__(self, image, subcategories, df_items, engine, threshold=0.6, top_k=2,
+                 max_candidates=None, target_matches=GUARDRAIL_TARGET_MATCHES,
+                 max_concurrency=GUARDRAIL_MAX_CONCURRENCY, batch_size=GUARDRAIL_BATCH_SIZE,
+                 candidate_image=load_catalog_image, streaming=ANALYSIS_STREAMING):
+        self.image = image
+        self.subcategories = list(subcategories)
+        self.df_items = df_items
+        self.engine = engine
+        self.threshold = threshold
+        self.top_k = top_k
+        self.max_candidates = max_candidates
+        self.target_matches = target_matches
+        self.batch_size = max(1, batch_size or 1)
+        self.candidate_image = candidate_image
+        self.streaming = streaming
+
+        self._queue = asyncio.Queue()
+        self._tasks = set()
+        self._verify_slots = asyncio.Semaphore(max(1, max_concurrency))
+        self._seen = set()
+        self._unverified = []
+        self._matches = 0
+        self._compatible = 0
+        self._filters = None
+        self._filters_ready = asyncio.Event()
+        self._started = None
+        self._timings = {}
+        self._trace = None
+
+    async def _traced(self, function, args):
+        # Tasks run in a copy of the spawning context; make the request's span their parent explicitly.
+        # The coroutine is only created here, so a task cancelled before it starts leaves nothing un-awaited
+        with activate(self._trace):
+            return await function(*args)
+
+    def _spawn(self, stage, function, *args):
+        task = asyncio.create_task(self._traced(function, args))
+        self._tasks.add(task)
+
+        def finished(task):
+            self._tasks.discard(task)
+            if not task.cancelled() and task.exception() is not None:
+                self._queue.put_nowait({"type": "error", "stage": stage, "error": str(task.exception())})
+            self._queue.put_nowait(_TASK_DONE)
+
+        task.add_done_callback(finished)
+        return task
+
+    def _mark(self, name):
+        # First occurrence only: e.g. the time the first match was found
+        self._timings.setdefault(name, time.perf_counter() - self._started)
+
+    async def _analyze(self):
+        searches = []
+        if self.streaming:
+            # Each description is searched as soon as the model has finished writing it
+            fields = {}
+            try:
+                async for field, value in analyze_image_stream_async(self.image, self.subcategories):
+                    if field == "item":
+                        self._mark("first_item")
+                        self._queue.put_nowait({"type": "analysis_item", "index": len(searches), "description": value})
+                        searches.append(self._spawn("search", self._search, value))
+                    elif field == "complete":
+                        raw = value
+                    else:
+                        fields[field] = value
+                        self._queue.put_nowait({"type": "analysis_field", "field": field, "value": value})
+                        if "gender" in fields and "category" in fields:
+                            self._set_filters(fields)
+            except BaseException as e:
+                # Searches spawned from the stream would otherwise wait for the filters forever; the
+                # analysis error itself is reported by the task's done callback
+                for task in searches:
+                    task.cancel()
+                if isinstance(e, Exception):
+                    # Matches already found are still verified
+                    self._flush_verify()
+                raise
+        else:
+            raw = await analyze_image_async(self.image, self.subcategories)
+        self._mark("analysis")
+        try:
+            analysis = json.loads(raw)
+        except (TypeError, json.JSONDecodeError) as e:
+            for task in searches:
+                task.cancel()
+            self._flush_verify()
+            self._queue.put_nowait({"type": "error", "stage": "analysis", "error": str(e), "raw": raw})
+            return
+        self._queue.put_nowait({"type": "analysis", "analysis": analysis})
+
+        self._set_filters(analysis)
+        # Descriptions not already picked up from the stream (all of them when not streaming) are
+        # embedded in one request and scored together
+        remaining = analysis.get("items", [])[len(searches):]
+        if remaining:
+            searches.append(self._spawn("search", self._search_many, remaining))
+        await asyncio.gather(*searches, return_exceptions=True)
+        self._flush_verify()
+        self._mark("search_done")
+        self._queue.put_nowait({"type": "search_done", "matches": self._matches})
+
+    def _set_filters(self, analysis):
+        if self._filters_ready.is_set():
+            return
+        if analysis.get("gender") and analysis.get("category"):
+            # Same gender (or unisex), different category than the uploaded item
+            self._filters = complementary_filter(analysis["gender"], analysis["category"])
+        self._filters_ready.set()
+
+    async def _search(self, description):
+        embedding = (await get_embeddings_async([description]))[0]
+        # With streaming analysis, embedding overlaps generation but scoring waits for the filter
+        await self._filters_ready.wait()
+        # Scoring runs on the event loop so the cross-description de-duplication in _take sees a
+        # consistent set of items; over-fetch by the items already taken so each description still
+        # gets up to top_k new ones, as with search_many(unique=True)
+        indices = self.engine.search(
+            embedding, threshold=self.threshold, top_k=self.top_k + len(self._seen), filters=self._filters
+        )
+        self._take(description, indices)
+
+    async def _search_many(self, descriptions):
+        embeddings = await get_embeddings_async(descriptions)
+        await self._filters_ready.wait()
+        # Earlier descriptions of the batch take up to top_k items each before a later one is served
+        over_fetch = len(self._seen) + self.top_k * len(descriptions)
+        results = self.engine.search_many(embeddings, threshold=self.threshold, top_k=over_fetch, filters=self._filters)
+        for description, indices in zip(descriptions, results):
+            self._take(description, indices)
+
+    def _take(self, description, indices):
+        """Report up to top_k of `indices` not returned for an earlier description and queue them for verification."""
+        taken = 0
+        for i in indices:
+            if taken == self.top_k or (self.max_candidates is not None and self._matches >= self.max_candidates):
+                break
+            if i in self._seen:
+                continue
+            self._seen.add(i)
+            taken += 1
+            index = self._matches
+            self._matches += 1
+            item = self.df_items.iloc[i].to_dict()
+            self._mark("first_match")
+            self._queue.put_nowait({"type": "match", "index": index, "item": item, "description": description})
+            self._unverified.append((index, item))
+            if len(self._unverified) >= self.batch_size:
+                self._flush_verify()
+
+    def _flush_verify(self):
+        if self._unverified:
+            self._spawn("verify", self._verify, self._unverified)
+            self._unverified = []
+
+    async def _candidate_image(self, item):
+        image = self.candidate_image(item)
+        if callable(image):
+            image = await asyncio.to_thread(image)
+        return image
+
+    async def _verify(self, group):
+        """Verify a group of (index, item) matches: one check_match per item, or one batched call."""
+        async with self._verify_slots:
+            images = await asyncio.gather(*(self._candidate_image(item) for _, item in group), return_exceptions=True)
+            candidates = []
+            for (index, item), image in zip(group, images):
+                if isinstance(image, OSError):
+                    verdict = {"answer": "no", "reason": "Candidate image is unavailable"}
+                    self._queue.put_nowait({"type": "verdict", "index": index, "item": item, "verdict": verdict})
+                elif isinstance(image, BaseException):
+                    raise image
+                elif image is not None:
+                    candidates.append((index, item, image))
+            if not candidates:
+                return
+            if self.batch_size == 1:
+                index, item, image = candidates[0]
+                results = [await check_match_async(self.image, image, candidate_id=item.get("id"))]
+            else:
+                results = await check_matches_async(
+                    self.image, [image for _, _, image in candidates], [item.get("id") for _, item, _ in candidates]
+                )
+        for (index, item, _), result in zip(candidates, results):
+            verdict = parse_verdict(result)
+            if verdict["answer"] == "yes":
+                self._mark("first_compatible")
+            self._queue.put_nowait({"type": "verdict", "index": index, "item": item, "verdict": verdict})
+
+    async def run(self):
+        """Async iterator of pipeline events; the final event is always {"type": "done", ...}."""
+        self._started = time.perf_counter()
+        self._trace = start_span("recommendation", streaming=self.streaming)
+        self._spawn("analysis", self._analyze)
+        try:
+            while self._tasks or not self._queue.empty():
+                event = await self._queue.get()
+                if event is _TASK_DONE:
+                    continue
+                yield event
+                if event["type"] == "verdict" and event["verdict"]["answer"] == "yes":
+                    self._compatible += 1
+                    if self.target_matches is not None and self._compatible >= self.target_matches:
+                        break
+            self._timings["total"] = time.perf_counter() - self._started
+            self._trace.set(matches=self._matches, compatible=self._compatible)
+            self._trace.finish()
+            yield {
+                "type": "done",
+                "matches": self._matches,
+                "compatible": self._compatible,
+                "time_to_first_match": self._timings.get("first_match"),
+                "timings": dict(self._timings),
+                "telemetry": self._trace.summary(),
+            }
+        finally:
+            for task in list(self._tasks):
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._trace.finish()
+
+
+def recommend(image, subcategories, df_items, engine, **options):
+    """
+    Run the recommendation pipeline for one uploaded image and return its async event stream.
+    `options` are RecommendationPipeline arguments (threshold, top_k, max_candidates, target_matches,
+    batch_size, ...).
+    """
+    return RecommendationPipeline(image, subcategories, df_items, engine, **options).run()
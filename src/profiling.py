@@ -0,0 +1,195 @@
+"""
+profiling.py
+On-demand profiling of a single request. `profile_request` wraps one request in a profiler plus
+tracemalloc and writes the results to PROFILE_DIR:
+
+    sample    wall-clock stack sampling of the request's threads (the calling thread and any thread started
+              during the request), written as collapsed stacks (<prefix>.collapsed) for flamegraph.pl,
+              speedscope or inferno
+    cprofile  deterministic cProfile of the calling thread, written as pstats (<prefix>.prof) for snakeviz
+              or flameprof, plus a text report of the top functions
+
+Both modes also write <prefix>.allocations.txt (peak traced memory and the lines that allocated the most
+memory during the request) and <prefix>.json (a summary). With the mode off, `profile_request` only
+checks its argument, so it can stay in place around every request.
+
+    with profile_request("run_demo", mode="sample") as profile:
+        ...
+    print(profile.files)
+"""
+
+# Standard library imports
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Local application imports
+from config import PROFILE, PROFILE_DIR, PROFILE_SAMPLE_INTERVAL_MS, PROFILE_TOP_ALLOCATIONS, PROFILE_TRACEMALLOC_FRAMES
+
+MODES = ("sample", "cprofile")
+_OFF = ("", "0", "off", "false", "no", "none")
+_ON = ("1", "on", "true", "yes")
+
+
+def resolve_mode(value=PROFILE):
+    """Profiling mode for an env var / query parameter / CLI value: None (off), "sample" or "cprofile"."""
+    if value is None:
+        return None
+    value = str(value).strip().lower()
+    if value in _OFF:
+        return None
+    if value in _ON:
+        return "sample"
+    if value in MODES:
+        return value
+    raise ValueError(f"Unknown profiling mode {value!r}; expected one of {MODES} or on/off")
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of selected threads every `interval` seconds from a background thread and
+    counts identical stacks. Threads alive at `start()` other than the calling one are ignored, so a
+    server's idle threads do not swamp the request's profile.
+    """
+
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL_MS / 1000):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._ignored = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        caller = threading.get_ident()
+        self._ignored = {thread.ident for thread in threading.enumerate() if thread.ident != caller}
+        self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+        self._thread.start()
+        self._ignored.add(self._thread.ident)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in self._ignored or ident == threading.get_ident():
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def write_collapsed(self, path):
+        """One "frame;frame;... count" line per distinct stack, root first (Brendan Gregg's folded format)."""
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfileResult:
+    """Where a profiled request's output went; `files` is filled in when the request finishes."""
+
+    def __init__(self, name, mode, prefix):
+        self.name = name
+        self.mode = mode
+        self.prefix = prefix
+        self.files = []
+        self.summary = {}
+
+
+def _allocation_report(start, end, peak, top):
+    lines = [f"Peak traced memory during the request: {peak / 2**20:.1f} MB", ""]
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    stats = end.filter_traces(filters).compare_to(start.filter_traces(filters), "lineno")
+    stats = sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:top]
+    lines.append(f"Top {len(stats)} lines by memory allocated during the request (still held at its end):")
+    for stat in stats:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size_diff / 1024:10.1f} KB {stat.count_diff:+8d} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+@contextlib.contextmanager
+def profile_request(name, mode=PROFILE, output_dir=PROFILE_DIR):
+    """
+    Profile the enclosed request when `mode` (see resolve_mode) is on; yields a ProfileResult, or None
+    when profiling is off.
+    """
+    mode = resolve_mode(mode)
+    if mode is None:
+        yield None
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    prefix = os.path.join(output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{name}-{os.getpid()}")
+    result = ProfileResult(name, mode, prefix)
+
+    owns_tracemalloc = not tracemalloc.is_tracing()
+    if owns_tracemalloc:
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    start_snapshot = tracemalloc.take_snapshot()
+
+    profiler = SamplingProfiler() if mode == "sample" else cProfile.Profile()
+    started = time.perf_counter()
+    if mode == "sample":
+        profiler.start()
+    else:
+        profiler.enable()
+    try:
+        yield result
+    finally:
+        if mode == "sample":
+            profiler.stop()
+        else:
+            profiler.disable()
+        seconds = time.perf_counter() - started
+        end_snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if owns_tracemalloc:
+            tracemalloc.stop()
+
+        if mode == "sample":
+            profiler.write_collapsed(f"{prefix}.collapsed")
+            result.files.append(f"{prefix}.collapsed")
+        else:
+            profiler.dump_stats(f"{prefix}.prof")
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(40)
+            with open(f"{prefix}.functions.txt", "w", encoding="utf-8") as f:
+                f.write(report.getvalue())
+            result.files += [f"{prefix}.prof", f"{prefix}.functions.txt"]
+
+        with open(f"{prefix}.allocations.txt", "w", encoding="utf-8") as f:
+            f.write(_allocation_report(start_snapshot, end_snapshot, peak, PROFILE_TOP_ALLOCATIONS))
+        result.files.append(f"{prefix}.allocations.txt")
+
+        result.summary = {
+            "name": name,
+            "mode": mode,
+            "seconds": seconds,
+            "peak_traced_mb": peak / 2**20,
+            "samples": profiler.samples if mode == "sample" else None,
+            "files": list(result.files),
+        }
+        with open(f"{prefix}.json", "w", encoding="utf-8") as f:
+            json.dump(result.summary, f, indent=2)
+        result.files.append(f"{prefix}.json")
@@ -0,0 +1,512 @@
+"""
+providers.py
+Model provider layer for the chat-vision and embedding calls made by analysis.py, guardrails.py and
+search_similar_items.py, so the pipeline can run against something other than the live API.
+
+Backends:
+    OpenAIProvider        the live API through the OpenAI SDK (clients are created on first use)
+    FakeProvider          deterministic and offline: hash-derived embeddings, canned JSON analyses and
+                          verdicts, configurable latency and injected errors
+    RecordReplayProvider  saves the responses of another provider to disk and serves them back later
+
+Every backend offers chat / chat_stream / embed plus their async counterparts. `chat` returns a ChatResponse
+with its token usage; `chat_stream` and `embed` report usage by filling an optional `usage` dict
+({"prompt_tokens": n, "completion_tokens": n}) once the call completes. `get_provider()` returns
+the process-wide provider selected by MODEL_PROVIDER; `set_provider()` swaps it (e.g. in a load test).
+"""
+
+# Standard library imports
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import weakref
+
+# 3P Imports
+import numpy as np
+
+# Local application imports
+from config import MODEL_PROVIDER, MODEL_RECORDINGS_PATH
+from config import FAKE_PROVIDER_ERROR_RATE, FAKE_PROVIDER_JITTER_MS, FAKE_PROVIDER_LATENCY_MS, FAKE_PROVIDER_YES_RATE
+from telemetry import payload_stats
+
+FAKE_EMBEDDING_DIM = 3072
+
+
+class ProviderError(Exception):
+    """Raised by a provider that cannot produce a response (injected fake errors, replay misses)."""
+
+
+class ReplayMissError(ProviderError):
+    """A replaying provider was asked for a call that was never recorded."""
+
+
+class ChatResponse:
+    """Text of a chat completion plus its token usage."""
+
+    def __init__(self, text, prompt_tokens=0, completion_tokens=0):
+        self.text = text
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    def to_dict(self):
+        return {"text": self.text, "prompt_tokens": self.prompt_tokens, "completion_tokens": self.completion_tokens}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["text"], data.get("prompt_tokens", 0), data.get("completion_tokens", 0))
+
+
+class ModelProvider:
+    """
+    Interface shared by all backends. `task` names the caller's prompt ("analysis", "guardrail",
+    "guardrail_batch"); the live API ignores it, the fake backend uses it to pick a canned answer.
+    The async methods default to running the sync ones in a worker thread.
+    """
+
+    name = "base"
+    # Prefix for cache keys derived from model names; non-empty for backends whose answers must never
+    # be mixed with real ones in the persistent caches
+    cache_namespace = ""
+
+    def model_key(self, model):
+        """Model name as used in cache keys."""
+        return f"{self.cache_namespace}/{model}" if self.cache_namespace else model
+
+    def chat(self, model, messages, task=None, **options):
+        raise NotImplementedError
+
+    def chat_stream(self, model, messages, task=None, usage=None, **options):
+        """Yield the response text in chunks as it is generated."""
+        raise NotImplementedError
+
+    def embed(self, model, inputs, usage=None):
+        """One embedding (list of floats) per input."""
+        raise NotImplementedError
+
+    async def chat_async(self, model, messages, task=None, **options):
+        return await asyncio.to_thread(self.chat, model, messages, task, **options)
+
+    async def chat_stream_async(self, model, messages, task=None, usage=None, **options):
+        chunks = await asyncio.to_thread(lambda: list(self.chat_stream(model, messages, task, usage, **options)))
+        for chunk in chunks:
+            yield chunk
+
+    async def embed_async(self, model, inputs, usage=None):
+        return await asyncio.to_thread(self.embed, model, inputs, usage)
+
+
+def _fill_usage(usage, prompt_tokens, completion_tokens=0):
+    if usage is not None:
+        usage["prompt_tokens"] = prompt_tokens
+        usage["completion_tokens"] = completion_tokens
+
+
+class OpenAIProvider(ModelProvider):
+    """The live OpenAI API. Async calls use one AsyncOpenAI client per event loop, as a client is tied to its loop."""
+
+    name = "openai"
+
+    def __init__(self, client=None, async_client=None):
+        self._client = client
+        self._async_client = async_client
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+                self._client = OpenAI()
+            return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is not None:
+            return self._async_client
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                from openai import AsyncOpenAI
+                client = self._async_clients[loop] = AsyncOpenAI()
+            return client
+
+    @staticmethod
+    def _chat_response(response):
+        usage = getattr(response, "usage", None)
+        return ChatResponse(
+            response.choices[0].message.content,
+            prompt_tokens=(usage.prompt_tokens or 0) if usage is not None else 0,
+            completion_tokens=(usage.completion_tokens or 0) if usage is not None else 0,
+        )
+
+    def chat(self, model, messages, task=None, **options):
+        return self._chat_response(self.client.chat.completions.create(model=model, messages=messages, **options))
+
+    @staticmethod
+    def _stream_usage(chunk, usage):
+        # With include_usage, the last chunk carries the usage of the whole stream (and no choices)
+        if getattr(chunk, "usage", None) is not None:
+            _fill_usage(usage, chunk.usage.prompt_tokens or 0, chunk.usage.completion_tokens or 0)
+
+    def chat_stream(self, model, messages, task=None, usage=None, **options):
+        stream = self.client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **options
+        )
+        for chunk in stream:
+            self._stream_usage(chunk, usage)
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                yield text
+
+    def embed(self, model, inputs, usage=None):
+        response = self.client.embeddings.create(input=inputs, model=model)
+        _fill_usage(usage, response.usage.prompt_tokens if response.usage is not None else 0)
+        return [data.embedding for data in response.data]
+
+    async def chat_async(self, model, messages, task=None, **options):
+        response = await self.async_client.chat.completions.create(model=model, messages=messages, **options)
+        return self._chat_response(response)
+
+    async def chat_stream_async(self, model, messages, task=None, usage=None, **options):
+        stream = await self.async_client.chat.completions.create(
+            model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **options
+        )
+        async for chunk in stream:
+            self._stream_usage(chunk, usage)
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                yield text
+
+    async def embed_async(self, model, inputs, usage=None):
+        response = await self.async_client.embeddings.create(input=inputs, model=model)
+        _fill_usage(usage, response.usage.prompt_tokens if response.usage is not None else 0)
+        return [data.embedding for data in response.data]
+
+
+def hash_embedding(item, dim=FAKE_EMBEDDING_DIM):
+    """Unit-length float32 vector derived from a hash of the input (text or token list)."""
+    seed = int.from_bytes(hashlib.sha256(json.dumps(item).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def _digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode("utf-8")).digest()
+
+
+def _image_urls(messages):
+    return [
+        part["image_url"]["url"]
+        for message in messages if isinstance(message.get("content"), list)
+        for part in message["content"] if part.get("type") == "image_url"
+    ]
+
+
+def _text_chars(messages):
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += len(content)
+        elif isinstance(content, list):
+            total += sum(len(part.get("text", "")) for part in content if part.get("type") == "text")
+    return total
+
+
+class FakeProvider(ModelProvider):
+    """
+    Deterministic offline backend. Answers depend only on the request: embeddings are derived from a
+    hash of the text, analyses from a hash of the image, and each guardrail verdict from a hash of the
+    (reference, candidate) image pair, so batched and pairwise calls agree. `latency_ms` (+ up to
+    `jitter_ms`) is slept per call, and a seeded `error_rate` share of calls raises ProviderError.
+    """
+
+    name = "fake"
+    cache_namespace = "fake"
+
+    CATEGORIES = ("Shirts", "Tshirts", "Jeans", "Trousers", "Jackets", "Dresses", "Skirts", "Casual Shoes", "Belts")
+    COLOURS = ("Black", "White", "Navy Blue", "Grey", "Brown", "Beige", "Red", "Green")
+    GENDERS = ("Men", "Women")
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, yes_rate=0.5, dim=FAKE_EMBEDDING_DIM,
+                 stream_chunk_chars=16, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.yes_rate = yes_rate
+        self.dim = dim
+        self.stream_chunk_chars = stream_chunk_chars
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = {"chat": 0, "chat_stream": 0, "embed": 0, "errors": 0}
+
+    def _begin(self, kind):
+        """Count the call, maybe inject an error, and return the simulated latency in seconds."""
+        with self._lock:
+            self.calls[kind] += 1
+            fail = self.error_rate > 0 and self._rng.random() < self.error_rate
+            jitter = self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+            if fail:
+                self.calls["errors"] += 1
+        if fail:
+            raise ProviderError(f"Injected fake provider error ({kind})")
+        return (self.latency_ms + jitter) / 1000
+
+    def _answer(self, reference_url, candidate_url):
+        fraction = int.from_bytes(_digest(reference_url, candidate_url)[:8], "little") / 2**64
+        if fraction < self.yes_rate:
+            return {"answer": "yes", "reason": "The colours and styles complement each other."}
+        return {"answer": "no", "reason": "The styles do not work well together."}
+
+    def _analysis(self, image_url):
+        digest = _digest(image_url)
+        category = self.CATEGORIES[digest[0] % len(self.CATEGORIES)]
+        others = [name for name in self.CATEGORIES if name != category]
+        items = [
+            f"{self.COLOURS[digest[2 + i] % len(self.COLOURS)]} {others[(digest[1] + 3 * i) % len(others)]}"
+            for i in range(3)
+        ]
+        return {"items": items, "category": category, "gender": self.GENDERS[digest[5] % len(self.GENDERS)]}
+
+    def _respond(self, messages, task):
+        urls = _image_urls(messages)
+        task = task or ("analysis" if len(urls) <= 1 else "guardrail" if len(urls) == 2 else "guardrail_batch")
+        if task == "analysis":
+            result = self._analysis(urls[0] if urls else "")
+        elif task == "guardrail_batch":
+            result = {"verdicts": [
+                {"candidate": number, **self._answer(urls[0], url)} for number, url in enumerate(urls[1:], start=1)
+            ]}
+        else:
+            result = self._answer(urls[0] if urls else "", urls[1] if len(urls) > 1 else "")
+        text = json.dumps(result)
+        # Roughly what the API would bill: 4 characters per text token plus the estimated image tokens
+        image_tokens = payload_stats(messages)[2]
+        return ChatResponse(text, prompt_tokens=_text_chars(messages) // 4 + image_tokens,
+                            completion_tokens=len(text) // 4)
+
+    def _chunks(self, text):
+        return [text[start:start + self.stream_chunk_chars] for start in range(0, len(text), self.stream_chunk_chars)]
+
+    def chat(self, model, messages, task=None, **options):
+        time.sleep(self._begin("chat"))
+        return self._respond(messages, task)
+
+    def chat_stream(self, model, messages, task=None, usage=None, **options):
+        # The latency is spread over the chunks, like tokens arriving one after another
+        delay = self._begin("chat_stream")
+        response = self._respond(messages, task)
+        chunks = self._chunks(response.text)
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            yield chunk
+        _fill_usage(usage, response.prompt_tokens, response.completion_tokens)
+
+    def _embed(self, inputs, usage):
+        _fill_usage(usage, sum(len(item) // 4 + 1 if isinstance(item, str) else len(item) for item in inputs))
+        return [hash_embedding(item, self.dim).tolist() for item in inputs]
+
+    def embed(self, model, inputs, usage=None):
+        time.sleep(self._begin("embed"))
+        return self._embed(inputs, usage)
+
+    async def chat_async(self, model, messages, task=None, **options):
+        await asyncio.sleep(self._begin("chat"))
+        return self._respond(messages, task)
+
+    async def chat_stream_async(self, model, messages, task=None, usage=None, **options):
+        delay = self._begin("chat_stream")
+        response = self._respond(messages, task)
+        chunks = self._chunks(response.text)
+        for chunk in chunks:
+            await asyncio.sleep(delay / len(chunks))
+            yield chunk
+        _fill_usage(usage, response.prompt_tokens, response.completion_tokens)
+
+    async def embed_async(self, model, inputs, usage=None):
+        await asyncio.sleep(self._begin("embed"))
+        return self._embed(inputs, usage)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.calls)
+
+
+class RecordReplayProvider(ModelProvider):
+    """
+    Records responses to JSON files under `path` and replays them. Chat calls are keyed by model,
+    messages (images included) and options; embeddings are recorded per input (with an even share of the
+    batch's tokens), so replay does not depend on how inputs were batched or which of them the embedding
+    cache already held.
+
+    Modes: "record" calls `inner` and saves every response, "replay" only serves recordings (a missing
+    one raises ReplayMissError), "auto" replays when a recording exists and records otherwise.
+    """
+
+    name = "record_replay"
+
+    def __init__(self, path=MODEL_RECORDINGS_PATH, inner=None, mode="replay"):
+        if mode not in ("record", "replay", "auto"):
+            raise ValueError(f"Unknown record/replay mode {mode!r}")
+        if mode != "replay" and inner is None:
+            raise ValueError(f"Mode {mode!r} needs an inner provider to record from")
+        self.path = path
+        self.inner = inner
+        self.mode = mode
+        # Recordings of a fake backend are still fake
+        self.cache_namespace = inner.cache_namespace if inner is not None else ""
+        self._lock = threading.Lock()
+        self.counts = {"replayed": 0, "recorded": 0}
+
+    @staticmethod
+    def _key(kind, model, payload, options=None):
+        return hashlib.sha256(
+            json.dumps([kind, model, payload, options or {}], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _file(self, kind, key):
+        return os.path.join(self.path, kind, f"{key}.json")
+
+    def _load(self, kind, key):
+        if self.mode == "record":
+            return None
+        try:
+            with open(self._file(kind, key), "r", encoding="utf-8") as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            if self.mode == "replay":
+                raise ReplayMissError(f"No recorded {kind} response {key} under {self.path}")
+            return None
+        with self._lock:
+            self.counts["replayed"] += 1
+        return recording["response"]
+
+    def _save(self, kind, key, model, task, response):
+        filename = self._file(kind, key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        partial = f"{filename}.{os.getpid()}.{threading.get_ident()}.partial"
+        with open(partial, "w", encoding="utf-8") as f:
+            json.dump({"kind": kind, "model": model, "task": task, "response": response}, f)
+        os.replace(partial, filename)
+        with self._lock:
+            self.counts["recorded"] += 1
+
+    def chat(self, model, messages, task=None, **options):
+        key = self._key("chat", model, messages, options)
+        recorded = self._load("chat", key)
+        if recorded is not None:
+            return ChatResponse.from_dict(recorded)
+        response = self.inner.chat(model, messages, task, **options)
+        self._save("chat", key, model, task, response.to_dict())
+        return response
+
+    def chat_stream(self, model, messages, task=None, usage=None, **options):
+        key = self._key("chat_stream", model, messages, options)
+        recorded = self._load("chat_stream", key)
+        if recorded is not None:
+            yield from recorded["chunks"]
+            _fill_usage(usage, **recorded["usage"])
+            return
+        chunks, recorded_usage = [], {"prompt_tokens": 0, "completion_tokens": 0}
+        for chunk in self.inner.chat_stream(model, messages, task, recorded_usage, **options):
+            chunks.append(chunk)
+            yield chunk
+        self._save("chat_stream", key, model, task, {"chunks": chunks, "usage": recorded_usage})
+        _fill_usage(usage, **recorded_usage)
+
+    def _replay_embeddings(self, model, inputs):
+        keys = [self._key("embedding", model, item) for item in inputs]
+        recordings = [self._load("embedding", key) for key in keys]
+        missing = [i for i, recording in enumerate(recordings) if recording is None]
+        return keys, recordings, missing
+
+    def _record_embeddings(self, model, keys, recordings, missing, computed, computed_usage, usage):
+        tokens = computed_usage["prompt_tokens"] / len(missing) if missing else 0
+        for i, vector in zip(missing, computed):
+            recordings[i] = {"embedding": vector, "prompt_tokens": tokens}
+            self._save("embedding", keys[i], model, None, recordings[i])
+        _fill_usage(usage, round(sum(recording["prompt_tokens"] for recording in recordings)))
+        return [recording["embedding"] for recording in recordings]
+
+    def embed(self, model, inputs, usage=None):
+        keys, recordings, missing = self._replay_embeddings(model, inputs)
+        computed, computed_usage = [], {"prompt_tokens": 0}
+        if missing:
+            computed = self.inner.embed(model, [inputs[i] for i in missing], computed_usage)
+        return self._record_embeddings(model, keys, recordings, missing, computed, computed_usage, usage)
+
+    async def chat_async(self, model, messages, task=None, **options):
+        key = self._key("chat", model, messages, options)
+        recorded = self._load("chat", key)
+        if recorded is not None:
+            return ChatResponse.from_dict(recorded)
+        response = await self.inner.chat_async(model, messages, task, **options)
+        self._save("chat", key, model, task, response.to_dict())
+        return response
+
+    async def chat_stream_async(self, model, messages, task=None, usage=None, **options):
+        key = self._key("chat_stream", model, messages, options)
+        recorded = self._load("chat_stream", key)
+        if recorded is not None:
+            for chunk in recorded["chunks"]:
+                yield chunk
+            _fill_usage(usage, **recorded["usage"])
+            return
+        chunks, recorded_usage = [], {"prompt_tokens": 0, "completion_tokens": 0}
+        async for chunk in self.inner.chat_stream_async(model, messages, task, recorded_usage, **options):
+            chunks.append(chunk)
+            yield chunk
+        self._save("chat_stream", key, model, task, {"chunks": chunks, "usage": recorded_usage})
+        _fill_usage(usage, **recorded_usage)
+
+    async def embed_async(self, model, inputs, usage=None):
+        keys, recordings, missing = self._replay_embeddings(model, inputs)
+        computed, computed_usage = [], {"prompt_tokens": 0}
+        if missing:
+            computed = await self.inner.embed_async(model, [inputs[i] for i in missing], computed_usage)
+        return self._record_embeddings(model, keys, recordings, missing, computed, computed_usage, usage)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def create_provider(kind=MODEL_PROVIDER):
+    """Provider for a MODEL_PROVIDER value: "openai", "fake", "record" or "replay"."""
+    if kind == "openai":
+        return OpenAIProvider()
+    if kind == "fake":
+        return FakeProvider(latency_ms=FAKE_PROVIDER_LATENCY_MS, jitter_ms=FAKE_PROVIDER_JITTER_MS,
+                            error_rate=FAKE_PROVIDER_ERROR_RATE, yes_rate=FAKE_PROVIDER_YES_RATE)
+    if kind == "record":
+        return RecordReplayProvider(MODEL_RECORDINGS_PATH, inner=OpenAIProvider(), mode="record")
+    if kind == "replay":
+        return RecordReplayProvider(MODEL_RECORDINGS_PATH, mode="replay")
+    raise ValueError(f"Unknown model provider {kind!r}; expected openai, fake, record or replay")
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """Process-wide model provider, created from MODEL_PROVIDER on first use."""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = create_provider()
+        return _provider
+
+
+def set_provider(provider):
+    """Replace the process-wide provider (None = recreate from MODEL_PROVIDER on next use); returns the previous one."""
+    global _provider
+    with _provider_lock:
+        previous, _provider = _provider, provider
+        return previous
@@ -0,0 +1,186 @@
+"""
+quantized_index.py
+Compressed catalog index for multi-process serving. Normalized vectors are stored either as int8 codes
+with one scale per dimension (4x smaller than float32) or as 1-bit sign codes (32x smaller) scored by
+Hamming distance. The codes rank the whole catalog; only a shortlist of the best candidates is rescored
+with exact cosine similarity against the full float vectors, which stay memory-mapped on disk.
+"""
+
+# Standard library imports
+import json
+import os
+import time
+
+# 3P Imports
+import numpy as np
+
+# Local application imports
+from similarity import as_matrix, normalize_rows, select_top_k
+
+INDEX_FORMAT = "retailnext-quantized"
+INDEX_VERSION = 1
+KINDS = ("int8", "binary")
+
+_META_FILENAME = "index.json"
+_BATCH_ROWS = 16384
+# int8 rows are de-quantized in blocks of about this many float32 bytes, small enough to stay in cache
+_SCORE_BLOCK_BYTES = 1 << 20
+
+# np.bitwise_count needs numpy 2; older versions count bits through a byte lookup table
+_POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def _popcount(codes):
+    """Set bits per row of a uint8 matrix."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(codes).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT_TABLE[codes].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedIndex:
+    """
+    int8 or binary codes for every catalog row (in catalog order) plus the int8 per-dimension `scale`.
+    `vectors` are the full-precision rows used for rescoring; pass the memory-mapped store matrix so
+    they are only paged in for shortlisted items. `source_checksum` is the SHA-256 of the embedding
+    store matrix the codes were built from, if any.
+    """
+
+    def __init__(self, kind, codes, scale=None, dim=None, vectors=None, rescore_candidates=100,
+                 source_checksum=None):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown quantization {kind!r}; expected one of {KINDS}")
+        self.kind = kind
+        self.codes = codes
+        self.scale = scale
+        self.dim = dim if dim is not None else codes.shape[1]
+        self.vectors = vectors
+        self.rescore_candidates = rescore_candidates
+        self.source_checksum = source_checksum
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    @property
+    def nbytes(self):
+        """Memory held by the codes (the full vectors are not counted: they are read on demand)."""
+        return self.codes.nbytes + (0 if self.scale is None else self.scale.nbytes)
+
+    @classmethod
+    def build(cls, embeddings, kind="int8", rescore_candidates=100):
+        """
+        Quantize a catalog matrix. `embeddings` may be memory-mapped; it is read in batches and kept
+        (not copied) as the rescoring vectors.
+        """
+        matrix = as_matrix(embeddings)
+        size, dim = matrix.shape
+        if kind == "int8":
+            # Per-dimension scale from the largest magnitude seen in that dimension
+            peak = np.zeros(dim, dtype=np.float32)
+            for start in range(0, size, _BATCH_ROWS):
+                batch = np.nan_to_num(normalize_rows(matrix[start:start + _BATCH_ROWS]))
+                np.maximum(peak, np.abs(batch).max(axis=0), out=peak)
+            scale = np.where(peak > 0, peak / 127, 1).astype(np.float32)
+            codes = np.empty((size, dim), dtype=np.int8)
+            for start in range(0, size, _BATCH_ROWS):
+                batch = np.nan_to_num(normalize_rows(matrix[start:start + _BATCH_ROWS]))
+                codes[start:start + len(batch)] = np.clip(np.rint(batch / scale), -127, 127)
+        elif kind == "binary":
+            scale = None
+            codes = np.empty((size, (dim + 7) // 8), dtype=np.uint8)
+            for start in range(0, size, _BATCH_ROWS):
+                batch = matrix[start:start + _BATCH_ROWS]
+                codes[start:start + len(batch)] = np.packbits(batch > 0, axis=1)
+        else:
+            raise ValueError(f"Unknown quantization {kind!r}; expected one of {KINDS}")
+        return cls(kind, codes, scale=scale, dim=dim, vectors=matrix, rescore_candidates=rescore_candidates)
+
+    def approximate_scores(self, query_embedding, rows=None):
+        """
+        Code-space score of one query against every row (or only `rows`): the int8 dot product, or
+        minus the Hamming distance between sign codes. Higher is more similar.
+        """
+        query = np.asarray(query_embedding, dtype=np.float32).reshape(-1)
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        if self.kind == "int8":
+            # Fold the scale into the query so the codes never need de-quantizing as a whole
+            scaled = normalize_rows(query[None, :])[0] * self.scale
+            block = max(1, _SCORE_BLOCK_BYTES // (4 * self.dim))
+            for start in range(0, codes.shape[0], block):
+                scores[start:start + block] = codes[start:start + block].astype(np.float32) @ scaled
+        else:
+            packed = np.packbits(query > 0)
+            for start in range(0, codes.shape[0], _BATCH_ROWS):
+                scores[start:start + _BATCH_ROWS] = -_popcount(codes[start:start + _BATCH_ROWS] ^ packed)
+        return scores
+
+    def probe(self, query_embedding, rows=None, shortlist=None):
+        """
+        Rank one query by its code-space scores and rescore the best `shortlist` rows exactly.
+
+        Returns:
+            tuple: (catalog row positions, cosine similarities) for the shortlisted rows
+        """
+        if self.vectors is None:
+            raise ValueError("This quantized index has no vectors to rescore with; load it with `vectors`")
+        approximate = self.approximate_scores(query_embedding, rows=rows)
+        positions = select_top_k(approximate, -np.inf, shortlist or self.rescore_candidates)
+        # Sorted so the full vectors are read from the (possibly memory-mapped) matrix in file order
+        ids = np.sort(np.asarray(positions, dtype=np.int64) if rows is None else rows[positions])
+        query = normalize_rows(np.atleast_2d(np.asarray(query_embedding, dtype=np.float32)))[0]
+        return ids, normalize_rows(np.asarray(self.vectors[ids], dtype=np.float32)) @ query
+
+    def search(self, query_embedding, threshold=0.5, top_k=2, shortlist=None):
+        """Catalog row positions of the most similar items, best first (same contract as find_similar_items)."""
+        ids, scores = self.probe(query_embedding, shortlist=max(shortlist or self.rescore_candidates, top_k))
+        return ids[select_top_k(scores, threshold, top_k)].tolist()
+
+    def save(self, path):
+        """Write the codes (and int8 scale) as .npy arrays plus a JSON header; vectors are not saved."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "codes.npy"), self.codes)
+        if self.scale is not None:
+            np.save(os.path.join(path, "scale.npy"), self.scale)
+        meta = {
+            "format": INDEX_FORMAT,
+            "version": INDEX_VERSION,
+            "kind": self.kind,
+            "size": len(self),
+            "dim": self.dim,
+            "source_sha256": self.source_checksum,
+        }
+        with open(os.path.join(path, _META_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path, vectors=None, rescore_candidates=100, mmap=True):
+        """
+        Open a saved index, attaching `vectors` for rescoring. With `mmap`, the codes are memory-mapped,
+        so worker processes serving the same index share one copy in the page cache.
+        """
+        with open(os.path.join(path, _META_FILENAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != INDEX_FORMAT or meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Unsupported quantized index at {path}: {meta.get('format')} v{meta.get('version')}")
+        mmap_mode = "r" if mmap else None
+        codes = np.load(os.path.join(path, "codes.npy"), mmap_mode=mmap_mode)
+        scale = np.load(os.path.join(path, "scale.npy")) if meta["kind"] == "int8" else None
+        if vectors is not None and np.shape(vectors) != (meta["size"], meta["dim"]):
+            raise ValueError(f"Rescoring vectors do not match the quantized index ({meta['size']} x {meta['dim']})")
+        return cls(meta["kind"], codes, scale=scale, dim=meta["dim"], vectors=vectors,
+                   rescore_candidates=rescore_candidates, source_checksum=meta.get("source_sha256"))
+
+
+def build_quantized_index(embeddings, path, kind="int8", source_checksum=None):
+    """
+    Quantize a catalog matrix and save the codes to `path`, recording `source_checksum` (the embedding
+    store's matrix checksum) so stale codes can be detected at load time.
+    """
+    started = time.perf_counter()
+    index = QuantizedIndex.build(embeddings, kind=kind)
+    index.source_checksum = source_checksum
+    index.save(path)
+    ratio = len(index) * index.dim * 4 / max(1, index.nbytes)
+    print(f"✅ Built {kind} index ({len(index)} vectors, {index.nbytes / 2**20:.1f} MB, {ratio:.0f}x smaller) "
+          f"in {time.perf_counter() - started:.1f}s -> {path}")
+    return index
@@ -0,0 +1,179 @@
+"""
+rate_limiter.py
+Adaptive concurrency control for bulk API work such as embedding a catalog. Instead of a fixed worker
+count plus blind exponential backoff, workers ask the limiter for a slot before each request. The
+limiter enforces requests-per-minute and tokens-per-minute budgets over a sliding window, honours the
+x-ratelimit-* and retry-after headers returned by the API, and adjusts the number of concurrent
+requests AIMD-style: +1 per round of successful requests, halved on a 429 (at most once per cooldown).
+"""
+
+# Standard library imports
+import re
+import threading
+import time
+from collections import deque
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value):
+    """Seconds in a rate-limit reset header such as "1s", "6m0s", "20ms" or "1h2m3.5s" (None if absent)."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_SECONDS[unit] for number, unit in parts)
+
+
+def _header_int(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after_seconds(headers):
+    """Server-requested wait from retry-after-ms / retry-after headers, if any."""
+    if headers is None:
+        return None
+    milliseconds = parse_duration(headers.get("retry-after-ms"))
+    if milliseconds is not None:
+        return milliseconds / 1000
+    return parse_duration(headers.get("retry-after"))
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Thread-safe gate for API requests.
+
+    `acquire(tokens)` blocks until a request of that many tokens may start: fewer than `limit` requests
+    are in flight, the sliding one-minute request and token budgets have room, and no cooldown from a
+    429 or an exhausted rate-limit header is active. `release(tokens, headers, throttled)` must follow
+    every acquire, passing the response (or error) headers so limits are learned from the API.
+    """
+
+    def __init__(self, initial=4, min_concurrency=1, max_concurrency=32, requests_per_minute=None,
+                 tokens_per_minute=None, headroom=0.95, window_seconds=60.0):
+        self.limit = float(initial)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.headroom = headroom
+        self.window_seconds = window_seconds
+
+        self.in_flight = 0
+        self.requests = 0
+        self.tokens = 0
+        self.throttled = 0
+        self.peak_concurrency = 0
+        self._window = deque()
+        self._window_tokens = 0
+        self._blocked_until = 0.0
+        self._backoff_until = 0.0
+        self._condition = threading.Condition()
+
+    def _expire(self, now):
+        while self._window and self._window[0][0] <= now - self.window_seconds:
+            _, tokens = self._window.popleft()
+            self._window_tokens -= tokens
+
+    def _wait_seconds(self, now, tokens):
+        """0 if a request of `tokens` may start now, otherwise how long to wait before checking again."""
+        waits = [self._blocked_until - now]
+        if self.in_flight >= max(self.min_concurrency, int(self.limit)):
+            waits.append(1.0)  # woken by release() long before this
+        if self.requests_per_minute and len(self._window) >= self.requests_per_minute * self.headroom:
+            waits.append(self._window[0][0] + self.window_seconds - now)
+        if (self.tokens_per_minute and self._window
+                and self._window_tokens + tokens > self.tokens_per_minute * self.headroom):
+            # Wait until enough of the window has expired
+            needed = self._window_tokens + tokens - self.tokens_per_minute * self.headroom
+            for started, used in self._window:
+                needed -= used
+                if needed <= 0:
+                    waits.append(started + self.window_seconds - now)
+                    break
+            else:
+                # Larger than the whole budget: wait for the window to empty so it does not stack on other requests
+                waits.append(self._window[-1][0] + self.window_seconds - now)
+        return max(waits)
+
+    def acquire(self, tokens=0):
+        """Block until a request of `tokens` tokens may be sent."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                wait = self._wait_seconds(now, tokens)
+                if wait <= 0:
+                    break
+                self._condition.wait(timeout=wait)
+            self.in_flight += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.in_flight)
+            self._window.append((now, tokens))
+            self._window_tokens += tokens
+
+    def release(self, tokens=0, headers=None, throttled=False):
+        """
+        Return a slot. `headers` are the response (or 429 error) headers; `throttled` marks a 429,
+        which pauses new requests until the server's reset time and halves the concurrency limit. The
+        other requests of the same burst were already in flight, so their 429s do not halve it again.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if headers is not None:
+                self._learn(headers, now, tokens)
+            if throttled:
+                self.throttled += 1
+                pause = retry_after_seconds(headers) or 1.0
+                if now >= self._backoff_until:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._backoff_until = now + pause
+                self._blocked_until = max(self._blocked_until, now + pause)
+            else:
+                self.requests += 1
+                self.tokens += tokens
+                # Additive increase: about +1 slot after `limit` consecutive successes
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _learn(self, headers, now, tokens):
+        limit_requests = _header_int(headers, "x-ratelimit-limit-requests")
+        limit_tokens = _header_int(headers, "x-ratelimit-limit-tokens")
+        if limit_requests:
+            self.requests_per_minute = limit_requests
+        if limit_tokens:
+            self.tokens_per_minute = limit_tokens
+
+        # The server's own view of the budget wins over the local window when it is tighter
+        remaining_requests = _header_int(headers, "x-ratelimit-remaining-requests")
+        remaining_tokens = _header_int(headers, "x-ratelimit-remaining-tokens")
+        if remaining_requests is not None and remaining_requests <= 0:
+            reset = parse_duration(headers.get("x-ratelimit-reset-requests")) or 1.0
+            self._blocked_until = max(self._blocked_until, now + reset)
+        if remaining_tokens is not None and remaining_tokens < tokens:
+            reset = parse_duration(headers.get("x-ratelimit-reset-tokens")) or 1.0
+            self._blocked_until = max(self._blocked_until, now + reset)
+
+    def stats(self):
+        """Current limit and totals."""
+        with self._condition:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "peak_concurrency": self.peak_concurrency,
+                "requests": self.requests,
+                "tokens": self.tokens,
+                "throttled": self.throttled,
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+            }
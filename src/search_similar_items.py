@@ -1,33 +1,92 @@
 """
 search_similar_items.py
-Contains functions for generating embeddings using OpenAI (text-embedding-3-large) and retrieving top-matching items
+Contains functions for generating embeddings using OpenAI (text-embedding-3-large, through the model provider
+layer in providers.py) and retrieving top-matching items
 based on cosine similarity. Forms the retrieval layer in the GPT-5 mini + RAG pipeline.
 """
 
 # Standard library imports
+import os
 from typing import List
 
 # 3P Imports
 import numpy as np
-from openai import OpenAI
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+from tenacity import retry, retry_if_not_exception_type, wait_random_exponential, stop_after_attempt
 
 # Local application imports
-from config import EMBEDDING_MODEL
+from config import EMBEDDING_MODEL, ANN_ENABLED, ANN_INDEX_PATH, ANN_N_PROBE, RERANK_CANDIDATES, SEARCH_DIMS
+from config import QUANTIZATION, QUANTIZED_INDEX_PATH, QUANTIZED_RESCORE_CANDIDATES
+from ann_index import IVFIndex
+from data_loader import catalog_store_checksum, load_search_matrices, load_store_matrix
+from embedding_cache import get_embedding_cache
+from filter_index import FilterIndex
+from providers import ReplayMissError, get_provider
+from quantized_index import QuantizedIndex
+from similarity import as_matrix, normalize_rows, select_top_k, truncate_rows
+from telemetry import current_span, span
 
-# Initialize OpenAI client
-client = OpenAI()
+# Filters matching fewer than this share of the catalog gather their rows before scoring
+_GATHER_FRACTION = 0.3
 
 # Simple function to take in a list of text objects and return them as a list of embeddings
 
-@retry(wait=wait_random_exponential(min=1, max=40), stop=stop_after_attempt(10))
+# A missing recording will not appear by retrying
+_retry_request = retry(wait=wait_random_exponential(min=1, max=40), stop=stop_after_attempt(10),
+                       retry=retry_if_not_exception_type(ReplayMissError))
+
+@_retry_request
+
+def _request_embeddings(input: List):
+    usage = {"prompt_tokens": 0}
+    vectors = get_provider().embed(EMBEDDING_MODEL, input, usage=usage)
+    _record_request(input, usage)
+    return vectors
+
+
+def _record_request(input, usage):
+    stage = current_span()
+    stage.record_model_call(EMBEDDING_MODEL, usage["prompt_tokens"], payload=input)
+    stage.add(texts_embedded=len(input))
+
+
+def _record_cache_lookups(stage, input):
+    # Whatever was not sent to the API was served from the cache
+    embedded = stage.counts.get("texts_embedded", 0)
+    stage.add(cache_hits=len(input) - embedded, cache_misses=embedded)
+
 
 def get_embeddings(input: List):
-    response = client.embeddings.create(
-        input=input,
-        model=EMBEDDING_MODEL
-    ).data
-    return [data.embedding for data in response]
+    """
+    Return one embedding per input, served from the embedding cache where possible.
+    Only cache misses are sent to the API, together in a single batched request.
+    """
+    with span("get_embeddings", inputs=len(input)) as stage:
+        cache = get_embedding_cache()
+        if cache is None:
+            return _request_embeddings(input)
+        vectors = cache.get_or_compute(get_provider().model_key(EMBEDDING_MODEL), input, _request_embeddings)
+        _record_cache_lookups(stage, input)
+        return vectors
+
+
+@_retry_request
+async def _request_embeddings_async(input: List):
+    usage = {"prompt_tokens": 0}
+    vectors = await get_provider().embed_async(EMBEDDING_MODEL, input, usage=usage)
+    _record_request(input, usage)
+    return vectors
+
+
+async def get_embeddings_async(input: List):
+    """get_embeddings on the provider's async API; shares the embedding cache with the sync path."""
+    with span("get_embeddings", inputs=len(input)) as stage:
+        cache = get_embedding_cache()
+        if cache is None:
+            return await _request_embeddings_async(input)
+        model_key = get_provider().model_key(EMBEDDING_MODEL)
+        vectors = await cache.get_or_compute_async(model_key, input, _request_embeddings_async)
+        _record_cache_lookups(stage, input)
+        return vectors
 
 
 # Includes matching algorithm. Math - cosine similarity function]
@@ -46,43 +105,239 @@ def cosine_similarity_manual(vec1, vec2):
     return dot_product / (norm_vec1 * norm_vec2)
 
 
+class CatalogSearchEngine:
+    """
+    Cosine-similarity search over a catalog.
+
+    By default the search is exact: catalog vectors are normalized once into a contiguous float32
+    matrix, so scoring a batch of queries is a single matrix product and top-k selection is a partial
+    sort per query. With `search_dims`, search is two-stage: the catalog is scored on Matryoshka-truncated
+    vectors (`search_dims` components, re-normalized) and the best `rerank_candidates` are re-scored with
+    the full vectors, which are then only read for that shortlist and can stay memory-mapped.
+    Built with `from_index`, queries are answered approximately by an IVFIndex, or by a QuantizedIndex
+    whose int8 / binary codes shortlist candidates that are then rescored exactly.
+    With a FilterIndex attached, searches can be restricted to rows matching a filter expression.
+    """
+
+    def __init__(self, embeddings, ann_index=None, filter_index=None, search_dims=None, search_matrix=None,
+                 rerank_candidates=RERANK_CANDIDATES, quantized_index=None):
+        self.ann_index = ann_index
+        self.quantized_index = quantized_index
+        self.filter_index = filter_index
+        self.search_dims = None
+        self.full_matrix = None
+        self.rerank_candidates = rerank_candidates
+        if embeddings is None:
+            self.matrix = None
+            return
+        embeddings = as_matrix(embeddings)
+        if search_dims and search_dims < embeddings.shape[1]:
+            self.search_dims = search_dims
+            self.full_matrix = embeddings
+            # `matrix` is the first-stage matrix: truncated, unit-norm, contiguous
+            self.matrix = np.ascontiguousarray(
+                truncate_rows(embeddings, search_dims) if search_matrix is None else as_matrix(search_matrix)
+            )
+        else:
+            self.matrix = np.ascontiguousarray(normalize_rows(embeddings))
+
+    @classmethod
+    def from_dataframe(cls, df_items, search_dims=None):
+        """Build an engine (and its filter index) from a catalog DataFrame with an 'embeddings' column."""
+        return cls(df_items["embeddings"].tolist(), filter_index=FilterIndex(df_items), search_dims=search_dims)
+
+    @classmethod
+    def from_index(cls, index, df_items=None):
+        """
+        Build an approximate engine on top of an IVFIndex or a QuantizedIndex, with a filter index if
+        the catalog is given.
+        """
+        filter_index = None if df_items is None else FilterIndex(df_items)
+        if isinstance(index, QuantizedIndex):
+            return cls(None, quantized_index=index, filter_index=filter_index)
+        return cls(None, ann_index=index, filter_index=filter_index)
+
+    def __len__(self):
+        if self.matrix is None:
+            return len(self.ann_index if self.ann_index is not None else self.quantized_index)
+        return self.matrix.shape[0]
+
+    def score(self, query_embeddings, rows=None):
+        """
+        Cosine similarity of each query (rows) against every catalog item, or only the given `rows`.
+        On a two-stage engine these are the first-stage scores over the truncated vectors.
+        """
+        if self.matrix is None:
+            raise ValueError("Exact scoring is not available on an index-only engine")
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        if self.search_dims:
+            queries = truncate_rows(queries, self.search_dims)
+        else:
+            queries = normalize_rows(queries)
+        if rows is None:
+            return queries @ self.matrix.T
+        if len(rows) < _GATHER_FRACTION * len(self):
+            # Selective filter: gather the matching vectors and score only those
+            return queries @ self.matrix[rows].T
+        # Broad filter: a full product is cheaper than copying most of the matrix
+        return (queries @ self.matrix.T)[:, rows]
+
+    def _candidate_scores(self, query_embeddings, rows=None, mask=None, top_k=2, seen=()):
+        """
+        Yield (row positions or None for the whole catalog, scores) for each query.
+        `seen` is the caller's live list of items already taken, so two-stage shortlists can be deepened
+        by as many items as may be skipped.
+        """
+        if self.search_dims:
+            queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+            for query, row in zip(normalize_rows(queries), self.score(queries, rows=rows)):
+                shortlist = select_top_k(row, -np.inf, max(self.rerank_candidates, top_k) + len(seen))
+                # Sorted so the full vectors are read from the (possibly memory-mapped) matrix in file order
+                ids = np.sort(np.asarray(shortlist, dtype=np.int64) if rows is None else rows[shortlist])
+                yield ids, normalize_rows(self.full_matrix[ids]) @ query
+        elif self.quantized_index is not None:
+            for query in np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)):
+                shortlist = max(self.quantized_index.rescore_candidates, top_k) + len(seen)
+                yield self.quantized_index.probe(query, rows=rows, shortlist=shortlist)
+        elif self.ann_index is not None:
+            index = self.ann_index
+            for query in np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)):
+                if rows is not None and len(rows) <= len(index) * index.n_probe / index.n_lists:
+                    # Selective filter: fewer matching rows than the probed lists would hold; score them all
+                    yield index.score_rows(query, rows)
+                    continue
+                n_probe = index.n_probe
+                while True:
+                    ids, scores = index.probe(query, n_probe=n_probe)
+                    if mask is not None:
+                        keep = mask[ids]
+                        ids, scores = ids[keep], scores[keep]
+                    # Filtered rows may be rare in the nearest lists: probe more until top_k (plus the items
+                    # `unique` may skip) survive the filter; probing every list is exact filtered search
+                    if mask is None or len(ids) >= top_k + len(seen) or n_probe >= index.n_lists:
+                        break
+                    n_probe = min(index.n_lists, 2 * n_probe)
+                yield ids, scores
+        else:
+            for row in self.score(query_embeddings, rows=rows):
+                yield rows, row
+
+    def search(self, query_embedding, threshold=0.5, top_k=2, filters=None):
+        """Indices of the most similar catalog items for one query, best first."""
+        return self.search_many([query_embedding], threshold=threshold, top_k=top_k, filters=filters)[0]
+
+    def search_many(self, query_embeddings, threshold=0.5, top_k=2, unique=False, filters=None):
+        """
+        Indices of the most similar catalog items for each query, best first.
+        All queries are scored together as one (queries x catalog) matrix product. With `unique`,
+        an item returned for an earlier query is skipped for later ones, which then fall through
+        to their next best match. `filters` is a FilterIndex expression; only matching rows are scored.
+        """
+        with span("search", queries=len(query_embeddings)) as stage:
+            rows = mask = None
+            if filters:
+                if self.filter_index is None:
+                    raise ValueError("This search engine has no filter index; build it from the catalog DataFrame")
+                mask = self.filter_index.mask(filters)
+                rows = np.flatnonzero(mask)
+            stage.add(rows_scored=len(self) if rows is None else len(rows))
+            if len(self) == 0 or (rows is not None and len(rows) == 0):
+                return [[] for _ in query_embeddings]
+
+            results = []
+            seen = []
+            for ids, row in self._candidate_scores(query_embeddings, rows=rows, mask=mask, top_k=top_k, seen=seen):
+                if unique and seen:
+                    row = row.copy()
+                    row[seen if ids is None else np.isin(ids, seen)] = -np.inf
+                positions = select_top_k(row, threshold, top_k)
+                indices = positions if ids is None else ids[positions].tolist()
+                seen.extend(indices)
+                results.append(indices)
+            return results
+
+
+def build_search_engine(df_items):
+    """
+    Search engine for a full catalog as loaded by load_clothing_data. Uses the saved IVF index when
+    ANN is enabled and the index was built from the embedding store the catalog was loaded from, then the saved quantized index when QUANTIZATION
+    is set (and the codes were built from the same store), otherwise exact search, two-stage over SEARCH_DIMS-truncated vectors when configured.
+    """
+    if ANN_ENABLED and os.path.isdir(ANN_INDEX_PATH):
+        try:
+            index = IVFIndex.load(ANN_INDEX_PATH, n_probe=ANN_N_PROBE)
+            # Row positions are only meaningful for the exact catalog the index was built from
+            if index.source_checksum is not None and index.source_checksum == catalog_store_checksum(df_items):
+                return CatalogSearchEngine.from_index(index, df_items)
+            print("⚠️  ANN index was not built from the current embedding store; rebuild it with "
+                  "generate_embeddings.py; using exact search")
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not load ANN index: {e}; using exact search")
+    if QUANTIZATION and os.path.isdir(QUANTIZED_INDEX_PATH):
+        # Rescoring reads the memory-mapped matrix of the store the codes were built from
+        vectors = load_store_matrix(df_items)
+        try:
+            index = QuantizedIndex.load(QUANTIZED_INDEX_PATH, vectors=vectors,
+                                        rescore_candidates=QUANTIZED_RESCORE_CANDIDATES)
+            checksum = catalog_store_checksum(df_items) if vectors is not None else None
+            if checksum is None or index.source_checksum != checksum:
+                print("⚠️  Quantized index was not built from the current embedding store; rebuild it with "
+                      "generate_embeddings.py; using exact search")
+            elif index.kind == QUANTIZATION:
+                return CatalogSearchEngine.from_index(index, df_items)
+            else:
+                print(f"⚠️  Quantized index is {index.kind}, not {QUANTIZATION}; rebuild it with generate_embeddings.py")
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Could not load quantized index: {e}; using exact search")
+    if SEARCH_DIMS:
+        # Memory-mapped full and truncated matrices when the catalog came from the embedding store
+        matrices = load_search_matrices(df_items, SEARCH_DIMS)
+        if matrices is not None:
+            full_matrix, search_matrix = matrices
+            return CatalogSearchEngine(full_matrix, filter_index=FilterIndex(df_items), search_dims=SEARCH_DIMS,
+                                       search_matrix=search_matrix)
+    return CatalogSearchEngine.from_dataframe(df_items, search_dims=SEARCH_DIMS)
+
+
 def find_similar_items(input_embedding, embeddings, threshold=0.5, top_k=2):
     """
     Find the most similar items based on cosine similarity.
+    `embeddings` may be a list of vectors, a prebuilt CatalogSearchEngine, an IVFIndex or a QuantizedIndex.
     """
-    
-    # Calculate cosine similarity between the input embedding and all other embeddings
-    similarities = [(index, cosine_similarity_manual(input_embedding, vec)) for index, vec in enumerate(embeddings)]
-    
-    # Filter out any similarities below the threshold
-    filtered_similarities = [(index, sim) for index, sim in similarities if sim >= threshold]
-    
-    # Sort the filtered similarities by similarity score
-    sorted_indices = sorted(filtered_similarities, key=lambda x: x[1], reverse=True)[:top_k]
+    if isinstance(embeddings, CatalogSearchEngine):
+        engine = embeddings
+    elif isinstance(embeddings, (IVFIndex, QuantizedIndex)):
+        engine = CatalogSearchEngine.from_index(embeddings)
+    else:
+        engine = CatalogSearchEngine(embeddings)
 
-    # Return just the indices (not the tuples with similarity scores)
-    return [index for index, sim in sorted_indices]
+    # Return just the indices, most similar first
+    return engine.search(input_embedding, threshold=threshold, top_k=top_k)
 
 
-def find_matching_items_with_rag(df_items, item_descs):
+def find_matching_items_with_rag(df_items, item_descs, engine=None, filters=None):
     """
     Take the input item descriptions and find the most similar items based on cosine similarity for each description.
+    Each catalog item is returned at most once, even if it is among the best matches for several descriptions.
+    Pass a CatalogSearchEngine built from `df_items` to avoid rebuilding the catalog matrix on every call, and
+    a filter expression (see filter_index.complementary_filter) to search only matching rows of `df_items`.
     """
 
-    # Select the embeddings from the DataFrame
-    embeddings = df_items['embeddings'].tolist()
+    if engine is None:
+        engine = CatalogSearchEngine.from_dataframe(df_items)
+
+    item_descs = list(item_descs)
+    if not item_descs:
+        return []
+
+    # Embed every description in one request and score them together against the catalog
+    query_embeddings = get_embeddings(item_descs)
+    similar_indices = engine.search_many(query_embeddings, threshold=0.6, unique=True, filters=filters)
 
     similar_items = []
-    for desc in item_descs:
-        # Generate the embedding for the input item
-        input_embeddings = get_embeddings([desc])
-        input_embedding = input_embeddings[0]  # Get the first (and only) embedding
-
-        # Find the most similar items based on cosine similarity
-        similar_indices = find_similar_items(input_embedding, embeddings, threshold=0.6)
-    
-        for i in similar_indices:
+    for indices in similar_indices:
+        for i in indices:
             item = df_items.iloc[i]
             similar_items.append(item.to_dict())
-    
-    return similar_items
\ No newline at end of file
+
+    return similar_items
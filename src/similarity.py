@@ -0,0 +1,57 @@
+"""
+similarity.py
+Vector helpers shared by the exact and approximate search paths: building float32 matrices,
+row normalization for cosine similarity, Matryoshka truncation, and threshold-aware partial top-k selection.
+"""
+
+# 3P Imports
+import numpy as np
+
+
+def as_matrix(embeddings):
+    """Stack a list of vectors (or pass through an array) as a 2-D float32 matrix."""
+    if not isinstance(embeddings, np.ndarray):
+        embeddings = list(embeddings)
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim != 2:
+        if matrix.size:
+            raise ValueError(f"Expected a 2-D embedding matrix, got shape {matrix.shape}")
+        matrix = np.empty((0, 0), dtype=np.float32)
+    return matrix
+
+
+def normalize_rows(matrix):
+    """
+    L2-normalize the rows of a float32 matrix. Zero vectors become NaN rows so they never pass a
+    similarity threshold, matching the NaN produced by cosine_similarity_manual.
+    """
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (matrix / norms).astype(np.float32, copy=False)
+
+
+def truncate_rows(matrix, dims):
+    """
+    Matryoshka truncation: the first `dims` components of every row, re-normalized to unit length.
+    Models trained for it (text-embedding-3-*) keep most of their ranking quality at a fraction of the width.
+    """
+    return normalize_rows(as_matrix(matrix)[:, :dims])
+
+
+def select_top_k(scores, threshold, top_k):
+    """
+    Return the positions of the `top_k` highest scores at or above `threshold`, best first.
+    Uses partial selection instead of a full sort; ties are broken by the lower position so the
+    result is identical to a stable sort of the whole row.
+    """
+    if top_k <= 0:
+        return []
+    candidates = np.flatnonzero(scores >= threshold)
+    candidate_scores = scores[candidates]
+    if len(candidates) > top_k:
+        # Everything scoring at least the k-th best value, including ties at the boundary
+        kth = np.partition(candidate_scores, len(candidates) - top_k)[len(candidates) - top_k]
+        keep = candidate_scores >= kth
+        candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+    order = np.lexsort((candidates, -candidate_scores))[:top_k]
+    return candidates[order].tolist()
@@ -0,0 +1,444 @@
+"""
+telemetry.py
+Span-based instrumentation for the recommendation flow. Each stage (analyze_image, get_embeddings,
+search, prepare_image, check_match, ...) runs inside a span that records its latency together with
+counts reported along the way: model calls, prompt / completion / estimated image tokens, cost from the
+rates in config.py, bytes sent and cache hits / misses.
+
+A span's counts roll up into its parent, so the root span of a request (e.g. "recommendation" in
+pipeline.py) ends with per-request totals and a per-stage breakdown. Finished spans feed a process-wide
+MetricsRegistry (counters plus latency histograms with p50/p95/p99) that can be dumped as JSON, rendered
+in the Prometheus text format or served over HTTP, and are written as structured JSON log lines.
+
+    with span("check_match", candidate_id=42) as stage:
+        stage.add(cache_hits=1)
+"""
+
+# Standard library imports
+import base64
+import binascii
+import collections
+import contextlib
+import contextvars
+import io
+import json
+import logging
+import math
+import os
+import threading
+import time
+import types
+import uuid
+
+# 3P Imports
+from PIL import Image
+
+# Local application imports
+from config import EMBEDDING_COST_PER_1K_TOKENS, EMBEDDING_MODEL, GPT_MODEL
+from config import GPT_COST_PER_1K_COMPLETION_TOKENS, GPT_COST_PER_1K_PROMPT_TOKENS
+from config import TELEMETRY_ENABLED, TELEMETRY_HISTOGRAM_SAMPLES, TELEMETRY_LOG_PATH, TELEMETRY_LOG_SPANS
+
+# USD per 1K (prompt, completion) tokens
+MODEL_RATES = {
+    GPT_MODEL: (GPT_COST_PER_1K_PROMPT_TOKENS, GPT_COST_PER_1K_COMPLETION_TOKENS),
+    EMBEDDING_MODEL: (EMBEDDING_COST_PER_1K_TOKENS, 0.0),
+}
+QUANTILES = (0.5, 0.95, 0.99)
+# Base64 characters decoded to read an image's dimensions: covers the headers of the JPEGs image_prep writes
+_IMAGE_HEADER_CHARS = 16384
+
+logger = logging.getLogger("retailnext.telemetry")
+
+_current = contextvars.ContextVar("telemetry_span", default=None)
+_fold_lock = threading.Lock()
+
+
+def model_cost(model, prompt_tokens, completion_tokens=0):
+    """USD cost of a call from the config.py rates (0 for models without a rate)."""
+    prompt_rate, completion_rate = MODEL_RATES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_rate + completion_tokens * completion_rate) / 1000
+
+
+def _image_tokens(url):
+    """Estimated vision tokens of a base64 JPEG data URL (0 if it cannot be decoded)."""
+    # Imported here: image_prep is itself instrumented with spans from this module
+    from image_prep import estimate_image_tokens
+
+    if not url.startswith("data:"):
+        return 0
+    start = url.find(",") + 1
+    # The dimensions are in the header, so only a prefix of the payload is copied and decoded; the whole
+    # payload only when the header runs past it (e.g. large EXIF blocks in an unprepared upload)
+    for end in (start + _IMAGE_HEADER_CHARS, len(url)):
+        try:
+            with Image.open(io.BytesIO(base64.b64decode(url[start:end]))) as image:
+                return estimate_image_tokens(*image.size)
+        except (binascii.Error, OSError, ValueError):
+            if end >= len(url):
+                return 0
+    return 0
+
+
+def payload_stats(payload):
+    """
+    (bytes sent, images, estimated image tokens) for chat messages or a list of embedding inputs.
+    Bytes count the text and image URLs carried by the request, not the JSON framing around them.
+    """
+    sent = images = image_tokens = 0
+    for entry in payload:
+        if isinstance(entry, str):
+            sent += len(entry.encode("utf-8"))
+        elif isinstance(entry, dict):
+            content = entry.get("content")
+            parts = [{"type": "text", "text": content}] if isinstance(content, str) else content or []
+            for part in parts:
+                if part.get("type") == "text":
+                    sent += len(part["text"].encode("utf-8"))
+                elif part.get("type") == "image_url":
+                    url = part["image_url"]["url"]
+                    sent += len(url)
+                    images += 1
+                    image_tokens += _image_tokens(url)
+        else:
+            # Token lists
+            sent += 4 * len(entry)
+    return sent, images, image_tokens
+
+
+def percentile(ordered, quantile):
+    """Nearest-rank percentile of an ascending list (0.0 when empty)."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(quantile * len(ordered)) - 1))]
+
+
+class Histogram:
+    """Count, sum and max of all observations plus percentiles over the most recent `samples` of them."""
+
+    def __init__(self, samples=TELEMETRY_HISTOGRAM_SAMPLES):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._recent = collections.deque(maxlen=samples)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self._recent.append(value)
+
+    def snapshot(self):
+        ordered = sorted(self._recent)
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "max": self.max,
+            **{f"p{round(quantile * 100)}": percentile(ordered, quantile) for quantile in QUANTILES},
+        }
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class MetricsRegistry:
+    """Thread-safe labelled counters and histograms."""
+
+    def __init__(self, samples=TELEMETRY_HISTOGRAM_SAMPLES):
+        self.samples = samples
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.samples)
+            histogram.observe(value)
+
+    def snapshot(self):
+        """{"counters": [...], "histograms": [...]}, each entry with its name and labels."""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = [
+                {"name": name, "labels": dict(labels), **histogram.snapshot()}
+                for (name, labels), histogram in sorted(self._histograms.items())
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def render_prometheus(self, prefix="retailnext_"):
+        """Prometheus text exposition: counters as counters, histograms as summaries with quantiles."""
+        snapshot = self.snapshot()
+        lines, typed = [], set()
+
+        def labels_text(labels, **extra):
+            labels = {**labels, **extra}
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{name}="{json.dumps(str(value))[1:-1]}"' for name, value in labels.items()) + "}"
+
+        for counter in snapshot["counters"]:
+            name = prefix + counter["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{labels_text(counter['labels'])} {counter['value']}")
+        for histogram in snapshot["histograms"]:
+            name = prefix + histogram["name"]
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} summary")
+            for quantile in QUANTILES:
+                value = histogram[f"p{round(quantile * 100)}"]
+                lines.append(f"{name}{labels_text(histogram['labels'], quantile=quantile)} {value}")
+            lines.append(f"{name}_sum{labels_text(histogram['labels'])} {histogram['sum']}")
+            lines.append(f"{name}_count{labels_text(histogram['labels'])} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """Write the snapshot as JSON."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+_registry = MetricsRegistry()
+
+
+def get_registry():
+    """Process-wide metrics registry fed by every finished span."""
+    return _registry
+
+
+class Span:
+    """
+    One timed stage. `add` accumulates numeric counts (tokens, bytes, cache hits, ...); on `finish` the
+    span's totals (its own counts plus those of finished children) roll up into its parent, and the
+    root span of the trace collects a per-stage breakdown.
+    """
+
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.root = parent.root if parent is not None else self
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.counts = {}
+        self.totals = {}
+        self.stages = {}
+        self.duration = None
+        self._started_at = time.time()
+        self._started = time.perf_counter()
+
+    def add(self, **counts):
+        with _fold_lock:
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def record_model_call(self, model, prompt_tokens=0, completion_tokens=0, payload=None):
+        """Count one model call with its token usage and cost, plus the bytes and images in `payload`."""
+        sent, images, image_tokens = payload_stats(payload) if payload is not None else (0, 0, 0)
+        self.add(
+            model_calls=1,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            image_tokens=image_tokens,
+            images_sent=images,
+            bytes_sent=sent,
+            cost_usd=model_cost(model, prompt_tokens, completion_tokens),
+        )
+
+    def finish(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.attributes["error"] = type(error).__name__
+        with _fold_lock:
+            for name, value in self.counts.items():
+                self.totals[name] = self.totals.get(name, 0) + value
+            stage = self.root.stages.setdefault(self.name, {"count": 0, "seconds": 0.0})
+            stage["count"] += 1
+            stage["seconds"] += self.duration
+            for name, value in self.counts.items():
+                stage[name] = stage.get(name, 0) + value
+            if self.parent is not None:
+                for name, value in self.totals.items():
+                    self.parent.totals[name] = self.parent.totals.get(name, 0) + value
+
+        _registry.observe("stage_seconds", self.duration, stage=self.name)
+        for name, value in self.counts.items():
+            _registry.inc(f"{name}_total", value, stage=self.name)
+        if error is not None:
+            _registry.inc("errors_total", stage=self.name)
+
+        if TELEMETRY_LOG_SPANS:
+            _log({
+                "event": "span",
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent.span_id if self.parent is not None else None,
+                "name": self.name,
+                "start": self._started_at,
+                "duration_ms": self.duration * 1000,
+                "attributes": self.attributes,
+                "counts": self.counts,
+            })
+        if self.parent is None:
+            _log({"event": "trace", **self.summary()})
+
+    def summary(self):
+        """Trace id, duration, totals and per-stage breakdown (complete once the span has finished)."""
+        with _fold_lock:
+            return {
+                "trace_id": self.trace_id,
+                "name": self.name,
+                "duration_ms": (self.duration if self.duration is not None else time.perf_counter() - self._started) * 1000,
+                "attributes": dict(self.attributes),
+                "totals": dict(self.totals),
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+            }
+
+
+class _NullSpan:
+    """Stand-in when telemetry is disabled or no span is active; every method is a no-op."""
+
+    name = None
+    # Read-only: the no-op span is shared by every caller, so nothing may be stored in it
+    counts = totals = stages = attributes = types.MappingProxyType({})
+
+    def add(self, **counts):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def record_model_call(self, model, prompt_tokens=0, completion_tokens=0, payload=None):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+    def summary(self):
+        return None
+
+
+NULL_SPAN = _NullSpan()
+
+
+def current_span():
+    """The innermost active span, or a no-op span outside any."""
+    return _current.get() or NULL_SPAN
+
+
+def start_span(name, **attributes):
+    """
+    Create a span under the current one without activating it; call `finish()` when done. Used where
+    a context manager cannot be, e.g. around generators that yield to their caller mid-span.
+    """
+    if not TELEMETRY_ENABLED:
+        return NULL_SPAN
+    return Span(name, parent=_current.get(), **attributes)
+
+
+@contextlib.contextmanager
+def activate(active_span):
+    """Make `active_span` the current span (the parent of spans started inside the block)."""
+    if active_span is NULL_SPAN:
+        yield active_span
+        return
+    token = _current.set(active_span)
+    try:
+        yield active_span
+    finally:
+        _current.reset(token)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time the block as a child of the current span; exceptions are recorded on the span and re-raised."""
+    stage = start_span(name, **attributes)
+    if stage is NULL_SPAN:
+        yield stage
+        return
+    token = _current.set(stage)
+    try:
+        yield stage
+    except BaseException as e:
+        stage.finish(error=e)
+        raise
+    finally:
+        _current.reset(token)
+        stage.finish()
+
+
+_log_handler_lock = threading.Lock()
+_log_handler = None
+
+
+def _log(record):
+    global _log_handler
+    if TELEMETRY_LOG_PATH and _log_handler is None:
+        with _log_handler_lock:
+            if _log_handler is None:
+                directory = os.path.dirname(TELEMETRY_LOG_PATH)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                _log_handler = logging.FileHandler(TELEMETRY_LOG_PATH, encoding="utf-8")
+                _log_handler.setFormatter(logging.Formatter("%(message)s"))
+                logger.addHandler(_log_handler)
+                logger.setLevel(logging.INFO)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps(record, default=str))
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """
+    Serve the registry over HTTP from a daemon thread: /metrics in the Prometheus text format and
+    /metrics.json as the JSON snapshot. Returns the server (call `shutdown()` to stop it).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = get_registry().render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(get_registry().snapshot()).encode("utf-8"), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="telemetry-metrics", daemon=True).start()
+    return server
@@ -0,0 +1,159 @@
+"""
+ttl_cache.py
+Size-bounded LRU cache with per-entry time-to-live and optional SQLite persistence, for memoizing
+expensive model calls (guardrail verdicts, image analyses). Values must be JSON-serializable when
+persistence is enabled; the disk tier is shared safely between worker processes.
+"""
+
+# Standard library imports
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access);
+"""
+
+
+class TTLCache:
+    """
+    LRU cache of at most `max_entries` values, each valid for `ttl_seconds` after it was stored.
+    With a `path`, entries are also written to an SQLite file so they survive restarts; the file
+    holds at most `max_entries` rows as well.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default` if it is missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+                self.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        value = json.loads(row[0])
+                        self._remember(key, value, row[1])
+                        self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                        self.hits += 1
+                        return value
+                    self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.expirations += 1
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl_seconds=None):
+        """Store `value` under `key` for `ttl_seconds` (default: the cache's TTL)."""
+        now = time.time()
+        expires_at = now + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is None:
+                return
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now),
+                )
+                self._db.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+                count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                if count > self.max_entries:
+                    self._db.execute(
+                        "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+                    self.evictions += count - self.max_entries
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def warm(self):
+        """
+        Load the most recently used unexpired disk entries into memory (up to `max_entries`), e.g. so
+        lookups that scan `items()` also see entries stored before a restart. Returns the number loaded.
+        """
+        if self._db is None:
+            return 0
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, value, expires_at FROM entries WHERE expires_at > ? ORDER BY last_access DESC LIMIT ?",
+                (now, self.max_entries),
+            ).fetchall()
+            # Least recently used first, so the memory tier keeps the disk tier's LRU order
+            for key, value, expires_at in reversed(rows):
+                if key not in self._memory:
+                    self._remember(key, json.loads(value), expires_at)
+            return len(rows)
+
+    def items(self):
+        """Snapshot of the unexpired (key, value) pairs held in memory, least recently used first."""
+        now = time.time()
+        with self._lock:
+            return [(key, value) for key, (value, expires_at) in self._memory.items() if expires_at > now]
+
+    def stats(self):
+        """Hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "entries": len(self._memory),
+            }
+
+    def clear(self):
+        """Drop every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
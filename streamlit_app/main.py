@@ -3,13 +3,10 @@ RetailNext - AI Fashion Recommendation System
 Modern Streamlit interface using the RetailNext UX skin
 """
 
+import asyncio
 import streamlit as st
 import os
 import sys
-import json
-import base64
-from PIL import Image
-import io
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -22,10 +19,13 @@ src_path = os.path.join(project_root, 'src')
 sys.path.insert(0, src_path)
 
 # Import our core modules
-from analysis import analyze_image
-from search_similar_items import find_matching_items_with_rag
-from guardrails import check_match
-from data_loader import load_clothing_data
+from pipeline import CATALOG_IMAGES_DIR, load_catalog_image, recommend
+from catalog import get_catalog_manager
+from config import GUARDRAIL_TARGET_MATCHES, PROFILE, TELEMETRY_METRICS_PORT
+from image_prep import prepare_image
+from image_blob_store import get_image_blob_store
+from profiling import profile_request, resolve_mode
+from telemetry import serve_metrics
 
 # Import the UX skin
 from ui_skin import mount_ui, render_navbar, render_footer, hero, section, cards, steps
@@ -33,7 +33,246 @@ from ui_skin import mount_ui, render_navbar, render_footer, hero, section, cards
 # Mount the UI skin
 mount_ui(title="RetailNext — AI Outfit Assistant", favicon="🛍️")
 
+
+@st.cache_resource(show_spinner="Loading catalog...")
+def get_catalog():
+    """Catalog and search index, loaded once per server process and shared by all sessions."""
+    manager = get_catalog_manager()
+    manager.snapshot()
+    return manager
+
+
+@st.cache_resource
+def start_metrics_server():
+    """Telemetry metrics endpoint (/metrics, /metrics.json), started once per server process when configured."""
+    return serve_metrics(TELEMETRY_METRICS_PORT) if TELEMETRY_METRICS_PORT else None
+
+
+def requested_profile_mode():
+    """?profile=sample|cprofile|1 profiles this request; otherwise the PROFILE environment variable applies."""
+    if hasattr(st, "query_params"):
+        value = st.query_params.get("profile")
+    else:
+        value = (st.experimental_get_query_params().get("profile") or [None])[0]
+    try:
+        return resolve_mode(value if value is not None else PROFILE)
+    except ValueError as e:
+        st.warning(f"⚠️ Profiling disabled: {e}")
+        return None
+
+SUBCATEGORIES = ["Tshirts", "Kurtas", "Casual Shoes", "Shorts", "Trousers", "Sports Shoes", "Track Pants", "Flip Flops", "Jeans", "Sandals", "Night suits", "Formal Shoes", "Jackets", "Sweatshirts", "Tracksuits", "Rain Trousers", "Free Gifts", "Sweaters", "Lounge Pants", "Basketballs", "Waistcoat", "Lounge Shorts", "Ties"]
+MAX_DISPLAYED_MATCHES = 5
+
+
+def catalog_image_path(item_id):
+    # Absolute path (resolved from the project root) that works both locally and on Streamlit Cloud
+    return os.path.join(CATALOG_IMAGES_DIR, f"{item_id}.jpg")
+
+
+def render_analysis(analysis_data):
+    st.markdown("""
+    <div style="
+        background: linear-gradient(135deg, #7c5cff, #8b5cf6);
+        color: white;
+        padding: 12px 20px;
+        border-radius: 12px;
+        text-align: center;
+        font-weight: 600;
+        margin: 20px 0;
+        box-shadow: 0 8px 25px rgba(124, 92, 255, 0.3);
+    ">
+        Image analysis complete!
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Display what was detected in the uploaded image using the new result box
+    from ui_skin import result_box
+    
+    # Create fields for the result box
+    fields = {}
+    if 'category' in analysis_data:
+        fields['Item Category'] = analysis_data['category']
+    if 'gender' in analysis_data:
+        fields['Target Gender'] = analysis_data['gender']
+    
+    # Display everything in one beautiful result box
+    result_box(
+        title="Item Analysis Results",
+        fields=fields,
+        matches=analysis_data.get('items', [])
+    )
+    
+    # Find matching items from catalog
+    from ui_skin import _inject_result_box_css
+    _inject_result_box_css()
+    st.markdown("""
+    <div class="rnx-result-box">
+      <h3>Finding Similar Items</h3>
+      <p class="rnx-kv">Searching our catalog for items that match the AI recommendations...</p>
+    </div>
+    """, unsafe_allow_html=True)
+
+
+def render_match_card(match):
+    card_content = f"""
+    <div class='rnx-card'>
+        <h3 style="background: linear-gradient(135deg, #7c5cff, #5eead4); -webkit-background-clip: text; -webkit-text-fill-color: transparent; font-weight: bold; font-size: 18px; margin-bottom: 12px;">{match.get('productDisplayName', 'Unknown Item')}</h3>
+        <p class='rnx-muted'>
+            <strong>Category:</strong> {match.get('articleType', 'N/A')}<br/>
+            <strong>Gender:</strong> {match.get('gender', 'N/A')}<br/>
+            <strong>Color:</strong> {match.get('baseColour', 'N/A')}<br/>
+            <strong>Season:</strong> {match.get('season', 'N/A')}<br/>
+            <strong>Usage:</strong> {match.get('usage', 'N/A')}
+        </p>
+    </div>
+    """
+    st.markdown(card_content, unsafe_allow_html=True)
+    
+    # Show product image if available
+    try:
+        item_id = match.get('id')
+        image_store = get_image_blob_store()
+        image_path = catalog_image_path(item_id)
+        if image_store is not None and item_id in image_store:
+            # Pre-encoded thumbnail, sliced from the mapped blob file
+            st.image(bytes(image_store.thumbnail(item_id)), caption=f"ID: {match.get('id', 'N/A')}", width=210)
+        elif os.path.exists(image_path):
+            st.image(image_path, caption=f"ID: {match.get('id', 'N/A')}", width=210)
+        else:
+            st.markdown("""
+            <div style="
+                width: 100%; 
+                height: 150px; 
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                border-radius: 10px;
+                display: flex;
+                align-items: center;
+                justify-content: center;
+                color: white;
+                font-size: 24px;
+            ">
+                👔
+            </div>
+            """, unsafe_allow_html=True)
+    except Exception as e:
+        st.error(f"Error loading image: {e}")
+
+
+def render_verdict(compatibility_data):
+    st.markdown("<div class='rnx-card'>", unsafe_allow_html=True)
+    
+    # Show compatibility analysis
+    st.markdown(f"""
+    <div style="
+        background: #5eead4;
+        color: #0b0b10;
+        padding: 12px 16px;
+        border-radius: 12px;
+        margin: 8px 0;
+        box-shadow: 0 4px 15px rgba(94, 234, 212, 0.3);
+        width: 100%;
+        max-width: 280px;
+    ">
+        {compatibility_data.get('reason', 'These items work well together!')}
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Action buttons for compatible items
+    st.markdown("""
+    <div style="display: flex; gap: 12px; margin-top: 16px; justify-content: center; width: 100%; max-width: 280px; margin-left: 0;">
+        <a href="#" style="
+            display: inline-block;
+            background: linear-gradient(135deg, #7c5cff, #8b5cf6);
+            color: white;
+            padding: 10px 20px;
+            border-radius: 999px;
+            text-decoration: none;
+            box-shadow: 0 10px 30px rgba(0,0,0,.35);
+            font-weight: 600;
+            font-size: 14px;
+        ">
+            Find in Store
+        </a>
+        <a href="#" style="
+            display: inline-block;
+            background: linear-gradient(135deg, #5eead4, #06b6d4);
+            color: white;
+            padding: 10px 20px;
+            border-radius: 999px;
+            text-decoration: none;
+            box-shadow: 0 10px 30px rgba(0,0,0,.35);
+            font-weight: 600;
+            font-size: 14px;
+        ">
+            Buy Now
+        </a>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    st.markdown("</div>", unsafe_allow_html=True)
+
+
+async def show_recommendations(prepared_image, catalog):
+    """Consume the recommendation pipeline's event stream, rendering each result as soon as it arrives."""
+    analysis_area = st.container()
+    matches_header = st.empty()
+    cols = st.columns(3)
+    verdict_slots = {}
+    
+    events = recommend(
+        prepared_image,
+        SUBCATEGORIES,
+        catalog.df_items,
+        catalog.engine,
+        max_candidates=MAX_DISPLAYED_MATCHES,
+        target_matches=GUARDRAIL_TARGET_MATCHES,
+        candidate_image=load_catalog_image,
+    )
+    async for event in events:
+        if event["type"] == "analysis":
+            with analysis_area:
+                render_analysis(event["analysis"])
+        elif event["type"] == "match":
+            i = event["index"]
+            with cols[i % len(cols)]:
+                render_match_card(event["item"])
+                # Placeholder filled in when this card's compatibility verdict arrives
+                verdict_slots[i] = st.empty()
+        elif event["type"] == "search_done":
+            if event["matches"]:
+                matches_header.markdown(f"""
+                <div class="rnx-result-box">
+                  <h3>Catalog Matches Found</h3>
+                  <p class="rnx-kv">Found {event['matches']} items in our catalog that match</p>
+                </div>
+                """, unsafe_allow_html=True)
+            else:
+                matches_header.warning("❌ No matching items found. Try uploading a different image.")
+        elif event["type"] == "verdict":
+            # Only display this item's compatibility if it's compatible - otherwise it is effectively hidden
+            if event["verdict"].get('answer') == 'yes':
+                with verdict_slots[event["index"]].container():
+                    render_verdict(event["verdict"])
+        elif event["type"] == "error":
+            if event["stage"] == "analysis":
+                st.error(f"❌ Error parsing analysis response: {event['error']}")
+                if "raw" in event:
+                    st.info(f"Raw response: {event['raw']}")
+            elif event["stage"] == "search":
+                st.error(f"❌ Error searching catalog: {event['error']}")
+            # If a compatibility check fails, the item is simply not marked as compatible
+        elif event["type"] == "done" and event["time_to_first_match"] is not None:
+            totals = (event.get("telemetry") or {}).get("totals", {})
+            st.caption(
+                f"First catalog match after {event['time_to_first_match']:.1f}s · "
+                f"all results after {event['timings']['total']:.1f}s · "
+                f"{totals.get('model_calls', 0)} model calls, ${totals.get('cost_usd', 0):.4f}"
+            )
+
+
 def main():
+    start_metrics_server()
+
     # Render the navbar (without navigation links)
     render_navbar(links=[], cta=None)
     
@@ -59,18 +298,21 @@ def main():
         # Display the uploaded image
         st.markdown("<div class='rnx-card'>", unsafe_allow_html=True)
         st.markdown("<h3>Uploaded Image</h3>", unsafe_allow_html=True)
-        image = Image.open(uploaded_file)
+        # Orient, downscale and re-encode once; the prepared image is reused for every model call below
+        prepared_image = prepare_image(uploaded_file.getvalue())
+        prep_stats = prepared_image.stats
         # Display image in a smaller, contained box
         col1, col2 = st.columns([2, 3])
         with col1:
-            st.image(image, width=300, caption="Your uploaded image")
+            st.image(prepared_image.data, width=300, caption="Your uploaded image")
+            st.caption(
+                f"Sent to the model as {prep_stats['prepared_size'][0]}x{prep_stats['prepared_size'][1]} JPEG: "
+                f"{prep_stats['original_bytes'] / 1024:.0f} KB → {prep_stats['prepared_bytes'] / 1024:.0f} KB, "
+                f"~{prep_stats['original_tokens']} → ~{prep_stats['prepared_tokens']} image tokens "
+                f"({prep_stats['prepare_ms']:.0f} ms)"
+            )
         st.markdown("</div>", unsafe_allow_html=True)
         
-        # Convert image to base64 for analysis
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
         # Custom styled Streamlit button with purple gradient
         st.markdown("""
         <style>
@@ -99,218 +341,17 @@ def main():
         if st.button("🔍 Analyze & Find Matches", type="primary"):
             with st.spinner("Analyzing your image with GPT-5..."):
                 try:
-                    # Analyze the image
-                    analysis = analyze_image(img_str, ["Tshirts", "Kurtas", "Casual Shoes", "Shorts", "Trousers", "Sports Shoes", "Track Pants", "Flip Flops", "Jeans", "Sandals", "Night suits", "Formal Shoes", "Jackets", "Sweatshirts", "Tracksuits", "Rain Trousers", "Free Gifts", "Sweaters", "Lounge Pants", "Basketballs", "Waistcoat", "Lounge Shorts", "Ties"])
-                    
-                    # Parse the analysis
-                    try:
-                        analysis_data = json.loads(analysis)
-                        st.markdown("""
-                        <div style="
-                            background: linear-gradient(135deg, #7c5cff, #8b5cf6);
-                            color: white;
-                            padding: 12px 20px;
-                            border-radius: 12px;
-                            text-align: center;
-                            font-weight: 600;
-                            margin: 20px 0;
-                            box-shadow: 0 8px 25px rgba(124, 92, 255, 0.3);
-                        ">
-                            Image analysis complete!
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # Display what was detected in the uploaded image using the new result box
-                        from ui_skin import result_box
-                        
-                        # Create fields for the result box
-                        fields = {}
-                        if 'category' in analysis_data:
-                            fields['Item Category'] = analysis_data['category']
-                        if 'gender' in analysis_data:
-                            fields['Target Gender'] = analysis_data['gender']
-                        
-                        # Get AI style recommendations
-                        matches = analysis_data.get('items', [])
-                        
-                        # Display everything in one beautiful result box
-                        result_box(
-                            title="Item Analysis Results",
-                            fields=fields,
-                            matches=matches
-                        )
-                        
-                        # Find matching items from catalog
-                        from ui_skin import _inject_result_box_css
-                        _inject_result_box_css()
-                        st.markdown("""
-                        <div class="rnx-result-box">
-                          <h3>Finding Similar Items</h3>
-                          <p class="rnx-kv">Searching our catalog for items that match the AI recommendations...</p>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                        # Load clothing data
-                        try:
-                            df_items = load_clothing_data()
-                            
-                            # Extract item descriptions from AI analysis for search
-                            item_descriptions = analysis_data.get('items', [])
-                            
-                            # Find matching items
-                            matches = find_matching_items_with_rag(df_items, item_descriptions)
-                        except Exception as e:
-                            st.error(f"❌ Error loading catalog data: {e}")
-                            matches = []
-                        
-                        if matches and len(matches) > 0:
-                            st.markdown(f"""
-                            <div class="rnx-result-box">
-                              <h3>Catalog Matches Found</h3>
-                              <p class="rnx-kv">Found {len(matches)} items in our catalog that match</p>
-                            </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Display matches in cards
-                            match_cards = []
-                            for i, match in enumerate(matches[:5]):
-                                card_content = f"""
-                                <div class='rnx-card'>
-                                    <h3 style="background: linear-gradient(135deg, #7c5cff, #5eead4); -webkit-background-clip: text; -webkit-text-fill-color: transparent; font-weight: bold; font-size: 18px; margin-bottom: 12px;">{match.get('productDisplayName', 'Unknown Item')}</h3>
-                                    <p class='rnx-muted'>
-                                        <strong>Category:</strong> {match.get('articleType', 'N/A')}<br/>
-                                        <strong>Gender:</strong> {match.get('gender', 'N/A')}<br/>
-                                        <strong>Color:</strong> {match.get('baseColour', 'N/A')}<br/>
-                                        <strong>Season:</strong> {match.get('season', 'N/A')}<br/>
-                                        <strong>Usage:</strong> {match.get('usage', 'N/A')}
-                                    </p>
-                                </div>
-                                """
-                                match_cards.append(("Match " + str(i+1), card_content))
-                            
-                            # Display matches in columns
-                            cols = st.columns(min(3, len(match_cards)))
-                            for i, (title, content) in enumerate(match_cards):
-                                with cols[i % len(cols)]:
-                                    st.markdown(content, unsafe_allow_html=True)
-                                    
-                                    # Show product image if available
-                                    try:
-                                        # Get the corresponding match data for this card
-                                        current_match = matches[i]
-                                        image_filename = f"{current_match.get('id', 'unknown')}.jpg"
-                                        
-                                        # Use absolute path that works both locally and on Streamlit Cloud
-                                        current_dir = os.path.dirname(os.path.abspath(__file__))
-                                        project_root = os.path.dirname(current_dir)
-                                        image_path = os.path.join(project_root, "data", "sample_clothes", "sample_images", image_filename)
-                                        
-                                        if os.path.exists(image_path):
-                                            st.image(image_path, caption=f"ID: {current_match.get('id', 'N/A')}", width=210)
-                                        else:
-                                            st.markdown("""
-                                            <div style="
-                                                width: 100%; 
-                                                height: 150px; 
-                                                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                                                border-radius: 10px;
-                                                display: flex;
-                                                align-items: center;
-                                                justify-content: center;
-                                                color: white;
-                                                font-size: 24px;
-                                            ">
-                                                👔
-                                            </div>
-                                            """, unsafe_allow_html=True)
-                                    except Exception as e:
-                                        st.error(f"Error loading image: {e}")
-                                    
-                                    # Guardrails compatibility check - only show compatible items
-                                    try:
-                                        if 'img_str' in locals():
-                                            from guardrails import check_match
-                                            
-                                            # Get the suggested item image as base64
-                                            # image_path is already defined above with absolute path
-                                            with open(image_path, "rb") as img_file:
-                                                suggested_img_base64 = base64.b64encode(img_file.read()).decode()
-                                            
-                                            # Run the compatibility check
-                                            compatibility_result = check_match(img_str, suggested_img_base64)
-                                            
-                                            try:
-                                                compatibility_data = json.loads(compatibility_result)
-                                                
-                                                # Only display this item if it's compatible
-                                                if compatibility_data.get('answer') == 'yes':
-                                                    st.markdown("<div class='rnx-card'>", unsafe_allow_html=True)
-                                                    
-                                                    # Show compatibility analysis
-                                                    st.markdown(f"""
-                                                    <div style="
-                                                        background: #5eead4;
-                                                        color: #0b0b10;
-                                                        padding: 12px 16px;
-                                                        border-radius: 12px;
-                                                        margin: 8px 0;
-                                                        box-shadow: 0 4px 15px rgba(94, 234, 212, 0.3);
-                                                        width: 100%;
-                                                        max-width: 280px;
-                                                    ">
-                                                        {compatibility_data.get('reason', 'These items work well together!')}
-                                                    </div>
-                                                    """, unsafe_allow_html=True)
-                                                    
-                                                    # Action buttons for compatible items
-                                                    st.markdown("""
-                                                    <div style="display: flex; gap: 12px; margin-top: 16px; justify-content: center; width: 100%; max-width: 280px; margin-left: 0;">
-                                                        <a href="#" style="
-                                                            display: inline-block;
-                                                            background: linear-gradient(135deg, #7c5cff, #8b5cf6);
-                                                            color: white;
-                                                            padding: 10px 20px;
-                                                            border-radius: 999px;
-                                                            text-decoration: none;
-                                                            box-shadow: 0 10px 30px rgba(0,0,0,.35);
-                                                            font-weight: 600;
-                                                            font-size: 14px;
-                                                        ">
-                                                            Find in Store
-                                                        </a>
-                                                        <a href="#" style="
-                                                            display: inline-block;
-                                                            background: linear-gradient(135deg, #5eead4, #06b6d4);
-                                                            color: white;
-                                                            padding: 10px 20px;
-                                                            border-radius: 999px;
-                                                            text-decoration: none;
-                                                            box-shadow: 0 10px 30px rgba(0,0,0,.35);
-                                                            font-weight: 600;
-                                                            font-size: 14px;
-                                                        ">
-                                                            Buy Now
-                                                        </a>
-                                                    </div>
-                                                    """, unsafe_allow_html=True)
-                                                    
-                                                    st.markdown("</div>", unsafe_allow_html=True)
-                                                # If not compatible, don't show anything - item is effectively hidden
-                                            except:
-                                                # If compatibility check fails, don't show the item
-                                                pass
-                                        else:
-                                            st.info("ℹ️ Upload an image to see compatibility analysis")
-                                    except Exception as e:
-                                        # If there's an error, don't show the item
-                                        pass
-                        else:
-                            st.warning("❌ No matching items found. Try uploading a different image.")
-                            
-                    except json.JSONDecodeError as e:
-                        st.error(f"❌ Error parsing analysis response: {e}")
-                        st.info(f"Raw response: {analysis}")
-                        
+                    catalog = get_catalog().snapshot()
+                except Exception as e:
+                    st.error(f"❌ Error loading catalog data: {e}")
+                    catalog = None
+                try:
+                    if catalog is not None:
+                        # Analysis, catalog search and compatibility checks overlap; results appear as they arrive
+                        with profile_request("streamlit", mode=requested_profile_mode()) as profile:
+                            asyncio.run(show_recommendations(prepared_image, catalog))
+                        if profile is not None:
+                            st.caption("🔬 Profile written to " + ", ".join(profile.files))
                 except Exception as e:
                     st.error(f"❌ Error during analysis: {e}")
                     st.info("Please try again with a different image.")
@@ -0,0 +1,129 @@
+"""
+test_analysis.py
+Tests for the image analysis cache keyed by perceptual hash and colour signature, and the streaming analysis span
+"""
+
+# Standard library imports
+import asyncio
+import base64
+import io
+import json
+import os
+import sys
+
+# 3P imports
+import pytest
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+import analysis
+from image_prep import image_fingerprint
+from providers import FakeProvider, ProviderError, set_provider
+
+SUBCATEGORIES = ["Jeans", "Shirts", "Belts"]
+
+
+def shirt(colour, quality=90):
+    """Base64 JPEG of a flat shirt shape in `colour` on a white background."""
+    image = Image.new("RGB", (300, 400), (255, 255, 255))
+    ImageDraw.Draw(image).polygon(
+        [(60, 60), (240, 60), (280, 140), (230, 160), (230, 360), (70, 360), (70, 160), (20, 140)], fill=colour
+    )
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+@pytest.fixture(autouse=True)
+def memory_cache(monkeypatch):
+    monkeypatch.setattr(analysis, "ANALYSIS_CACHE_ENABLED", True)
+    monkeypatch.setattr(analysis, "ANALYSIS_CACHE_PATH", None)
+    monkeypatch.setattr(analysis, "ANALYSIS_CACHE_MAX_DISTANCE", 4)
+    monkeypatch.setattr(analysis, "_analysis_cache", None)
+    previous = set_provider(FakeProvider())
+    yield
+    set_provider(previous)
+
+
+def test_recolour_of_the_same_cut_gets_the_same_hash_but_not_the_analysis():
+    red, blue = shirt((200, 30, 30)), shirt((30, 30, 200))
+    assert image_fingerprint(red)[0] == image_fingerprint(blue)[0]
+    analysis._store_analysis(red, SUBCATEGORIES, json.dumps({"items": ["Blue Jeans"], "category": "Shirts"}))
+    assert analysis._cached_analysis(blue, SUBCATEGORIES) is None
+
+
+def test_recompressed_upload_reuses_the_analysis():
+    result = json.dumps({"items": ["Blue Jeans"], "category": "Shirts"})
+    analysis._store_analysis(shirt((200, 30, 30)), SUBCATEGORIES, result)
+    assert analysis._cached_analysis(shirt((200, 30, 30), quality=40), SUBCATEGORIES) == result
+
+
+@pytest.mark.parametrize("colour, signature", [
+    ((200, 30, 30), "red"), ((30, 30, 200), "blue"), ((20, 20, 20), "black"), ((128, 128, 128), "grey"),
+])
+def test_colour_signature_ignores_the_white_background(colour, signature):
+    assert image_fingerprint(shirt(colour))[1] == signature
+
+
+@pytest.fixture
+def finished_spans(monkeypatch):
+    """(span, error) for every finish() call on the spans the analysis stream starts."""
+    calls = []
+    start_span = analysis.start_span
+
+    def recording_start_span(*args, **kwargs):
+        stage = start_span(*args, **kwargs)
+        finish = stage.finish
+
+        def recording_finish(error=None):
+            calls.append((stage, error))
+            finish(error=error)
+
+        stage.finish = recording_finish
+        return stage
+
+    monkeypatch.setattr(analysis, "start_span", recording_start_span)
+    return calls
+
+
+def consume(stream, limit=None):
+    events = []
+    for event in stream:
+        events.append(event)
+        if len(events) == limit:
+            stream.close()
+    return events
+
+
+async def consume_async(stream, limit=None):
+    events = []
+    async for event in stream:
+        events.append(event)
+        if len(events) == limit:
+            await stream.aclose()
+    return events
+
+
+def run_stream(streaming_async, limit=None):
+    if streaming_async:
+        return asyncio.run(consume_async(analysis.analyze_image_stream_async(shirt((200, 30, 30)), SUBCATEGORIES), limit))
+    return consume(analysis.analyze_image_stream(shirt((200, 30, 30)), SUBCATEGORIES), limit)
+
+
+@pytest.mark.parametrize("streaming_async", [False, True])
+def test_stream_error_finishes_the_span_once_with_the_error(finished_spans, streaming_async):
+    set_provider(FakeProvider(error_rate=1.0))
+    with pytest.raises(ProviderError):
+        run_stream(streaming_async)
+    assert len(finished_spans) == 1
+    stage, error = finished_spans[0]
+    assert isinstance(error, ProviderError)
+    assert stage.attributes["error"] == "ProviderError"
+
+
+@pytest.mark.parametrize("streaming_async", [False, True])
+def test_closed_stream_finishes_the_span_once_without_error(finished_spans, streaming_async):
+    assert len(run_stream(streaming_async, limit=1)) == 1
+    assert [error for _, error in finished_spans] == [None]
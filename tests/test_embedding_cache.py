@@ -0,0 +1,150 @@
+"""
+test_embedding_cache.py
+Tests for the two-tier embedding cache: key normalization, the LRU and SQLite tiers, the byte cap and
+reads that never take the SQLite write lock
+"""
+
+# Standard library imports
+import asyncio
+import os
+import sqlite3
+import sys
+
+# 3P imports
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+import embedding_cache
+from embedding_cache import EmbeddingCache, cache_key, normalize_text
+
+MODEL = "test-model"
+DIM = 4
+VECTOR_BYTES = DIM * 4
+
+
+def vector(seed):
+    return np.full(DIM, seed, dtype=np.float32)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "embeddings.sqlite3")
+
+
+@pytest.mark.parametrize("text, normalized", [
+    ("White Canvas Sneakers", "white canvas sneakers"),
+    ("  White\tCanvas \n Sneakers ", "white canvas sneakers"),
+    ("Ｗｈｉｔｅ Ｓｎｅａｋｅｒｓ", "white sneakers"),      # full-width letters (NFKC)
+    ("Straße Shorts", "strasse shorts"),               # casefold, not just lower()
+    ("ﬁtted Shirt", "fitted shirt"),                   # "fi" ligature (NFKC)
+    ("Cafe\u0301 Blouse", "caf\u00e9 blouse"),        # combining accent composed (NFKC)
+])
+def test_normalize_text(text, normalized):
+    assert normalize_text(text) == normalized
+
+
+def test_cache_key_shares_normalized_texts_only_within_a_model():
+    assert cache_key(MODEL, "Women's  Black Jeans") == cache_key(MODEL, "WOMEN'S BLACK JEANS")
+    assert cache_key(MODEL, "Black Jeans") != cache_key("other-model", "Black Jeans")
+    # Token inputs are keyed on the exact ids and never collide with text
+    assert cache_key(MODEL, [1, 2, 3]) == cache_key(MODEL, (1, 2, 3))
+    assert cache_key(MODEL, [1, 2, 3]) != cache_key(MODEL, [3, 2, 1])
+    assert cache_key(MODEL, [1, 2]) != cache_key(MODEL, "1,2")
+
+
+def test_misses_are_computed_once_in_one_batch():
+    cache = EmbeddingCache(path=None)
+    batches = []
+
+    def compute(inputs):
+        batches.append(list(inputs))
+        return [vector(len(text)) for text in inputs]
+
+    result = cache.get_or_compute(MODEL, ["Red Dress", "red  dress", "Blue Jeans"], compute)
+    assert batches == [["Red Dress", "Blue Jeans"]]
+    np.testing.assert_array_equal(result[0], result[1])
+    cache.get_or_compute(MODEL, ["RED DRESS", "Green Belt"], compute)
+    assert batches[1] == ["Green Belt"]
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_async_lookup_shares_the_disk_tier(path):
+    async def compute(inputs):
+        return [vector(len(text)) for text in inputs]
+
+    first = asyncio.run(EmbeddingCache(path=path).get_or_compute_async(MODEL, ["Red Dress"], compute))
+
+    async def fail(inputs):
+        raise AssertionError("should be served from disk")
+
+    cache = EmbeddingCache(path=path)
+    second = asyncio.run(cache.get_or_compute_async(MODEL, ["red dress"], fail))
+    np.testing.assert_array_equal(first[0], second[0])
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_vectors_persist_across_instances_and_tiers(path):
+    writer = EmbeddingCache(path=path, memory_items=2)
+    writer.put_many(MODEL, [(f"k{i}", vector(i)) for i in range(3)])
+    # Only the two most recent stay in memory; the first is still on disk
+    assert writer.stats()["memory_items"] == 2
+    assert set(writer.get_many(["k0", "k1", "k2"])) == {"k0", "k1", "k2"}
+    assert writer.stats()["disk_hits"] == 1
+
+    reader = EmbeddingCache(path=path)
+    found = reader.get_many(["k0", "k2", "missing"])
+    np.testing.assert_array_equal(found["k2"], vector(2))
+    assert set(found) == {"k0", "k2"}
+    reader.get_many(["k0"])
+    stats = reader.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["misses"]) == (2, 1, 1)
+
+
+def test_disk_tier_is_trimmed_to_the_byte_cap_least_recently_used_first(path, monkeypatch):
+    clock = iter(range(1000, 2000))
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: next(clock))
+    cache = EmbeddingCache(path=path, memory_items=1, max_disk_bytes=3 * VECTOR_BYTES)
+    for i in range(3):
+        cache.put_many(MODEL, [(f"k{i}", vector(i))])
+    # k0 is read from disk, so k1 is now the least recently used
+    assert "k0" in cache.get_many(["k0"])
+    cache.put_many(MODEL, [("k3", vector(3))])
+
+    stats = cache.stats()
+    assert stats["disk_bytes"] == 3 * VECTOR_BYTES and stats["disk_items"] == 3
+    assert stats["evictions"] == 1
+    assert set(EmbeddingCache(path=path).get_many(["k0", "k1", "k2", "k3"])) == {"k0", "k2", "k3"}
+
+
+def test_replacing_a_key_does_not_count_its_bytes_twice(path):
+    cache = EmbeddingCache(path=path, max_disk_bytes=10 * VECTOR_BYTES)
+    cache.put_many(MODEL, [("k0", vector(0)), ("k0", vector(1))])
+    cache.put_many(MODEL, [("k0", vector(2)), ("k1", vector(3))])
+    db = sqlite3.connect(path)
+    assert cache.stats()["disk_bytes"] == db.execute("SELECT SUM(size) FROM embeddings").fetchone()[0] == 2 * VECTOR_BYTES
+    cache.clear()
+    assert cache.stats()["disk_bytes"] == 0
+
+
+def test_disk_hits_do_not_wait_for_another_writer(path):
+    EmbeddingCache(path=path).put_many(MODEL, [(f"k{i}", vector(i)) for i in range(embedding_cache._TOUCH_BATCH)])
+    cache = EmbeddingCache(path=path)
+    last_access = dict(sqlite3.connect(path).execute("SELECT key, last_access FROM embeddings"))
+
+    # Another worker process holds the write lock for the whole lookup
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        found = cache.get_many([f"k{i}" for i in range(embedding_cache._TOUCH_BATCH)])
+    finally:
+        other.execute("ROLLBACK")
+    assert len(found) == embedding_cache._TOUCH_BATCH
+
+    # The access times stayed pending and are written with the next put
+    assert dict(sqlite3.connect(path).execute("SELECT key, last_access FROM embeddings")) == last_access
+    cache.put_many(MODEL, [("new", vector(9))])
+    updated = dict(sqlite3.connect(path).execute("SELECT key, last_access FROM embeddings"))
+    assert all(updated[key] > last_access[key] for key in last_access)
@@ -0,0 +1,233 @@
+"""
+test_embedding_store.py
+Tests for the binary embedding store and for recognising the catalog that was loaded from it
+"""
+
+# Standard library imports
+import functools
+import json
+import os
+import sys
+
+# 3P imports
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+import data_loader
+import search_similar_items
+from ann_index import build_ann_index
+from quantized_index import QuantizedIndex, build_quantized_index
+from embedding_store import (
+    MANIFEST_FILENAME, MATRIX_FILENAME, EmbeddingStoreError, EmbeddingStoreWriter, convert_csv_to_store,
+    open_embedding_store, read_manifest, verify_embedding_store, write_embedding_store,
+)
+from search_similar_items import CatalogSearchEngine, build_search_engine
+
+ROWS, DIM = 40, 8
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "id": np.arange(ROWS),
+        "gender": ["Men", "Women"] * (ROWS // 2),
+        "articleType": ["Jeans", "Shirts", "Belts", "Jackets"] * (ROWS // 4),
+    })
+    path = str(tmp_path / "store")
+    write_embedding_store(path, df, rng.standard_normal((ROWS, DIM)).astype(np.float32), model="test-model")
+    return path
+
+
+@pytest.fixture
+def store_engine(monkeypatch, store):
+    """build_search_engine reading the test store, with ANN search over an index saved next to it."""
+    monkeypatch.setattr(search_similar_items, "catalog_store_checksum",
+                        functools.partial(data_loader.catalog_store_checksum, path=store))
+    monkeypatch.setattr(search_similar_items, "load_store_matrix",
+                        functools.partial(data_loader.load_store_matrix, path=store))
+    monkeypatch.setattr(search_similar_items, "ANN_ENABLED", True)
+    monkeypatch.setattr(search_similar_items, "ANN_INDEX_PATH", os.path.join(store, "ann"))
+    monkeypatch.setattr(search_similar_items, "QUANTIZATION", None)
+    monkeypatch.setattr(search_similar_items, "SEARCH_DIMS", None)
+    return build_search_engine
+
+
+def catalog_frame(rows=ROWS, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "id": np.arange(rows),
+        "productDisplayName": [f"Item, {i}" for i in range(rows)],
+        "articleType": ["Jeans", "Shirts"] * (rows // 2),
+    })
+    return df, rng.standard_normal((rows, DIM)).astype(np.float32)
+
+
+def test_store_round_trip(tmp_path):
+    df, embeddings = catalog_frame()
+    path = str(tmp_path / "store")
+    with EmbeddingStoreWriter(path, model="test-model") as writer:
+        # Appended in uneven chunks, as generate_embeddings.py streams them
+        for start, stop in ((0, 7), (7, 30), (30, ROWS)):
+            writer.append(df.iloc[start:stop], embeddings[start:stop])
+
+    metadata, matrix, manifest = open_embedding_store(path, verify=True)
+    pd.testing.assert_frame_equal(metadata, df)
+    np.testing.assert_array_equal(matrix, embeddings)
+    assert (manifest["rows"], manifest["dim"], manifest["model"]) == (ROWS, DIM, "test-model")
+    assert manifest["columns"] == list(df.columns)
+    assert not [name for name in os.listdir(path) if name.endswith(".partial")]
+
+
+def test_csv_conversion_matches_parsed_embeddings(tmp_path):
+    df, embeddings = catalog_frame()
+    csv_path = str(tmp_path / "catalog.csv")
+    df.assign(embeddings=[json.dumps(vector.tolist()) for vector in embeddings]).to_csv(csv_path, index=False)
+    convert_csv_to_store(csv_path, str(tmp_path / "store"), chunksize=16)
+    metadata, matrix, _ = open_embedding_store(str(tmp_path / "store"), verify=True)
+    pd.testing.assert_frame_equal(metadata, df)
+    np.testing.assert_array_equal(matrix, embeddings)
+
+
+def test_tampered_matrix_fails_verification(store):
+    with open(os.path.join(store, MATRIX_FILENAME), "r+b") as f:
+        f.seek(DIM * 4 * (ROWS // 2))
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(EmbeddingStoreError, match="Checksum mismatch"):
+        verify_embedding_store(store)
+    with pytest.raises(EmbeddingStoreError):
+        open_embedding_store(store, verify=True)
+
+
+@pytest.mark.parametrize("tamper, message", [
+    (lambda manifest: manifest["files"]["matrix"].update(sha256="0" * 64), "Checksum mismatch"),
+    (lambda manifest: manifest.update(rows=ROWS + 1), "bytes, expected"),
+    (lambda manifest: manifest.update(dim=DIM * 2), "bytes, expected"),
+    (lambda manifest: manifest.update(format="something-else"), "Unknown embedding store format"),
+    (lambda manifest: manifest.update(version=99), "Unsupported embedding store version"),
+])
+def test_tampered_manifest_is_rejected(store, tamper, message):
+    manifest_path = os.path.join(store, MANIFEST_FILENAME)
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    tamper(manifest)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    with pytest.raises(EmbeddingStoreError, match=message):
+        open_embedding_store(store, verify=True)
+
+
+def test_truncated_manifest_is_rejected(store):
+    manifest_path = os.path.join(store, MANIFEST_FILENAME)
+    with open(manifest_path, encoding="utf-8") as f:
+        text = f.read()
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        f.write(text[:len(text) // 2])
+    with pytest.raises(EmbeddingStoreError, match="Corrupt"):
+        read_manifest(store)
+
+
+def test_aborted_writer_leaves_previous_store_intact(store):
+    metadata_before, matrix_before, manifest_before = open_embedding_store(store, verify=True)
+    matrix_before = np.array(matrix_before)
+    df, embeddings = catalog_frame(seed=1)
+
+    with pytest.raises(RuntimeError):
+        with EmbeddingStoreWriter(store, model="test-model") as writer:
+            writer.append(df.iloc[:10], embeddings[:10])
+            raise RuntimeError("embedding run failed")
+    assert not [name for name in os.listdir(store) if name.endswith(".partial")]
+
+    # A writer that dies without closing or aborting only leaves .partial files behind
+    writer = EmbeddingStoreWriter(store, model="test-model")
+    writer.append(df, embeddings)
+    writer._matrix_file.flush()
+
+    metadata, matrix, manifest = open_embedding_store(store, verify=True)
+    assert manifest == manifest_before
+    pd.testing.assert_frame_equal(metadata, metadata_before)
+    np.testing.assert_array_equal(matrix, matrix_before)
+    writer.abort()
+
+
+def test_corrupt_store_falls_back_to_csv(monkeypatch, tmp_path, store):
+    with open(os.path.join(store, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+        f.write("{")
+    df, embeddings = catalog_frame()
+    csv_path = str(tmp_path / "catalog.csv")
+    df.assign(embeddings=[json.dumps(vector.tolist()) for vector in embeddings]).to_csv(csv_path, index=False)
+
+    def unreachable():
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr(data_loader, "EMBEDDING_STORE_PATH", store)
+    monkeypatch.setattr(data_loader, "LOCAL_DATA_PATH", csv_path)
+    monkeypatch.setattr(data_loader, "fetch_remote_catalog", unreachable)
+    catalog, version = data_loader.load_catalog()
+    assert version == {"source": "local"}
+    np.testing.assert_array_equal(np.stack(catalog["embeddings"]), embeddings)
+    assert data_loader.catalog_store_checksum(catalog, path=store) is None
+
+
+def test_catalog_loaded_from_store_is_recognised(store):
+    catalog = data_loader.load_embedding_store(store)
+    checksum = read_manifest(store)["files"]["matrix"]["sha256"]
+    assert data_loader.catalog_store_checksum(catalog, path=store) == checksum
+    np.testing.assert_array_equal(data_loader.load_store_matrix(catalog, path=store), np.stack(catalog["embeddings"]))
+
+
+def test_changed_middle_row_is_not_the_store_catalog(store):
+    catalog = data_loader.load_embedding_store(store)
+    catalog["embeddings"] = catalog["embeddings"].copy()
+    catalog.at[ROWS // 2, "embeddings"] = np.ones(DIM, dtype=np.float32)
+    assert data_loader.catalog_store_checksum(catalog, path=store) is None
+
+
+def test_reordered_catalog_is_not_the_store_catalog(store):
+    catalog = data_loader.load_embedding_store(store)
+    order = list(range(ROWS))
+    order[10], order[11] = order[11], order[10]
+    reordered = catalog.iloc[order].reset_index(drop=True)
+    assert reordered.attrs == catalog.attrs
+    assert data_loader.catalog_store_checksum(reordered, path=store) is None
+    assert data_loader.load_store_matrix(catalog[catalog["id"] < 10], path=store) is None
+
+
+def test_catalog_from_a_rewritten_store_is_not_recognised(store):
+    catalog = data_loader.load_embedding_store(store)
+    df = catalog.drop(columns=["embeddings"])
+    write_embedding_store(store, df, np.stack(catalog["embeddings"]) * 2, model="test-model")
+    assert data_loader.catalog_store_checksum(catalog, path=store) is None
+
+
+def test_ann_index_is_used_only_for_its_store_catalog(store, store_engine):
+    catalog = data_loader.load_embedding_store(store)
+    build_ann_index(np.stack(catalog["embeddings"]), os.path.join(store, "ann"), n_lists=4,
+                    source_checksum=read_manifest(store)["files"]["matrix"]["sha256"])
+    assert store_engine(catalog).ann_index is not None
+
+    catalog["embeddings"] = catalog["embeddings"].copy()
+    catalog.at[ROWS // 2, "embeddings"] = np.ones(DIM, dtype=np.float32)
+    engine = store_engine(catalog)
+    assert isinstance(engine, CatalogSearchEngine) and engine.ann_index is None
+
+
+@pytest.mark.parametrize("kind", ["int8", "binary"])
+def test_quantized_codes_are_used_only_for_their_store_catalog(monkeypatch, store, store_engine, kind):
+    monkeypatch.setattr(search_similar_items, "ANN_ENABLED", False)
+    monkeypatch.setattr(search_similar_items, "QUANTIZATION", kind)
+    monkeypatch.setattr(search_similar_items, "QUANTIZED_INDEX_PATH", os.path.join(store, "quantized"))
+    catalog = data_loader.load_embedding_store(store)
+    build_quantized_index(np.stack(catalog["embeddings"]), os.path.join(store, "quantized"), kind=kind,
+                          source_checksum=read_manifest(store)["files"]["matrix"]["sha256"])
+    assert isinstance(store_engine(catalog).quantized_index, QuantizedIndex)
+
+    catalog["embeddings"] = catalog["embeddings"].copy()
+    catalog.at[ROWS // 2, "embeddings"] = np.ones(DIM, dtype=np.float32)
+    assert store_engine(catalog).quantized_index is None
@@ -0,0 +1,99 @@
+"""
+test_filter_index.py
+Correctness of filter posting lists and filtered catalog search against pandas masks and a brute-force cosine sort
+"""
+
+# Standard library imports
+import os
+import sys
+
+# 3P imports
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+from filter_index import FilterIndex, complementary_filter
+from search_similar_items import CatalogSearchEngine
+from tests.test_similarity import brute_top_k, cosine, sparse_unit_vectors
+
+GENDERS = ["Men", "Women", "Unisex", None]
+CATEGORIES = ["Tshirts", "Jeans", "Shoes", "Watches", None]
+
+FILTERS = [
+    None,
+    complementary_filter("Men", "Tshirts"),
+    complementary_filter("Women", "Shoes"),
+    {"include": {"gender": "Unisex", "articleType": ["Watches", "Belts"]}},
+    {"include": {"articleType": "Watches"}, "exclude": {"gender": ["Men", "Women"]}},
+    {"exclude": {"articleType": ["Tshirts", "Jeans", "Shoes"]}},
+    {"include": {"gender": "Boys"}},
+]
+
+
+@pytest.fixture
+def df_items():
+    rng = np.random.default_rng(5)
+    return pd.DataFrame({
+        "gender": rng.choice(np.array(GENDERS, dtype=object), 300),
+        "articleType": rng.choice(np.array(CATEGORIES, dtype=object), 300),
+    })
+
+
+def pandas_mask(df, expression):
+    """Reference: the same expression evaluated with DataFrame masks (missing values match nothing)."""
+    mask = pd.Series(True, index=df.index)
+    expression = expression or {}
+    for column, values in (expression.get("include") or {}).items():
+        mask &= df[column].isin(values if isinstance(values, list) else [values])
+    for column, values in (expression.get("exclude") or {}).items():
+        mask &= ~df[column].isin(values if isinstance(values, list) else [values])
+    return mask.to_numpy()
+
+
+@pytest.mark.parametrize("expression", FILTERS)
+def test_mask_matches_pandas(df_items, expression):
+    index = FilterIndex(df_items)
+    expected = pandas_mask(df_items, expression)
+    assert np.array_equal(index.mask(expression), expected)
+    assert index.select(expression).tolist() == np.flatnonzero(expected).tolist()
+    assert index.count(expression) == int(expected.sum())
+
+
+def test_posting_lists_are_sorted_and_skip_missing_values(df_items):
+    index = FilterIndex(df_items)
+    for column in ("gender", "articleType"):
+        assert None not in index.values(column)
+        covered = np.concatenate([index.rows(column, value) for value in index.values(column)])
+        assert sorted(covered.tolist()) == df_items.index[df_items[column].notna()].tolist()
+        for value in index.values(column):
+            rows = index.rows(column, value)
+            assert np.all(np.diff(rows) > 0)
+    with pytest.raises(ValueError):
+        index.rows("usage", "Casual")
+
+
+@pytest.mark.parametrize("top_k", [1, 3, 500])
+@pytest.mark.parametrize("expression", FILTERS)
+def test_filtered_search_matches_brute_force_cosine(df_items, expression, top_k):
+    catalog = sparse_unit_vectors(len(df_items), seed=6)
+    engine = CatalogSearchEngine(catalog, filter_index=FilterIndex(df_items))
+    allowed = np.flatnonzero(pandas_mask(df_items, expression)).tolist()
+    queries = sparse_unit_vectors(8, seed=7)
+    for query in queries:
+        scores = [cosine(query, vector) for vector in catalog]
+        expected = brute_top_k(scores, 0.0, top_k, rows=allowed)
+        assert engine.search(query, threshold=0.0, top_k=top_k, filters=expression) == expected
+        # k above the number of filtered rows returns every allowed row above the threshold
+        if top_k > len(allowed):
+            assert len(expected) == sum(scores[i] >= 0.0 for i in allowed)
+
+    taken = set()
+    for query, result in zip(queries, engine.search_many(queries, threshold=0.0, top_k=top_k, unique=True,
+                                                         filters=expression)):
+        scores = [cosine(query, vector) for vector in catalog]
+        expected = brute_top_k(scores, 0.0, top_k, rows=[i for i in allowed if i not in taken])
+        assert result == expected
+        taken.update(expected)
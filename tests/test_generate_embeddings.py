@@ -0,0 +1,146 @@
+"""
+test_generate_embeddings.py
+Tests for incremental, resumable catalog embedding (scripts/generate_embeddings.py) on the offline fake provider
+"""
+
+# Standard library imports
+import os
+import sys
+import threading
+
+# 3P imports
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+from embedding_store import CHECKPOINT_SUFFIX, CONTENT_HASH_COLUMN, EmbeddingCheckpoint, open_embedding_store
+from providers import FakeProvider
+from scripts import generate_embeddings as script
+
+DIM = 8
+
+
+class FakeEmbeddings:
+    """Stands in for the embeddings API: FakeProvider vectors, a record of every input, optional failures."""
+
+    def __init__(self, fail_on=None):
+        self.provider = FakeProvider(dim=DIM)
+        self.fail_on = fail_on
+        self.inputs = []
+        self._lock = threading.Lock()
+
+    def texts(self):
+        with self._lock:
+            return sorted(bytes(tokens).decode("utf-8") for tokens in self.inputs)
+
+    def __call__(self, batch):
+        texts = [bytes(tokens).decode("utf-8") for tokens in batch]
+        if self.fail_on is not None and any(self.fail_on in text for text in texts):
+            raise ConnectionError("embedding request failed")
+        with self._lock:
+            self.inputs.extend(batch)
+        return self.provider.embed(script.EMBEDDING_MODEL, batch)
+
+
+@pytest.fixture
+def paths(tmp_path, monkeypatch):
+    # Byte-level tokens instead of tiktoken, whose encoding files are downloaded on first use
+    monkeypatch.setattr(script, "encode_texts",
+                        lambda texts, max_context_len=8191: [list(text.encode("utf-8"))[:max_context_len] for text in texts])
+    return str(tmp_path / "catalog.csv"), str(tmp_path / "store")
+
+
+def write_catalog(csv_path, names):
+    pd.DataFrame({"id": range(len(names)), "productDisplayName": names}).to_csv(csv_path, index=False)
+
+
+def run(monkeypatch, paths, embeddings, chunk_size=5):
+    monkeypatch.setattr(script, "_request_embeddings", embeddings)
+    csv_path, store_path = paths
+    return script.generate_embeddings(csv_path, "productDisplayName", store_path=store_path, chunk_size=chunk_size,
+                                      max_pending_rows=10)
+
+
+def stored(store_path):
+    metadata, matrix, _ = open_embedding_store(store_path, verify=True)
+    return dict(zip(metadata["productDisplayName"], np.array(matrix)))
+
+
+def expected_vector(text):
+    return np.asarray(FakeProvider(dim=DIM).embed(script.EMBEDDING_MODEL, [list(text.encode("utf-8"))])[0],
+                      dtype=np.float32)
+
+
+def test_first_run_embeds_every_distinct_text(monkeypatch, paths):
+    csv_path, store_path = paths
+    # Repeated texts within a chunk are embedded once
+    names = [f"Item {i}" for i in range(12)]
+    names[4] = "Item 3"
+    write_catalog(csv_path, names)
+    embeddings = FakeEmbeddings()
+    manifest = run(monkeypatch, paths, embeddings)
+
+    assert manifest["rows"] == len(names) and manifest["dim"] == DIM
+    assert embeddings.texts() == sorted(set(names))
+    metadata, matrix, _ = open_embedding_store(store_path, verify=True)
+    assert metadata["productDisplayName"].tolist() == names
+    assert CONTENT_HASH_COLUMN in metadata.columns
+    for name, vector in zip(names, matrix):
+        np.testing.assert_array_equal(vector, expected_vector(name))
+    # Cleared on success
+    assert not os.path.exists(store_path + CHECKPOINT_SUFFIX)
+
+
+def test_rerun_reuses_unchanged_rows_and_drops_deleted_ones(monkeypatch, paths):
+    csv_path, store_path = paths
+    write_catalog(csv_path, [f"Item {i}" for i in range(12)])
+    run(monkeypatch, paths, FakeEmbeddings())
+    before = stored(store_path)
+
+    # Item 4 is edited, Item 7 deleted and Item 12 added
+    names = [f"Item {i}" for i in range(12) if i != 7] + ["Item 12"]
+    names[4] = "Item 4 (navy)"
+    write_catalog(csv_path, names)
+    embeddings = FakeEmbeddings()
+    manifest = run(monkeypatch, paths, embeddings)
+
+    assert embeddings.texts() == ["Item 12", "Item 4 (navy)"]
+    assert manifest["rows"] == len(names)
+    after = stored(store_path)
+    assert list(after) == names
+    for name in names:
+        if name in before:
+            np.testing.assert_array_equal(after[name], before[name])
+    assert "Item 7" not in after and "Item 4" not in after
+
+
+def test_crash_keeps_the_previous_store_and_resumes_from_the_checkpoint(monkeypatch, paths):
+    csv_path, store_path = paths
+    write_catalog(csv_path, [f"Item {i}" for i in range(5)])
+    run(monkeypatch, paths, FakeEmbeddings())
+    previous = stored(store_path)
+
+    names = [f"Item {i}" for i in range(5)] + [f"New {i}" for i in range(20)] + ["Broken"]
+    write_catalog(csv_path, names)
+    with pytest.raises(ConnectionError):
+        run(monkeypatch, paths, FakeEmbeddings(fail_on="Broken"))
+
+    # The failed run never replaced the store
+    assert {name: vector.tolist() for name, vector in stored(store_path).items()} == \
+        {name: vector.tolist() for name, vector in previous.items()}
+    checkpoint = EmbeddingCheckpoint(store_path + CHECKPOINT_SUFFIX, script.EMBEDDING_MODEL)
+    checkpointed = checkpoint.load()
+    assert checkpointed == 20
+
+    embeddings = FakeEmbeddings()
+    run(monkeypatch, paths, embeddings)
+    # Only the text that never got a vector is paid for again
+    assert embeddings.texts() == ["Broken"]
+    after = stored(store_path)
+    assert list(after) == names
+    for name in names:
+        np.testing.assert_array_equal(after[name], expected_vector(name))
+    assert not os.path.exists(store_path + CHECKPOINT_SUFFIX)
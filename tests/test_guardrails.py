@@ -0,0 +1,112 @@
+"""
+test_guardrails.py
+Tests for batched guardrail verdicts: parsing batched responses and falling back to pairwise checks
+"""
+
+# Standard library imports
+import asyncio
+import json
+import os
+import sys
+
+# 3P imports
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+import guardrails
+from guardrails import check_matches, check_matches_async, parse_batch_verdicts
+from providers import ChatResponse, FakeProvider, set_provider
+
+
+class UnparseableBatchProvider(FakeProvider):
+    """Answers pairwise checks normally but returns prose for batched ones."""
+
+    def _respond(self, messages, task):
+        if task == "guardrail_batch":
+            return ChatResponse("Candidate 1 works, candidate 2 does not.", prompt_tokens=10, completion_tokens=10)
+        return super()._respond(messages, task)
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    monkeypatch.setattr(guardrails, "GUARDRAIL_CACHE_ENABLED", False)
+    monkeypatch.setattr(guardrails, "_verdict_cache", None)
+    guardrails.reset_guardrail_usage()
+
+
+@pytest.fixture
+def provider():
+    def install(provider):
+        previous = set_provider(provider)
+        installed.append(previous)
+        return provider
+
+    installed = []
+    yield install
+    for previous in installed:
+        set_provider(previous)
+
+
+def batch(*verdicts):
+    return json.dumps({"verdicts": [
+        {"candidate": number, "answer": answer, "reason": f"reason {number}"} for number, answer in verdicts
+    ]})
+
+
+def test_parse_batch_verdicts_orders_by_candidate():
+    verdicts = parse_batch_verdicts(batch((2, "no"), (1, "yes")), 2)
+    assert [json.loads(verdict) for verdict in verdicts] == [
+        {"answer": "yes", "reason": "reason 1"},
+        {"answer": "no", "reason": "reason 2"},
+    ]
+
+
+def test_parse_batch_verdicts_strips_json_fence():
+    assert parse_batch_verdicts(f"```json\n{batch((1, 'yes'))}\n```", 1) == ['{"answer": "yes", "reason": "reason 1"}']
+
+
+@pytest.mark.parametrize("result", [
+    None,
+    "",
+    "not json",
+    json.dumps({"answers": []}),
+    json.dumps({"verdicts": "yes"}),
+    batch((1, "yes")),                          # missing candidate 2
+    batch((1, "yes"), (2, "no"), (3, "no")),    # extra candidate
+    batch((1, "yes"), (1, "no")),               # duplicate candidate
+    batch((1, "yes"), (2, "maybe")),            # invalid answer
+    json.dumps({"verdicts": [{"candidate": "one", "answer": "yes"}, {"candidate": 2, "answer": "no"}]}),
+])
+def test_parse_batch_verdicts_rejects_incomplete_responses(result):
+    assert parse_batch_verdicts(result, 2) is None
+
+
+def test_check_matches_agrees_with_pairwise(provider):
+    fake = provider(FakeProvider(yes_rate=0.5))
+    images = [f"candidate-{i}" for i in range(4)]
+    batched = check_matches("reference", images)
+    assert fake.stats()["chat"] == 1
+    assert batched == [guardrails.check_match("reference", image) for image in images]
+    assert guardrails.guardrail_usage_stats()["fallbacks"] == 0
+
+
+def test_check_matches_falls_back_to_pairwise_when_unparseable(provider):
+    fake = provider(UnparseableBatchProvider(yes_rate=0.5))
+    images = [f"candidate-{i}" for i in range(3)]
+    results = check_matches("reference", images)
+    # One batched call, then one check_match per candidate
+    assert fake.stats()["chat"] == 1 + len(images)
+    assert guardrails.guardrail_usage_stats()["fallbacks"] == 1
+    provider(FakeProvider(yes_rate=0.5))
+    assert results == [guardrails.check_match("reference", image) for image in images]
+
+
+def test_check_matches_async_falls_back_to_pairwise_when_unparseable(provider):
+    fake = provider(UnparseableBatchProvider(yes_rate=0.5))
+    images = [f"candidate-{i}" for i in range(3)]
+    results = asyncio.run(check_matches_async("reference", images))
+    assert fake.stats()["chat"] == 1 + len(images)
+    assert guardrails.guardrail_usage_stats()["fallbacks"] == 1
+    assert results == check_matches("reference", images)
@@ -0,0 +1,151 @@
+"""
+test_pipeline.py
+Regression tests for the async recommendation pipeline on the offline fake model backend
+"""
+
+# Standard library imports
+import asyncio
+import os
+import sys
+
+# 3P imports
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+import analysis
+import embedding_cache
+import guardrails
+from filter_index import complementary_filter
+from pipeline import recommend
+from providers import FakeProvider, hash_embedding, set_provider
+from search_similar_items import CatalogSearchEngine
+
+DIM = 8
+
+
+class DroppedStreamProvider(FakeProvider):
+    """Streams the start of an analysis with two complete items, then loses the connection."""
+
+    async def chat_stream_async(self, model, messages, task=None, usage=None, **options):
+        yield '{"items": ["Black Jeans", "White Shirt", '
+        raise ConnectionError("connection dropped")
+
+
+@pytest.fixture
+def catalog():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        "id": np.arange(1, 21),
+        "gender": ["Men", "Women"] * 10,
+        "articleType": ["Jeans", "Shirts", "Belts", "Jackets"] * 5,
+        "productDisplayName": [f"Item {i}" for i in range(1, 21)],
+    })
+    df["embeddings"] = list(rng.standard_normal((len(df), DIM)).astype(np.float32))
+    return df, CatalogSearchEngine.from_dataframe(df)
+
+
+@pytest.fixture(autouse=True)
+def no_caches(monkeypatch):
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_ENABLED", False)
+    monkeypatch.setattr(embedding_cache, "_default_cache", None)
+    monkeypatch.setattr(analysis, "ANALYSIS_CACHE_ENABLED", False)
+    monkeypatch.setattr(analysis, "_analysis_cache", None)
+    monkeypatch.setattr(guardrails, "GUARDRAIL_CACHE_ENABLED", False)
+    monkeypatch.setattr(guardrails, "_verdict_cache", None)
+
+
+def run_pipeline(df, engine, streaming, timeout=10, **options):
+    async def collect():
+        events = []
+        options.setdefault("target_matches", None)
+        stream = recommend("reference", ["Jeans", "Shirts", "Belts", "Jackets"], df, engine, threshold=-1.0,
+                           top_k=1, candidate_image=lambda item: f"candidate-{item['id']}", streaming=streaming,
+                           **options)
+        async for event in stream:
+            events.append(event)
+        return events
+
+    return asyncio.run(asyncio.wait_for(collect(), timeout))
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_pipeline_completes_on_fake_provider(catalog, streaming):
+    df, engine = catalog
+    previous = set_provider(FakeProvider(dim=DIM))
+    try:
+        events = run_pipeline(df, engine, streaming)
+    finally:
+        set_provider(previous)
+    assert events[-1]["type"] == "done"
+    assert not [event for event in events if event["type"] == "error"]
+    verdicts = [event for event in events if event["type"] == "verdict"]
+    assert events[-1]["matches"] == len(verdicts) > 0
+
+
+def test_stream_failure_after_items_ends_with_done(catalog):
+    df, engine = catalog
+    previous = set_provider(DroppedStreamProvider(dim=DIM))
+    try:
+        events = run_pipeline(df, engine, streaming=True)
+    finally:
+        set_provider(previous)
+    types = [event["type"] for event in events]
+    assert types.count("analysis_item") == 2
+    errors = [event for event in events if event["type"] == "error"]
+    assert [error["stage"] for error in errors] == ["analysis"]
+    assert "connection dropped" in errors[0]["error"]
+    assert types[-1] == "done"
+    assert events[-1]["matches"] == 0
+
+
+def test_unstreamed_descriptions_share_one_embedding_request(catalog):
+    df, engine = catalog
+    provider = FakeProvider(dim=DIM)
+    previous = set_provider(provider)
+    try:
+        events = run_pipeline(df, engine, streaming=False)
+    finally:
+        set_provider(previous)
+    assert provider.stats()["embed"] == 1
+    analysis = next(event["analysis"] for event in events if event["type"] == "analysis")
+    expected = engine.search_many(
+        [hash_embedding(description, DIM) for description in analysis["items"]], threshold=-1.0, top_k=1,
+        unique=True, filters=complementary_filter(analysis["gender"], analysis["category"]),
+    )
+    matches = [event for event in events if event["type"] == "match"]
+    assert [event["item"]["id"] for event in matches] == [df.iloc[i]["id"] for indices in expected for i in indices]
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_batched_verification_matches_pairwise(catalog, streaming):
+    df, engine = catalog
+    verdicts = {}
+    for batch_size in (1, 2):
+        provider = FakeProvider(dim=DIM)
+        previous = set_provider(provider)
+        try:
+            events = run_pipeline(df, engine, streaming, batch_size=batch_size)
+        finally:
+            set_provider(previous)
+        verdicts[batch_size] = {event["item"]["id"]: event["verdict"] for event in events if event["type"] == "verdict"}
+        matches = events[-1]["matches"]
+        assert len(verdicts[batch_size]) == matches == 3
+        # One call (or stream) for the analysis plus one guardrail call per group of candidates
+        calls = provider.stats()
+        assert calls["chat"] + calls["chat_stream"] == 1 + -(-matches // batch_size)
+    assert verdicts[1] == verdicts[2]
+
+
+def test_batched_verification_stops_at_target(catalog):
+    df, engine = catalog
+    previous = set_provider(FakeProvider(dim=DIM, yes_rate=1.0))
+    try:
+        events = run_pipeline(df, engine, streaming=False, batch_size=2, target_matches=1)
+    finally:
+        set_provider(previous)
+    assert events[-1]["type"] == "done"
+    assert events[-1]["compatible"] == 1
@@ -0,0 +1,178 @@
+"""
+test_rate_limiter.py
+Deterministic tests for AdaptiveConcurrencyLimiter: AIMD limit changes, sliding RPM/TPM windows and
+header-driven blocking, on a fake clock
+"""
+
+# Standard library imports
+import os
+import sys
+
+# 3P imports
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+import rate_limiter
+from rate_limiter import AdaptiveConcurrencyLimiter, parse_duration, retry_after_seconds
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def make_limiter(clock, **options):
+    options.setdefault("initial", 16)
+    options.setdefault("max_concurrency", 32)
+    limiter = AdaptiveConcurrencyLimiter(headroom=1.0, **options)
+    # A blocked acquire "sleeps" by advancing the fake clock by its timeout
+    limiter._condition.wait = lambda timeout=None: clock.sleep(timeout)
+    return limiter
+
+
+def waited(clock, limiter, tokens=0):
+    """Seconds of fake time acquire(tokens) blocked for; the slot is released again immediately."""
+    start = clock.now
+    limiter.acquire(tokens)
+    limiter.release(tokens)
+    return clock.now - start
+
+
+@pytest.mark.parametrize("value, seconds", [
+    (None, None), ("", None), ("1s", 1.0), ("20ms", 0.02), ("6m0s", 360.0), ("1h2m3.5s", 3723.5), ("2.5", 2.5),
+])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == seconds
+
+
+def test_retry_after_prefers_milliseconds():
+    assert retry_after_seconds({"retry-after-ms": "250", "retry-after": "3"}) == 0.25
+    assert retry_after_seconds({"retry-after": "3"}) == 3.0
+    assert retry_after_seconds(None) is None
+
+
+def test_limit_halves_once_per_429_cooldown(clock):
+    limiter = make_limiter(clock)
+    for _ in range(7):
+        limiter.acquire()
+    # A burst of 429s for requests that were already in flight together
+    for _ in range(6):
+        limiter.release(headers={"retry-after": "2"}, throttled=True)
+    assert limiter.limit == 8
+    assert limiter.throttled == 6
+
+    # A late 429 from the same burst, still inside the cooldown: no further halving
+    clock.sleep(1.5)
+    limiter.release(headers={"retry-after": "2"}, throttled=True)
+    assert limiter.limit == 8
+
+    # After the cooldown a new 429 halves again, never below min_concurrency
+    clock.sleep(2.5)
+    for expected in (4, 2, 1, 1):
+        limiter.acquire()
+        limiter.release(headers={"retry-after": "2"}, throttled=True)
+        assert limiter.limit == expected
+        clock.sleep(2.1)
+
+
+def test_429_pauses_new_requests_until_retry_after(clock):
+    limiter = make_limiter(clock)
+    limiter.acquire()
+    limiter.release(headers={"retry-after-ms": "1500"}, throttled=True)
+    assert waited(clock, limiter) == pytest.approx(1.5)
+
+
+def test_additive_increase_after_a_round_of_successes(clock):
+    limiter = make_limiter(clock, initial=4)
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    assert 4.9 < limiter.limit < 5.0
+    assert limiter.requests == 4
+
+    limiter = make_limiter(clock, initial=31.9)
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 32
+
+
+def test_requests_per_minute_window_slides(clock):
+    limiter = make_limiter(clock, requests_per_minute=3)
+    for _ in range(3):
+        assert waited(clock, limiter) == 0
+        clock.sleep(10)
+    # The 4th request waits for the first to leave the one-minute window (started at t=0, now t=30)
+    assert waited(clock, limiter) == pytest.approx(30)
+    # The window now holds requests from t=10, t=20 and t=60
+    assert waited(clock, limiter) == pytest.approx(10)
+
+
+def test_tokens_per_minute_window_waits_for_enough_tokens_to_expire(clock):
+    limiter = make_limiter(clock, tokens_per_minute=1000)
+    assert waited(clock, limiter, 400) == 0
+    clock.sleep(5)
+    assert waited(clock, limiter, 400) == 0
+    clock.sleep(5)
+    # 800 of 1000 used; 500 more needs the first request (t=0) to expire, not the second
+    assert waited(clock, limiter, 500) == pytest.approx(50)
+
+
+def test_request_larger_than_the_token_budget_waits_for_an_empty_window(clock):
+    limiter = make_limiter(clock, tokens_per_minute=1000)
+    waited(clock, limiter, 300)
+    clock.sleep(10)
+    waited(clock, limiter, 300)
+    clock.sleep(10)
+    # Waits until the newest request (t=10) has left the window, then runs alone
+    assert waited(clock, limiter, 5000) == pytest.approx(50)
+    # With an empty window it does not wait at all
+    clock.sleep(60)
+    assert waited(clock, limiter, 5000) == 0
+
+
+def test_exhausted_request_header_blocks_until_reset(clock):
+    limiter = make_limiter(clock)
+    limiter.acquire()
+    limiter.release(headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "2s"})
+    assert waited(clock, limiter) == pytest.approx(2)
+
+
+def test_exhausted_token_header_blocks_until_reset(clock):
+    limiter = make_limiter(clock)
+    limiter.acquire(500)
+    limiter.release(500, headers={"x-ratelimit-remaining-tokens": "100", "x-ratelimit-reset-tokens": "750ms"})
+    assert waited(clock, limiter, 200) == pytest.approx(0.75)
+
+
+def test_limits_are_learned_from_headers(clock):
+    limiter = make_limiter(clock)
+    limiter.acquire(10)
+    limiter.release(10, headers={"x-ratelimit-limit-requests": "500", "x-ratelimit-limit-tokens": "1000000"})
+    assert (limiter.requests_per_minute, limiter.tokens_per_minute) == (500, 1000000)
+    assert limiter.stats()["requests_per_minute"] == 500
+
+
+def test_concurrency_limit_blocks_until_a_release(clock):
+    limiter = make_limiter(clock, initial=2)
+    limiter.acquire()
+    limiter.acquire()
+    assert limiter._wait_seconds(clock.now, 0) > 0
+    limiter.release()
+    assert limiter._wait_seconds(clock.now, 0) <= 0
+    assert limiter.stats()["peak_concurrency"] == 2
@@ -0,0 +1,91 @@
+"""
+test_similarity.py
+Correctness of partial top-k selection and exact catalog search against a brute-force cosine sort
+"""
+
+# Standard library imports
+import os
+import sys
+
+# 3P imports
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# Local application imports
+from search_similar_items import CatalogSearchEngine
+from similarity import select_top_k
+
+DIM = 16
+
+
+def brute_top_k(scores, threshold, top_k, rows=None):
+    """Stable full sort: best score first, ties by lower position."""
+    rows = range(len(scores)) if rows is None else rows
+    ranked = sorted((i for i in rows if scores[i] >= threshold), key=lambda i: (-scores[i], i))
+    return ranked[:max(top_k, 0)]
+
+
+def sparse_unit_vectors(count, seed):
+    """
+    Unit vectors with four components of +-0.5: every cosine similarity is an exact multiple of 0.25 in
+    float32, so there are many exact ties and no rounding differences from the brute-force reference.
+    """
+    rng = np.random.default_rng(seed)
+    vectors = np.zeros((count, DIM), dtype=np.float32)
+    for vector in vectors:
+        vector[rng.choice(DIM, 4, replace=False)] = rng.choice([-0.5, 0.5], 4)
+    return vectors
+
+
+def cosine(query, vector):
+    norms = float(np.linalg.norm(query)) * float(np.linalg.norm(vector))
+    return float(np.dot(query.astype(np.float64), vector.astype(np.float64))) / norms if norms else float("nan")
+
+
+@pytest.mark.parametrize("top_k", [0, 1, 3, 10, 50, 200])
+@pytest.mark.parametrize("threshold", [-np.inf, 0.0, 0.5, 2.0])
+def test_select_top_k_matches_a_stable_sort(top_k, threshold):
+    rng = np.random.default_rng(top_k)
+    # Few distinct values, so ties straddle the k-th position
+    scores = rng.integers(-4, 5, size=100).astype(np.float32) / 4
+    assert select_top_k(scores, threshold, top_k) == brute_top_k(scores, threshold, top_k)
+
+
+def test_select_top_k_skips_nan_scores():
+    scores = np.array([0.5, np.nan, 0.9, np.nan, 0.5], dtype=np.float32)
+    assert select_top_k(scores, -np.inf, 10) == [2, 0, 4]
+
+
+@pytest.mark.parametrize("top_k", [1, 2, 5, 300])
+@pytest.mark.parametrize("threshold", [-1.0, 0.0, 0.5])
+def test_exact_search_matches_brute_force_cosine(top_k, threshold):
+    catalog = sparse_unit_vectors(200, seed=1)
+    # Unnormalized copies and a zero vector: cosine ignores scale, and a zero vector never matches
+    catalog[10] = catalog[3] * 3
+    catalog[20] = 0
+    engine = CatalogSearchEngine(catalog)
+    for query in sparse_unit_vectors(10, seed=2) * 2:
+        scores = [cosine(query, vector) for vector in catalog]
+        expected = brute_top_k(scores, threshold, top_k)
+        assert engine.search(query, threshold=threshold, top_k=top_k) == expected
+        assert 20 not in expected
+
+
+def test_search_many_unique_matches_sequential_brute_force():
+    catalog = sparse_unit_vectors(60, seed=3)
+    queries = sparse_unit_vectors(5, seed=4)
+    queries[3] = queries[1]
+    engine = CatalogSearchEngine(catalog)
+    results = engine.search_many(queries, threshold=0.0, top_k=3, unique=True)
+
+    taken = set()
+    for query, result in zip(queries, results):
+        scores = [cosine(query, vector) for vector in catalog]
+        expected = brute_top_k(scores, 0.0, 3, rows=[i for i in range(len(catalog)) if i not in taken])
+        assert result == expected
+        taken.update(expected)
+    assert engine.search_many(queries, threshold=0.0, top_k=3) == [
+        engine.search(query, threshold=0.0, top_k=3) for query in queries
+    ]